@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -28,7 +29,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'store.middleware.StaticFilesMiddleware',  # WhiteNoise, async-capable under ASGI
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -50,7 +51,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'store.context_processors.cart',  # if using a custom one
+                'store.context_processors.cart_item_count',
+                'store.context_processors.wishlist_count',
             ],
         },
     },
@@ -58,6 +60,7 @@ TEMPLATES = [
 
 
 WSGI_APPLICATION = 'ecommerce.wsgi.application'
+ASGI_APPLICATION = 'ecommerce.asgi.application'   # served by gunicorn + uvicorn workers (see Procfile)
 
 # Redirect settings for login-required views
 LOGIN_URL = '/login/'
@@ -80,6 +83,10 @@ EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Outbound email queue (store.mailer), sent by the job workers over one connection per run
+STORE_EMAIL_BATCH_SIZE = 50         # emails claimed and sent per batch
+STORE_EMAIL_MAX_ATTEMPTS = 5        # tries before a transient send failure gives up
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -99,13 +106,125 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'  # Required by Render
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Media: product and profile images are saved under content-hashed names
+# (served with immutable caching by the media view). Static files use
+# WhiteNoise's compressed, manifest-hashed storage, which needs collectstatic
+# to have run; the test suite doesn't, so it falls back to plain storage.
+STORAGES = {
+    "default": {"BACKEND": "store.storage.MediaStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
+if sys.argv[1:2] == ["test"]:
+    STORAGES["staticfiles"] = {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"}
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Catalog listing (keyset pagination)
+STORE_PAGE_SIZE = int(os.getenv("STORE_PAGE_SIZE", "24"))
+STORE_MAX_PAGE_SIZE = int(os.getenv("STORE_MAX_PAGE_SIZE", "96"))
+
+# Product search: "auto" uses SQLite FTS5 when available, else the in-memory index
+STORE_SEARCH_BACKEND = os.getenv("STORE_SEARCH_BACKEND", "auto")
+STORE_SEARCH_MAX_RESULTS = 1000
+
+# Price facet bucket edges in rupees (run `manage.py rebuild_facets` after changing)
+STORE_PRICE_BUCKETS = [0, 500, 1000, 5000, 10000]
+
+# Rows per bulk_create batch in the CSV product importer
+STORE_IMPORT_BATCH_SIZE = 1000
+
+# Remote image downloads during CSV import
+STORE_IMAGE_FETCH_WORKERS = 8       # thread pool size (and HTTP connection pool size)
+STORE_IMAGE_FETCH_PER_HOST = 4      # max concurrent requests to any single host
+STORE_IMAGE_FETCH_TIMEOUT = 10      # seconds, per request
+STORE_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+
+# Cached per-user cart/wishlist counts shown in the navbar (seconds). Writes
+# drop them at once in the shared cache; with STORE_CATALOG_CACHE="locmem"
+# (see CACHES below) this is how long another process can show an old count.
+STORE_COUNT_CACHE_TIMEOUT = 300
+
+# Product page review feed: reviews per page, and how long a cached page is
+# kept (pages are invalidated on every review write regardless)
+STORE_REVIEW_PAGE_SIZE = 10
+STORE_REVIEW_CACHE_TIMEOUT = 600
+
+# Resized product images (store.images): widths in pixels, formats best first.
+# AVIF is skipped where the installed Pillow can't encode it.
+STORE_IMAGE_WIDTHS = (240, 480, 960)
+STORE_IMAGE_FORMATS = ('avif', 'webp')
+
+# Cached shared part of the product page; keyed on Product.updated_at, so the
+# timeout only bounds memory use, not staleness
+STORE_PRODUCT_CACHE_TIMEOUT = 3600
+
+# Caches. "default" holds the per-user navbar counts, review feed pages and
+# product page fragments; "catalog" holds the versioned catalog read cache
+# (store.catalog_cache). STORE_CATALOG_CACHE picks the backend of both:
+# "file" (the default) is shared by every process on one host, so the web
+# workers and the run_jobs worker see each other's invalidations; use "redis"
+# (needs the redis package; REDIS_URL) across hosts. "locmem" is per process,
+# so other processes show stale entries until they time out; the test suite
+# uses it.
+STORE_CATALOG_CACHE = os.getenv("STORE_CATALOG_CACHE", "locmem" if sys.argv[1:2] == ["test"] else "file")
+STORE_CACHE_DIR = Path(os.getenv("STORE_CACHE_DIR", BASE_DIR / "cache"))
+CACHE_BACKENDS = {
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    "redis": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/1"),
+    },
+}
+
+
+def cache_backend(name):
+    backend = dict(CACHE_BACKENDS[STORE_CATALOG_CACHE])
+    if STORE_CATALOG_CACHE == "locmem":
+        backend["LOCATION"] = f"store-{name}"
+    elif STORE_CATALOG_CACHE == "file":
+        backend["LOCATION"] = str(STORE_CACHE_DIR / name)
+    else:
+        backend["KEY_PREFIX"] = name
+    return backend
+
+
+CACHES = {
+    "default": cache_backend("default"),
+    "catalog": cache_backend("catalog"),
+}
+STORE_CATALOG_CACHE_TIMEOUT = 3600   # seconds; writes change the keys, so this only bounds memory use
+STORE_CATALOG_LOCK_TIMEOUT = 5       # seconds other readers wait for one reader's rebuild
+
+# Background job queue (run workers with `python manage.py run_jobs`)
+STORE_JOB_POLL_INTERVAL = 1.0       # seconds an idle worker waits between polls
+STORE_JOB_RETRY_BACKOFF = 30        # seconds before the first retry; doubles per attempt
+STORE_JOB_HEARTBEAT_INTERVAL = 30   # seconds between lock refreshes while a job runs
+STORE_JOB_LOCK_TIMEOUT = 600        # seconds without a refresh before a running job is presumed orphaned
+
+# Stock held for an unpaid order is released after this many seconds
+# (by the job workers' sweep, or `python manage.py release_expired_holds`)
+STORE_STOCK_HOLD_TTL = int(os.getenv('STORE_STOCK_HOLD_TTL', 15 * 60))
+
 # Razorpay API Keys from environment
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
+RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET", "")
+
+# Payment gateway: 'razorpay', 'fake' (in-process, for development), or a
+# dotted path to a store.payments.PaymentGateway subclass
+STORE_PAYMENT_GATEWAY = os.getenv('STORE_PAYMENT_GATEWAY', 'razorpay')
+STORE_PAYMENT_TIMEOUT = (3.05, 10)      # connect/read seconds for gateway API calls
+STORE_PAYMENT_POOL_SIZE = 10            # keep-alive connections to the gateway per process
+STORE_PAYMENT_BREAKER_THRESHOLD = 5     # consecutive failures before failing fast
+STORE_PAYMENT_BREAKER_RESET = 30        # seconds before a trial call is let through
+STORE_FAKE_GATEWAY_LATENCY = 0          # simulated seconds per call for the 'fake' gateway
 
 # CSRF Trusted Origins (update your Render URL accordingly)
 CSRF_TRUSTED_ORIGINS = [
@@ -1,13 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+
+from store.views import media
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('', include('store.urls')),  # All URLs handled by store
+    # Media in every environment, with long-lived caching for content-hashed names
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:path>", media, name='media'),
 ]
-
-# Serve media files during development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -5,7 +5,7 @@ from .models import (
     Address, Order, OrderItem,
     Profile, Review,
     Coupon, Shipment,
-    StoreProfile, PaymentWebhook
+    StoreProfile, PaymentWebhook, Job, StockHold, OutboundEmail
 )
 
 
@@ -64,6 +64,7 @@ class AddressAdmin(admin.ModelAdmin):
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
+    readonly_fields = ['line_total']
 
 
 @admin.register(Order)
@@ -109,7 +110,33 @@ class ShipmentAdmin(admin.ModelAdmin):
 
 @admin.register(PaymentWebhook)
 class PaymentWebhookAdmin(admin.ModelAdmin):
-    list_display = ['gateway', 'event_type', 'received_at']
-    list_filter = ['gateway', 'event_type']
-    search_fields = ['event_type']
-    readonly_fields = ['gateway', 'event_type', 'payload', 'received_at']
+    list_display = ['gateway', 'event_type', 'event_id', 'status', 'attempts', 'received_at']
+    list_filter = ['gateway', 'event_type', 'status']
+    search_fields = ['event_type', 'event_id']
+    readonly_fields = ['gateway', 'event_id', 'event_type', 'payload', 'occurred_at', 'attempts',
+                       'claimed_at', 'processed_at', 'last_error', 'received_at']
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'to', 'order', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['kind', 'status']
+    search_fields = ['to', 'order__id']
+    readonly_fields = ['kind', 'order', 'to', 'attempts', 'send_after', 'claimed_at', 'sent_at',
+                       'last_error', 'created_at']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'task', 'status', 'priority', 'attempts', 'run_at', 'finished_at']
+    list_filter = ['status', 'priority', 'task']
+    search_fields = ['task', 'id']
+    readonly_fields = ['created_at', 'finished_at', 'locked_by', 'locked_at', 'result', 'last_error']
+
+
+@admin.register(StockHold)
+class StockHoldAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order', 'product', 'quantity', 'status', 'expires_at']
+    list_filter = ['status']
+    search_fields = ['order__id', 'product__name']
+    raw_id_fields = ['order', 'product']
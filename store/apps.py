@@ -5,4 +5,5 @@ class StoreConfig(AppConfig):
     name = 'store'
 
     def ready(self):
-        import store.signals
\ No newline at end of file
+        import store.signals
+        import store.tasks
\ No newline at end of file
@@ -0,0 +1,151 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CartItem, Product
+from .context_processors import invalidate_cart_count
+
+
+class OutOfStock(Exception):
+    pass
+
+
+# ---------------- Cart service ----------------
+
+def parse_quantities(data):
+    """
+    Extracts {cart_item_id: quantity} from submitted data. Accepts
+    `quantity_<item_id>` fields, or a single `item_id` + `quantity` pair.
+    Unparseable values are ignored.
+    """
+    quantities = {}
+    for key, value in data.items():
+        if key.startswith('quantity_'):
+            item_id = key[len('quantity_'):]
+            try:
+                quantities[int(item_id)] = int(value)
+            except (TypeError, ValueError):
+                continue
+    if not quantities and data.get('item_id') is not None:
+        try:
+            quantities[int(data['item_id'])] = int(data.get('quantity', 1))
+        except (TypeError, ValueError):
+            pass
+    return quantities
+
+
+# Insert the line, or add to it if it exists, in one statement. Both branches
+# only apply if the product has stock for the resulting quantity; otherwise
+# no row is returned.
+UPSERT_SQL = """
+    INSERT INTO store_cartitem (user_id, product_id, quantity, created_at)
+    SELECT %s, p.id, %s, %s FROM store_product p WHERE p.id = %s AND p.stock >= %s
+    ON CONFLICT (user_id, product_id) DO UPDATE
+        SET quantity = store_cartitem.quantity + excluded.quantity
+        WHERE (SELECT stock FROM store_product WHERE id = excluded.product_id)
+              >= store_cartitem.quantity + excluded.quantity
+    RETURNING quantity
+"""
+
+
+def _add_with_upsert(user_id, product_id, quantity):
+    with connection.cursor() as cursor:
+        created_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        cursor.execute(UPSERT_SQL, [user_id, quantity, created_at, product_id, quantity])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _add_with_conditional_update(user_id, product_id, quantity):
+    # For databases without INSERT ... ON CONFLICT: increment atomically in
+    # SQL, then fall back to an insert if there was no line yet.
+    lines = CartItem.objects.filter(
+        user_id=user_id, product_id=product_id, product__stock__gte=F('quantity') + quantity
+    )
+    with transaction.atomic():
+        if lines.update(quantity=F('quantity') + quantity):
+            return CartItem.objects.filter(user_id=user_id, product_id=product_id).values_list('quantity', flat=True).first()
+        if CartItem.objects.filter(user_id=user_id, product_id=product_id).exists():
+            return None
+        if not Product.objects.filter(id=product_id, stock__gte=quantity).exists():
+            return None
+        CartItem.objects.create(user_id=user_id, product_id=product_id, quantity=quantity)
+        return quantity
+
+
+def add_item(user, product_id, quantity=1):
+    """
+    Adds `quantity` of a product to the user's cart without a read-modify-write,
+    so concurrent adds never lose increments. Returns the line's new quantity.
+
+    Raises Product.DoesNotExist for an unknown product and OutOfStock when
+    the resulting quantity would exceed the product's stock.
+    """
+    quantity = max(1, int(quantity))
+    if connection.vendor in ('sqlite', 'postgresql'):
+        new_quantity = _add_with_upsert(user.pk, product_id, quantity)
+    else:
+        new_quantity = _add_with_conditional_update(user.pk, product_id, quantity)
+
+    if new_quantity is None:
+        product = Product.objects.only('name', 'stock').get(id=product_id)
+        raise OutOfStock(f"Only {product.stock} of {product.name} in stock.")
+    # The upsert bypasses post_save, so drop the cached navbar count here.
+    invalidate_cart_count(user.pk)
+    return new_quantity
+
+
+def cart_total(items):
+    return sum((item.product.price * item.quantity for item in items), Decimal('0.00'))
+
+
+def update_quantities(user, quantities):
+    """
+    Applies submitted cart quantities in one transaction and returns a delta
+    describing what changed.
+
+    Only lines whose quantity actually changed are written, all with a
+    single bulk_update; lines set to 0 are deleted. A line asking for more
+    than the product's stock is left unchanged and reported in `errors`.
+    """
+    with transaction.atomic():
+        items = list(
+            CartItem.objects.select_for_update()
+            .filter(user=user)
+            .select_related('product')
+            .order_by('id')
+        )
+        changed, removed, errors = [], [], {}
+        for item in items:
+            if item.id not in quantities:
+                continue
+            quantity = quantities[item.id]
+            if quantity == item.quantity:
+                continue
+            if quantity <= 0:
+                removed.append(item)
+            elif quantity > item.product.stock:
+                errors[item.id] = f"Only {item.product.stock} of {item.product.name} in stock."
+            else:
+                item.quantity = quantity
+                changed.append(item)
+
+        if changed:
+            CartItem.objects.bulk_update(changed, ['quantity'])
+        if removed:
+            CartItem.objects.filter(id__in=[item.id for item in removed]).delete()
+
+    removed_ids = {item.id for item in removed}
+    remaining = [item for item in items if item.id not in removed_ids]
+    return {
+        'updated': {
+            item.id: {'quantity': item.quantity, 'line_total': str(item.product.price * item.quantity)}
+            for item in changed
+        },
+        'removed': sorted(removed_ids),
+        'errors': errors,
+        'total': str(cart_total(remaining)),
+        'item_count': len(remaining),
+    }
@@ -0,0 +1,188 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .facets import filter_products
+from .models import Category, Product, ProductTag, ProductVariant, Tag
+from .pagination import decode_cursor, paginate_keyset
+
+# ---------------- Catalog read cache ----------------
+# Catalog reads that most pages repeat are cached in the "catalog" cache
+# (settings.CACHES) under keys that embed the current generation of every
+# model they were built from. Writing one of those models bumps its
+# generation (see store.signals), after which readers look up new keys; the
+# old entries are never read again and just expire.
+#
+# Generations are stamped with time.time_ns() rather than incremented, so
+# concurrent bumps on a backend without an atomic incr (the file cache)
+# can't lose one, and a generation that was evicted can't restart at a
+# value older entries are still stored under.
+#
+# On a miss one reader takes a short lock and rebuilds the entry; other
+# readers of the same key wait for its result instead of all querying.
+
+CACHE_ALIAS = 'catalog'
+TIMEOUT = getattr(settings, 'STORE_CATALOG_CACHE_TIMEOUT', 3600)
+LOCK_TIMEOUT = getattr(settings, 'STORE_CATALOG_LOCK_TIMEOUT', 5)
+WAIT_INTERVAL = 0.02
+
+READS = ('categories', 'tag_names', 'variants', 'product_tags', 'listing')
+METRICS = ('hit', 'miss', 'wait')
+
+# Listing filters on columns that change by queryset update() on every order
+# and review (stock, average_rating), which don't send signals. Those pages
+# are read straight from the database.
+UNCACHED_FILTERS = ('rating', 'availability')
+
+_MISSING = object()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+# ---------------- Generations ----------------
+
+def _generation_key(scope):
+    return f"store:catalog:generation:{scope}"
+
+
+def generations(scopes):
+    cache = get_cache()
+    keys = [_generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    """
+    Starts a new generation of each scope now, so the writer's own
+    transaction reads fresh data, and again once it commits, which orphans
+    anything another reader cached from the pre-commit rows in between.
+    """
+    def stamp():
+        get_cache().set_many({_generation_key(scope): time.time_ns() for scope in scopes}, None)
+
+    stamp()
+    transaction.on_commit(stamp)
+
+
+# ---------------- Metrics ----------------
+
+def _metric_key(read, metric):
+    return f"store:catalog:metric:{read}:{metric}"
+
+
+def _count(read, metric):
+    cache = get_cache()
+    key = _metric_key(read, metric)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def stats():
+    """
+    Hit, miss and wait counts per read, summed over every process sharing
+    the cache. A wait is a miss that was served by another reader's rebuild.
+    """
+    keys = {(read, metric): _metric_key(read, metric) for read in READS for metric in METRICS}
+    found = get_cache().get_many(keys.values())
+    result = {}
+    for read in READS:
+        counts = {metric: found.get(keys[read, metric], 0) for metric in METRICS}
+        total = sum(counts.values())
+        counts['hit_rate'] = round(100 * (counts['hit'] + counts['wait']) / total, 1) if total else None
+        result[read] = counts
+    return result
+
+
+def reset_stats():
+    get_cache().delete_many([_metric_key(read, metric) for read in READS for metric in METRICS])
+
+
+# ---------------- Reading ----------------
+
+def cached(read, scopes, build, *parts):
+    """
+    Returns build()'s result, cached under the current generations of
+    `scopes` and the given key `parts`.
+    """
+    cache = get_cache()
+    variant = hashlib.md5(repr(parts).encode()).hexdigest() if parts else ''
+    key = f"store:catalog:{read}:{':'.join(map(str, generations(scopes)))}:{variant}"
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _count(read, 'hit')
+        return value
+
+    lock = f"{key}:lock"
+    locked = cache.add(lock, 1, LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                _count(read, 'wait')
+                return value
+        # The reader holding the lock died or is stuck; build it ourselves.
+
+    _count(read, 'miss')
+    try:
+        value = build()
+        cache.set(key, value, TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock)
+    return value
+
+
+def categories():
+    return cached('categories', ('category',), lambda: list(Category.objects.order_by('name')))
+
+
+def tag_names():
+    """{str(tag id): name} for every tag."""
+    return cached('tag_names', ('tag',), lambda: {str(pk): name for pk, name in Tag.objects.values_list('id', 'name')})
+
+
+def variants(product_id):
+    return cached(
+        'variants', ('variant',),
+        lambda: list(ProductVariant.objects.filter(product_id=product_id).order_by('id')),
+        product_id,
+    )
+
+
+def product_tags(product_id):
+    """The names of a product's tags, alphabetically."""
+    return cached(
+        'product_tags', ('tag',),
+        lambda: list(ProductTag.objects.filter(product_id=product_id).order_by('tag__name').values_list('tag__name', flat=True)),
+        product_id,
+    )
+
+
+def listing_page(selected, cursor, page_size):
+    """
+    One keyset page of listed products, newest first, narrowed by the
+    selected facets (see store.facets), as shown by home and product_list.
+    """
+    def build():
+        return paginate_keyset(filter_products(Product.objects.listed(), selected), cursor, page_size)
+
+    if any(name in selected for name in UNCACHED_FILTERS):
+        return build()
+    if decode_cursor(cursor) is None:
+        cursor = None
+    return cached('listing', ('product', 'tag'), build, sorted(selected.items()), cursor, page_size)
@@ -0,0 +1,128 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CartItem, Order, OrderItem, Product
+from .inventory import InsufficientStock, confirm_holds, reserve
+from . import mailer, tasks
+
+MINIMUM_ORDER_TOTAL = Decimal('1.00')
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class CheckoutLine:
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.price = product.price      # unit price snapshot, taken once per checkout
+
+    @property
+    def line_total(self):
+        return self.price * self.quantity
+
+
+def load_cart_lines(user):
+    """
+    Returns the user's cart as CheckoutLines, with products, in one query.
+    """
+    items = CartItem.objects.filter(user=user).select_related('product').order_by('id')
+    return [CheckoutLine(item.product, item.quantity) for item in items]
+
+
+def load_buy_now_line(buy_now_item):
+    product = Product.objects.filter(id=buy_now_item['product_id']).first()
+    if product is None:
+        return []
+    return [CheckoutLine(product, max(1, int(buy_now_item['quantity'])))]
+
+
+def order_total(lines):
+    total = sum((line.line_total for line in lines), Decimal('0.00'))
+    return total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def place_order(user, address, lines, clear_cart=True):
+    """
+    Creates the order for `lines` in one short transaction: saves the
+    shipping address, creates the order and its items, places stock holds
+    for them and clears the cart. Either everything is written or nothing is.
+    """
+    if not lines:
+        raise CheckoutError("Your cart is empty.")
+    total = order_total(lines)
+    if total < MINIMUM_ORDER_TOTAL:
+        raise CheckoutError(f"Minimum order amount must be ₹{MINIMUM_ORDER_TOTAL}.")
+
+    try:
+        with transaction.atomic():
+            address.user = user
+            address.address_type = 'shipping'
+            address.save()
+
+            order = Order.objects.create(user=user, shipping_address=address, total_price=total)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=line.product, quantity=line.quantity, product_name=line.product.name,
+                          price=line.price, line_total=line.line_total)
+                for line in lines
+            ])
+            reserve(order, lines)
+            if clear_cart:
+                CartItem.objects.filter(user=user).delete()
+    except InsufficientStock as e:
+        raise CheckoutError(str(e))
+    return order
+
+
+def lock_payment_order(razorpay_order_id):
+    """
+    Fetches the order for a Razorpay order ID with its row locked, so the
+    payment handler and the webhook processor serialize on it. Call inside
+    a transaction.
+    """
+    if not razorpay_order_id:
+        return None
+    return Order.objects.select_for_update().filter(razorpay_order_id=razorpay_order_id).first()
+
+
+def complete_payment(order, payment_id, signature=None):
+    """
+    Marks `order` paid and runs everything that follows a successful
+    payment: confirms its stock holds, clears the buyer's cart and queues
+    the confirmation email and invoice. Returns False if it was already paid.
+
+    The paid flag is flipped with a conditional UPDATE, so of two callers
+    racing on the same order exactly one does the follow-up work.
+    """
+    if order.is_paid:
+        return False
+    with transaction.atomic():
+        changes = {'is_paid': True, 'status': 'paid', 'razorpay_payment_id': payment_id, 'updated_at': timezone.now()}
+        if signature:
+            changes['razorpay_signature'] = signature
+        if not Order.objects.filter(pk=order.pk, is_paid=False).update(**changes):
+            order.refresh_from_db()
+            return False
+        for field, value in changes.items():
+            setattr(order, field, value)
+        confirm_holds(order)
+        CartItem.objects.filter(user_id=order.user_id).delete()
+        transaction.on_commit(lambda: mailer.queue_order_confirmation(order))
+        transaction.on_commit(lambda: tasks.render_invoice_pdf.delay(order.id))
+    return True
+
+
+def record_payment(razorpay_order_id, payment_id, signature=None):
+    """
+    Completes the payment for a Razorpay order ID under the order's row
+    lock. Returns (order, completed): order is None if there is no such
+    order, and completed is False if it was already paid.
+    """
+    with transaction.atomic():
+        order = lock_payment_order(razorpay_order_id)
+        if order is None:
+            return None, False
+        return order, complete_payment(order, payment_id, signature)
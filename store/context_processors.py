@@ -1,19 +1,64 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
 from .models import CartItem, Wishlist
 
+# Counts are cached per user and dropped by the CartItem/Wishlist signals in
+# store.signals whenever a line is added or removed. The timeout bounds
+# staleness if an invalidation is missed, and, if STORE_CATALOG_CACHE is set
+# to the per-process "locmem" (see settings.CACHES), for lines changed by
+# another process, such as a run_jobs worker clearing the cart after payment.
+COUNT_CACHE_TIMEOUT = getattr(settings, 'STORE_COUNT_CACHE_TIMEOUT', 300)
+
+
+def _count_key(kind, user_id):
+    return f"store:{kind}_count:{user_id}"
+
+
+def get_cart_item_count(user_id):
+    key = _count_key('cart', user_id)
+    count = cache.get(key)
+    if count is None:
+        count = CartItem.objects.filter(user_id=user_id).count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def get_wishlist_count(user_id):
+    key = _count_key('wishlist', user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Wishlist.objects.filter(user_id=user_id).count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def invalidate_cart_count(user_id):
+    cache.delete(_count_key('cart', user_id))
+
+
+def invalidate_wishlist_count(user_id):
+    cache.delete(_count_key('wishlist', user_id))
+
+
 def cart_item_count(request):
     """
     Returns the number of items in the user's cart.
+
+    Evaluated lazily, so pages that never display it cost nothing.
     """
-    count = 0
-    if request.user.is_authenticated:
-        count = CartItem.objects.filter(user=request.user).count()
-    return {'cart_item_count': count}
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {'cart_item_count': 0}
+    return {'cart_item_count': SimpleLazyObject(lambda: get_cart_item_count(user.pk))}
 
 def wishlist_count(request):
     """
     Returns the number of items in the user's wishlist.
+
+    Evaluated lazily, so pages that never display it cost nothing.
     """
-    count = 0
-    if request.user.is_authenticated:
-        count = Wishlist.objects.filter(user=request.user).count()
-    return {'wishlist_count': count}
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {'wishlist_count': 0}
+    return {'wishlist_count': SimpleLazyObject(lambda: get_wishlist_count(user.pk))}
\ No newline at end of file
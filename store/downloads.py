@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+class FetchResult:
+    def __init__(self, url, name=None, error=None, reused=False):
+        self.url = url
+        self.name = name          # storage name of the saved image
+        self.error = error
+        self.reused = reused      # content already existed in storage
+
+    @property
+    def ok(self):
+        return self.name is not None
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class BaseImageDownloader:
+    """
+    What every transport shares: the limits, validation of the response
+    and content-addressed storage. Images are stored under the SHA-256 of
+    their bytes, so the same picture referenced by many rows (or many
+    imports) is stored once. Subclasses set up their own connection pool
+    and implement `fetch_many`.
+    """
+
+    def __init__(self, max_workers=None, per_host=None, timeout=None, max_bytes=None,
+                 retries=3, backoff=0.5, upload_to='products', storage=None):
+        self.max_workers = max_workers or getattr(settings, 'STORE_IMAGE_FETCH_WORKERS', 8)
+        self.per_host = per_host or getattr(settings, 'STORE_IMAGE_FETCH_PER_HOST', 4)
+        self.timeout = timeout or getattr(settings, 'STORE_IMAGE_FETCH_TIMEOUT', 10)
+        self.max_bytes = max_bytes or getattr(settings, 'STORE_IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+        self.upload_to = upload_to
+        self.storage = storage or default_storage
+        self.retries = retries
+        self.backoff = backoff
+        self._save_lock = threading.Lock()
+
+    def _check_response(self, status_code, headers):
+        """Returns the image's content type, or raises ImageFetchError."""
+        if status_code != 200:
+            raise ImageFetchError(f"HTTP {status_code}")
+        content_type = headers.get('Content-Type', '')
+        if 'image' not in content_type:
+            raise ImageFetchError(f"non-image content ({content_type or 'no content type'})")
+        return content_type
+
+    def _add_chunk(self, body, chunk):
+        body.extend(chunk)
+        if len(body) > self.max_bytes:
+            raise ImageFetchError(f"image larger than {self.max_bytes} bytes")
+
+    def _store(self, url, content, content_type):
+        digest = hashlib.sha256(content).hexdigest()
+        extension = os.path.splitext(urlsplit(url).path)[1].lower()
+        if not extension or len(extension) > 5:
+            extension = mimetypes.guess_extension(content_type.split(';')[0].strip()) or ''
+        name = f"{self.upload_to}/{digest[:2]}/{digest}{extension}"
+        with self._save_lock:
+            if self.storage.exists(name):
+                return name, True
+            return self.storage.save(name, ContentFile(content)), False
+
+    def _failed(self, url, error, expected=True):
+        if expected:
+            logger.error(f"Image download failed for {url}: {error}")
+            return FetchResult(url, error=str(error) or type(error).__name__)
+        logger.exception(f"Unexpected error downloading {url}")
+        return FetchResult(url, error=f"{type(error).__name__}: {error}")
+
+    def fetch_many(self, urls):
+        """
+        Downloads every distinct URL once, concurrently. Returns {url: FetchResult}.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ImageDownloader(BaseImageDownloader):
+    """
+    Fetches remote product images on a thread pool.
+
+    Requests go through one pooled keep-alive adapter shared by all worker
+    threads, with per-host concurrency limits and retry/backoff on transient
+    failures.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.adapter = HTTPAdapter(
+            pool_connections=self.max_workers,
+            pool_maxsize=self.max_workers,
+            max_retries=Retry(
+                total=self.retries,
+                backoff_factor=self.backoff,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=('GET',),
+                raise_on_status=False,
+            ),
+        )
+        self._local = threading.local()
+        self._host_limits = {}
+        self._host_lock = threading.Lock()
+        self._executor = None
+
+    # ---- plumbing ----
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+        return session
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._host_lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_limits[host]
+
+    def _download(self, url):
+        with self._host_limit(url):
+            with self._session().get(url, timeout=self.timeout, stream=True) as response:
+                content_type = self._check_response(response.status_code, response.headers)
+                body = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    self._add_chunk(body, chunk)
+                return bytes(body), content_type
+
+    def fetch(self, url):
+        """
+        Downloads and stores one image. Never raises: any failure, including
+        a malformed URL, becomes the result's `error`, so one bad cell can't
+        abort the rest of the batch.
+        """
+        try:
+            content, content_type = self._download(url)
+            name, reused = self._store(url, content, content_type)
+            return FetchResult(url, name=name, reused=reused)
+        except (requests.RequestException, ImageFetchError, ValueError, OSError) as e:
+            return self._failed(url, e)
+        except Exception as e:
+            return self._failed(url, e, expected=False)
+
+    # ---- public API ----
+
+    def fetch_many(self, urls):
+        unique = list(dict.fromkeys(url for url in urls if url))
+        if not unique:
+            return {}
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='image-fetch')
+        return dict(zip(unique, self._executor.map(self.fetch, unique)))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.adapter.close()
+
+
+class AsyncImageDownloader(BaseImageDownloader):
+    """
+    Fetches remote product images on asyncio: every download runs on one
+    event loop over a single httpx connection pool, instead of a thread per
+    connection. The pool lives only as long as one `afetch_many` call.
+
+    Await `afetch_many` from async code; `fetch_many` runs it to completion
+    from sync code (e.g. the CSV import job).
+    """
+
+    def _client(self):
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.max_workers, max_keepalive_connections=self.max_workers),
+            transport=httpx.AsyncHTTPTransport(retries=self.retries),   # connection failures only
+        )
+
+    async def _adownload(self, client, url, host_limits):
+        host = urlsplit(url).netloc.lower()
+        limit = host_limits.setdefault(host, asyncio.Semaphore(self.per_host))
+        async with limit:
+            for attempt in range(self.retries + 1):
+                async with client.stream('GET', url) as response:
+                    if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                        await asyncio.sleep(self.backoff * (2 ** attempt))
+                        continue
+                    content_type = self._check_response(response.status_code, response.headers)
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes(64 * 1024):
+                        self._add_chunk(body, chunk)
+                    return bytes(body), content_type
+
+    async def afetch(self, client, url, host_limits):
+        """Like ImageDownloader.fetch, never raises; failures become the result's `error`."""
+        try:
+            content, content_type = await self._adownload(client, url, host_limits)
+            # Storage backends are blocking; keep them off the event loop.
+            name, reused = await asyncio.to_thread(self._store, url, content, content_type)
+            return FetchResult(url, name=name, reused=reused)
+        except (httpx.HTTPError, httpx.InvalidURL, ImageFetchError, ValueError, OSError) as e:
+            return self._failed(url, e)
+        except Exception as e:
+            return self._failed(url, e, expected=False)
+
+    async def afetch_many(self, urls):
+        """
+        Downloads every distinct URL once, concurrently. Returns {url: FetchResult}.
+        """
+        unique = list(dict.fromkeys(url for url in urls if url))
+        if not unique:
+            return {}
+        host_limits = {}
+        async with self._client() as client:
+            results = await asyncio.gather(*(self.afetch(client, url, host_limits) for url in unique))
+        return dict(zip(unique, results))
+
+    def fetch_many(self, urls):
+        return async_to_sync(self.afetch_many)(list(urls))
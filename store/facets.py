@@ -0,0 +1,263 @@
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Product, ProductTag, ProductFacet, FacetCount, Category, Tag
+
+
+# ---------------- Buckets ----------------
+
+def price_bucket_edges():
+    return getattr(settings, 'STORE_PRICE_BUCKETS', [0, 500, 1000, 5000, 10000])
+
+
+def price_bucket(price):
+    edges = price_bucket_edges()
+    for low, high in zip(edges, edges[1:]):
+        if price < high:
+            return f"{low}-{high}"
+    return f"{edges[-1]}+"
+
+
+def price_range(bucket):
+    """
+    Returns (low, high) for a price bucket key; high is None for the open-ended top bucket.
+    """
+    if bucket.endswith('+'):
+        return Decimal(bucket[:-1]), None
+    low, high = bucket.split('-')
+    return Decimal(low), Decimal(high)
+
+
+def rating_bucket(average_rating):
+    return str(int(average_rating or 0))
+
+
+def availability_bucket(stock):
+    return 'in_stock' if stock > 0 else 'out_of_stock'
+
+
+def facet_values(category_id, price, average_rating, stock, tag_ids):
+    values = {
+        ('category', str(category_id)),
+        ('price', price_bucket(price)),
+        ('rating', rating_bucket(average_rating)),
+        ('availability', availability_bucket(stock)),
+    }
+    values.update(('tag', str(tag_id)) for tag_id in tag_ids)
+    return values
+
+
+# ---------------- Incremental maintenance ----------------
+
+def _apply_deltas(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value) for facet, value in deltas],
+        ignore_conflicts=True,
+    )
+    for (facet, value), delta in deltas.items():
+        FacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+
+
+def sync_product_facets(product_ids):
+    """
+    Brings the facet rows and counts for the given products in line with
+    their current state. Products that are no longer listed stop counting.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+
+    with transaction.atomic():
+        rows = Product.objects.listed().filter(id__in=product_ids).values_list(
+            'id', 'category_id', 'price', 'average_rating', 'stock'
+        )
+        tags = defaultdict(list)
+        for product_id, tag_id in ProductTag.objects.filter(product_id__in=product_ids).values_list('product_id', 'tag_id'):
+            tags[product_id].append(tag_id)
+        wanted = {
+            (pk, facet, value)
+            for pk, category_id, price, average_rating, stock in rows
+            for facet, value in facet_values(category_id, price, average_rating, stock, tags[pk])
+        }
+
+        current = {}
+        for row_id, pk, facet, value in ProductFacet.objects.filter(product_id__in=product_ids).values_list(
+            'id', 'product_id', 'facet', 'value'
+        ):
+            current[(pk, facet, value)] = row_id
+
+        added = wanted - current.keys()
+        removed = current.keys() - wanted
+        if not added and not removed:
+            return
+
+        if removed:
+            ProductFacet.objects.filter(id__in=[current[key] for key in removed]).delete()
+        if added:
+            ProductFacet.objects.bulk_create(
+                [ProductFacet(product_id=pk, facet=facet, value=value) for pk, facet, value in added]
+            )
+
+        deltas = Counter()
+        for _, facet, value in added:
+            deltas[(facet, value)] += 1
+        for _, facet, value in removed:
+            deltas[(facet, value)] -= 1
+        _apply_deltas(deltas)
+
+
+def remove_product_facets(product_ids):
+    with transaction.atomic():
+        facets = ProductFacet.objects.filter(product_id__in=list(product_ids))
+        deltas = Counter()
+        for facet, value in facets.values_list('facet', 'value'):
+            deltas[(facet, value)] -= 1
+        facets.delete()
+        _apply_deltas(deltas)
+
+
+def rebuild_facets(chunk_size=2000):
+    """
+    Recomputes every facet row and count from scratch.
+    """
+    with transaction.atomic():
+        ProductFacet.objects.all().delete()
+        FacetCount.objects.all().delete()
+        totals = Counter()
+        last_id = 0
+        products = Product.objects.listed().order_by('id')
+        while True:
+            rows = list(
+                products.filter(id__gt=last_id).values_list(
+                    'id', 'category_id', 'price', 'average_rating', 'stock'
+                )[:chunk_size]
+            )
+            if not rows:
+                break
+            ids = [row[0] for row in rows]
+            tags = defaultdict(list)
+            for product_id, tag_id in ProductTag.objects.filter(product_id__in=ids).values_list('product_id', 'tag_id'):
+                tags[product_id].append(tag_id)
+            batch = []
+            for pk, category_id, price, average_rating, stock in rows:
+                for facet, value in facet_values(category_id, price, average_rating, stock, tags[pk]):
+                    batch.append(ProductFacet(product_id=pk, facet=facet, value=value))
+                    totals[(facet, value)] += 1
+            ProductFacet.objects.bulk_create(batch)
+            last_id = ids[-1]
+        FacetCount.objects.bulk_create(
+            [FacetCount(facet=facet, value=value, count=count) for (facet, value), count in totals.items()]
+        )
+    return len(totals)
+
+
+# ---------------- Reading ----------------
+
+FILTER_PARAMS = ('category', 'tag', 'price', 'rating', 'availability')
+
+
+def selected_facets(params):
+    """
+    Returns the valid facet selections found in a QueryDict.
+    """
+    selected = {}
+    for key in ('category', 'tag', 'rating'):
+        value = params.get(key, '')
+        if value.isdigit():
+            selected[key] = value
+    price = params.get('price', '')
+    if price:
+        try:
+            price_range(price)
+            selected['price'] = price
+        except (ValueError, ArithmeticError):
+            pass
+    if params.get('availability') in ('in_stock', 'out_of_stock'):
+        selected['availability'] = params['availability']
+    return selected
+
+
+def filter_products(products, selected):
+    if 'category' in selected:
+        products = products.filter(category_id=selected['category'])
+    if 'tag' in selected:
+        products = products.filter(tags__tag_id=selected['tag'])
+    if 'price' in selected:
+        low, high = price_range(selected['price'])
+        products = products.filter(price__gte=low)
+        if high is not None:
+            products = products.filter(price__lt=high)
+    if 'rating' in selected:
+        products = products.filter(average_rating__gte=int(selected['rating']))
+    if 'availability' in selected:
+        if selected['availability'] == 'in_stock':
+            products = products.filter(stock__gt=0)
+        else:
+            products = products.filter(stock=0)
+    return products
+
+
+def facet_counts():
+    counts = defaultdict(dict)
+    for facet, value, count in FacetCount.objects.filter(count__gt=0).values_list('facet', 'value', 'count'):
+        counts[facet][value] = count
+    return counts
+
+
+def build_facets(selected, categories=None, tag_names=None):
+    """
+    Returns the facet groups for the product list sidebar, each a dict of
+    `param`, `label` and `options` (value, label, count, selected).
+    `tag_names` is {str(tag id): name}, for at least the counted tags.
+    """
+    counts = facet_counts()
+
+    if categories is None:
+        categories = Category.objects.all()
+    category_names = {str(category.id): category.name for category in categories}
+    if tag_names is None:
+        tag_names = {
+            str(pk): name
+            for pk, name in Tag.objects.filter(id__in=list(counts['tag'])).values_list('id', 'name')
+        } if counts['tag'] else {}
+
+    def options(param, labels, values=None):
+        values = values if values is not None else counts[param]
+        return [
+            {'value': value, 'label': labels(value), 'count': count, 'selected': selected.get(param) == value}
+            for value, count in values.items()
+            if labels(value)
+        ]
+
+    def price_label(bucket):
+        low, high = price_range(bucket)
+        return f"₹{low}+" if high is None else f"₹{low} – ₹{high}"
+
+    price_order = {price_bucket(edge): index for index, edge in enumerate(price_bucket_edges())}
+    prices = dict(sorted(counts['price'].items(), key=lambda item: price_order.get(item[0], len(price_order))))
+
+    # Rating buckets are exclusive (4 means 4.0–4.9); the sidebar shows "N★ & up".
+    ratings = {}
+    running = 0
+    for stars in range(5, 0, -1):
+        running += counts['rating'].get(str(stars), 0)
+        if running:
+            ratings[str(stars)] = running
+
+    return [
+        {'param': 'category', 'label': 'Category', 'options': sorted(
+            options('category', category_names.get), key=lambda option: option['label'])},
+        {'param': 'tag', 'label': 'Tags', 'options': sorted(
+            options('tag', tag_names.get), key=lambda option: option['label'])},
+        {'param': 'price', 'label': 'Price', 'options': options('price', price_label, prices)},
+        {'param': 'rating', 'label': 'Rating', 'options': options('rating', lambda v: f"{v}★ & up", ratings)},
+        {'param': 'availability', 'label': 'Availability', 'options': options(
+            'availability', {'in_stock': 'In stock', 'out_of_stock': 'Out of stock'}.get)},
+    ]
@@ -0,0 +1,156 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .storage import is_public, name_digest
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+# Content-Encoding -> suffix of the precompressed copy, preferred first.
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+class _RangeFile:
+    """
+    Wraps an open file so iteration yields only bytes [start, start + length).
+    """
+
+    def __init__(self, fileobj, start, length, block_size=64 * 1024):
+        self.fileobj = fileobj
+        self.remaining = length
+        self.block_size = block_size
+        fileobj.seek(start)
+
+    def __iter__(self):
+        while self.remaining > 0:
+            chunk = self.fileobj.read(min(self.block_size, self.remaining))
+            if not chunk:
+                break
+            self.remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.fileobj.close()
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match', '')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return quote_etag(etag) in candidates
+
+
+def serve_file(request, storage, name, etag, content_type, filename=None, as_attachment=False,
+               cache_control='private, max-age=0, must-revalidate', last_modified=None):
+    """
+    Streams a file from `storage` with a strong ETag, conditional GET (304)
+    and single-range (206) support. The body is sent with FileResponse, so
+    servers that support it can use sendfile.
+    """
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = quote_etag(etag)
+        response['Cache-Control'] = cache_control
+        return response
+
+    size = storage.size(name)
+    fileobj = storage.open(name, 'rb')
+
+    start, end = 0, size - 1
+    partial = False
+    match = RANGE_RE.match(request.headers.get('Range', ''))
+    # A Range is only honoured if If-Range (when sent) still names this version.
+    if match and request.headers.get('If-Range', quote_etag(etag)) == quote_etag(etag):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        elif last:
+            start = max(size - int(last), 0)
+        if start > end or start >= size:
+            fileobj.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        partial = (start, end) != (0, size - 1)
+
+    if partial:
+        response = FileResponse(_RangeFile(fileobj, start, end - start + 1), status=206,
+                                content_type=content_type, as_attachment=as_attachment, filename=filename)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(fileobj, content_type=content_type, as_attachment=as_attachment, filename=filename)
+        response['Content-Length'] = str(size)
+
+    response['ETag'] = quote_etag(etag)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = cache_control
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def accepts_encoding(request, coding):
+    """Whether the Accept-Encoding header allows `coding` (a q=0 entry refuses it)."""
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = item.partition(';')
+        if token.strip().lower() in (coding, '*'):
+            _, _, q = params.strip().partition('q=')
+            try:
+                return float(q or 1) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def serve_media(request, storage, name):
+    """
+    Serves a public media file. Content-hashed names are immutable, so they
+    are cached for a year without revalidation; anything else gets an ETag
+    from its size and mtime and is revalidated (a 304 costs no body). A
+    precompressed copy written by MediaStorage is sent instead when the
+    client accepts it.
+    """
+    # Normalised first, so products/../invoices/... can't reach private files.
+    name = posixpath.normpath(name).lstrip('/')
+    if not is_public(name):
+        raise Http404
+    try:
+        path = storage.path(name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(path):
+        raise Http404
+    modified, size = storage.get_modified_time(name), storage.size(name)
+
+    digest = name_digest(name)
+    etag = digest or f"{int(modified.timestamp()):x}-{size:x}"
+    cache_control = IMMUTABLE if digest else REVALIDATE
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    served, encoding, variants = name, None, False
+    for coding, suffix in PRECOMPRESSED:
+        if storage.exists(name + suffix):
+            variants = True
+            if encoding is None and accepts_encoding(request, coding):
+                served, encoding, etag = name + suffix, coding, f"{etag}-{suffix[1:]}"
+
+    response = serve_file(request, storage, served, etag, content_type,
+                          cache_control=cache_control, last_modified=modified)
+    if encoding and response.status_code != 304:
+        response['Content-Encoding'] = encoding
+    if variants:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+from collections import defaultdict
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from .models import Job, Product
+from .jobs import enqueue
+from . import catalog_cache
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_TASK = 'store.generate_image_derivatives'
+
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 55, 'speed': 8},
+}
+
+
+# ---------------- Settings ----------------
+
+def derivative_widths():
+    return tuple(getattr(settings, 'STORE_IMAGE_WIDTHS', (240, 480, 960)))
+
+
+def derivative_formats():
+    """Output formats, best first. AVIF only where this Pillow build can encode it."""
+    wanted = getattr(settings, 'STORE_IMAGE_FORMATS', ('avif', 'webp'))
+    return tuple(fmt for fmt in wanted if fmt in SAVE_OPTIONS and features.check(fmt))
+
+
+def source_name(product):
+    """The stored image the product displays (see Product.display_image), or ''."""
+    return product.uploaded_image.name or product.image.name or ''
+
+
+def is_current(product):
+    name = source_name(product)
+    return not name or (product.image_derivatives or {}).get('source') == name
+
+
+# ---------------- Rendering ----------------
+
+def render_derivatives(content, widths, formats):
+    """
+    Resizes one source image, in each format, to every configured width
+    narrower than it plus its own width (capped at the widest configured
+    one), so the srcset always reaches the source's full resolution.
+
+    Pure and picklable, so it can run in a process pool: returns
+    ((width, height), [(format, width, bytes), ...]).
+    """
+    with Image.open(BytesIO(content)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    full = min(image.width, max(widths))
+    sizes = sorted({width for width in widths if width < full} | {full})
+    rendered = []
+    for width in sizes:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        for fmt in formats:
+            out = BytesIO()
+            resized.save(out, **SAVE_OPTIONS[fmt])
+            rendered.append((fmt, width, out.getvalue()))
+    return image.size, rendered
+
+
+def store_derivatives(source, size, rendered, storage=None):
+    """
+    Saves rendered derivatives under content-hashed names (identical output
+    is stored once) and returns the record kept on Product.image_derivatives.
+    """
+    storage = storage or default_storage
+    formats = defaultdict(list)
+    for fmt, width, content in rendered:
+        digest = hashlib.sha256(content).hexdigest()
+        name = f"derivatives/{digest[:2]}/{digest}.{fmt}"
+        if not storage.exists(name):
+            name = storage.save(name, ContentFile(content))
+        formats[fmt].append([width, name])
+    return {'source': source, 'width': size[0], 'height': size[1], 'formats': dict(formats)}
+
+
+def build_derivatives(products, executor=None, storage=None):
+    """
+    Generates derivatives for products whose displayed image has none yet.
+    Products sharing a source image share one rendering. With `executor`
+    (e.g. a ProcessPoolExecutor) the resizing runs there; reading and
+    writing storage and the database stay in this process.
+
+    Returns (sources rendered, sources that failed).
+    """
+    storage = storage or default_storage
+    by_source = defaultdict(list)
+    for product in products:
+        if not is_current(product):
+            by_source[source_name(product)].append(product.pk)
+
+    widths, formats = derivative_widths(), derivative_formats()
+    pending = {}
+    rendered = failed = 0
+    for source in by_source:
+        try:
+            with storage.open(source, 'rb') as f:
+                content = f.read()
+        except OSError as e:
+            logger.warning(f"Can't read product image {source}: {e}")
+            failed += 1
+            continue
+        pending[source] = executor.submit(render_derivatives, content, widths, formats) if executor else content
+
+    for source, job in pending.items():
+        try:
+            size, outputs = job.result() if executor else render_derivatives(job, widths, formats)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as e:
+            logger.warning(f"Can't render derivatives of {source}: {e}")
+            failed += 1
+            continue
+        record = store_derivatives(source, size, outputs, storage)
+        # update(), not save(): nothing else about the product changed.
+        Product.objects.filter(pk__in=by_source[source]).update(image_derivatives=record, updated_at=timezone.now())
+        rendered += 1
+    if rendered:
+        catalog_cache.bump('product')  # listing pages show the new <picture> sources
+    return rendered, failed
+
+
+def schedule_derivatives(product_ids):
+    if product_ids:
+        enqueue(DERIVATIVES_TASK, args=[list(product_ids)], priority=Job.PRIORITY_LOW)
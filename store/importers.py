@@ -0,0 +1,152 @@
+import codecs
+import csv
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.text import slugify
+
+from .models import Product, Category
+from .downloads import AsyncImageDownloader
+from . import search, facets, images, catalog_cache
+
+logger = logging.getLogger(__name__)
+
+
+class CSVImportError(Exception):
+    pass
+
+
+class ImportResult:
+    # Only the first few warnings are kept, so a bad file can't grow memory.
+    max_warnings = 50
+
+    def __init__(self):
+        self.created = 0
+        self.skipped = 0
+        self.batches = 0
+        self.warnings = []
+        self.warning_count = 0
+
+    def warn(self, message):
+        logger.warning(message)
+        self.warning_count += 1
+        if len(self.warnings) < self.max_warnings:
+            self.warnings.append(message)
+
+
+class ProductCSVImporter:
+    """
+    Streams a product CSV into the catalog in bounded batches.
+
+    Rows are decoded line by line from the upload, categories come from one
+    preloaded name map and slugs are allocated against an in-memory set, so
+    database work is a handful of queries per batch rather than per row.
+    """
+
+    def __init__(self, batch_size=None, downloader=None):
+        self.batch_size = batch_size or getattr(settings, 'STORE_IMPORT_BATCH_SIZE', 1000)
+        self.downloader = downloader
+        self.categories = {}
+        self.slugs = set()
+        self.result = ImportResult()
+
+    def run(self, fileobj):
+        reader = csv.DictReader(codecs.iterdecode(fileobj, 'utf-8-sig'))
+        if not reader.fieldnames or 'name' not in reader.fieldnames:
+            raise CSVImportError("Invalid CSV format. 'name' field is required.")
+
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.slugs = set(Product.objects.values_list('slug', flat=True))
+
+        owns_downloader = self.downloader is None
+        if owns_downloader:
+            self.downloader = AsyncImageDownloader()
+        try:
+            batch = []
+            for row in reader:
+                product = self.build_product(row, reader.line_num)
+                if product is None:
+                    self.result.skipped += 1
+                    continue
+                batch.append((product, row))
+                if len(batch) >= self.batch_size:
+                    self.write_batch(batch)
+                    batch = []
+            self.write_batch(batch)
+        finally:
+            if owns_downloader:
+                self.downloader.close()
+        return self.result
+
+    def category_id(self, name):
+        name = (name or '').strip() or 'Uncategorized'
+        if name not in self.categories:
+            category, _ = Category.objects.get_or_create(name=name)
+            self.categories[name] = category.id
+        return self.categories[name]
+
+    def allocate_slug(self, name):
+        base_slug = slugify(name) or 'product'
+        slug = base_slug
+        counter = 1
+        while slug in self.slugs:
+            slug = f"{base_slug}-{counter}"
+            counter += 1
+        self.slugs.add(slug)
+        return slug
+
+    def build_product(self, row, line_number):
+        name = (row.get('name') or '').strip()
+        if not name:
+            self.result.warn(f"Row {line_number}: missing name, skipped.")
+            return None
+        try:
+            price = Decimal((row.get('price') or '0').strip() or '0')
+            stock = int((row.get('stock') or '0').strip() or '0')
+        except (InvalidOperation, ValueError):
+            self.result.warn(f"Row {line_number}: invalid price or stock for {name}, skipped.")
+            return None
+
+        return Product(
+            name=name,
+            price=price,
+            description=row.get('description') or '',
+            category_id=self.category_id(row.get('category')),
+            stock=max(stock, 0),
+            is_available=(row.get('is_available') or '').strip().lower() == 'true',
+            slug=self.allocate_slug(name),
+        )
+
+    def attach_images(self, batch):
+        urls = [(product, (row.get('image') or '').strip()) for product, row in batch]
+        results = self.downloader.fetch_many(url for _, url in urls)
+        for product, url in urls:
+            if not url:
+                continue
+            result = results[url]
+            if result.ok:
+                product.image.name = result.name
+            else:
+                self.result.warn(f"Failed to download image for {product.name} ({result.error}).")
+
+    def write_batch(self, batch):
+        if not batch:
+            return
+        self.attach_images(batch)
+        with transaction.atomic():
+            created = Product.objects.bulk_create([product for product, _ in batch])
+            # bulk_create bypasses post_save, so update the derived indexes here.
+            ids = [product.pk for product in created]
+            search.index_products(ids)
+            facets.sync_product_facets(ids)
+            catalog_cache.bump('product')
+            with_images = [product.pk for product in created if product.image]
+            transaction.on_commit(lambda: images.schedule_derivatives(with_images))
+        self.result.created += len(created)
+        self.result.batches += 1
+
+
+def import_products_csv(fileobj, batch_size=None, downloader=None):
+    return ProductCSVImporter(batch_size=batch_size, downloader=downloader).run(fileobj)
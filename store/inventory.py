@@ -0,0 +1,150 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Product, StockHold
+from . import facets
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_names):
+        self.product_names = list(product_names)
+        super().__init__(f"Not enough stock for: {', '.join(self.product_names)}.")
+
+
+def hold_ttl():
+    return timedelta(seconds=getattr(settings, 'STORE_STOCK_HOLD_TTL', 15 * 60))
+
+
+# ---------------- Stock movements ----------------
+
+def _quantity_case(wanted):
+    return Case(
+        *[When(id=product_id, then=Value(qty)) for product_id, qty in wanted.items()],
+        output_field=IntegerField(),
+    )
+
+
+def take_stock(wanted):
+    """
+    Decrements stock for {product_id: quantity} with one conditional UPDATE.
+    Each product row is locked only for the statement, and only changes if it
+    still has enough, so concurrent checkouts of the same SKU can't oversell.
+    Must run inside the caller's transaction; raises InsufficientStock
+    (leaving the rollback to the caller) if any product is short.
+
+    update() sends no signals, so the availability facet counts are synced
+    here, in the same transaction.
+    """
+    if not wanted:
+        return
+    quantity = _quantity_case(wanted)
+    updated = Product.objects.filter(id__in=wanted, stock__gte=quantity).update(stock=F('stock') - quantity)
+    if updated != len(wanted):
+        short = Product.objects.filter(id__in=wanted, stock__lt=quantity).values_list('name', flat=True)
+        raise InsufficientStock(short)
+    facets.sync_product_facets(wanted)
+
+
+def return_stock(wanted):
+    if wanted:
+        quantity = _quantity_case(wanted)
+        with transaction.atomic():
+            Product.objects.filter(id__in=wanted).update(stock=F('stock') + quantity)
+            facets.sync_product_facets(wanted)
+
+
+def _totals(holds):
+    wanted = defaultdict(int)
+    for hold in holds:
+        wanted[hold.product_id] += hold.quantity
+    return dict(wanted)
+
+
+# ---------------- Holds ----------------
+
+def reserve(order, lines):
+    """
+    Takes stock for the order's lines and records it as holds that expire
+    after STORE_STOCK_HOLD_TTL unless the order is paid first.
+    """
+    wanted = defaultdict(int)
+    for line in lines:
+        wanted[line.product.id] += line.quantity
+    with transaction.atomic():
+        take_stock(wanted)
+        expires_at = timezone.now() + hold_ttl()
+        return StockHold.objects.bulk_create([
+            StockHold(order=order, product_id=product_id, quantity=qty, expires_at=expires_at)
+            for product_id, qty in wanted.items()
+        ])
+
+
+def _claim(holds, status):
+    # Flip the holds' status first; only the rows this call actually changed
+    # are ours to act on, so a release racing a confirm can't apply twice.
+    claimed = []
+    for hold in holds:
+        if StockHold.objects.filter(id=hold.id, status=hold.status).update(status=status):
+            claimed.append(hold)
+    return claimed
+
+
+def confirm_holds(order):
+    """
+    Makes the order's reserved stock permanent once it is paid. Holds that
+    already expired and were released are taken again if stock allows; any
+    shortfall is logged and returned as product names so it can be handled
+    by hand — the payment has already been captured.
+    """
+    with transaction.atomic():
+        holds = list(StockHold.objects.filter(order=order).exclude(status='confirmed'))
+        released = [hold for hold in holds if hold.status == 'released']
+        _claim([hold for hold in holds if hold.status == 'held'], 'confirmed')
+        if not released:
+            return []
+        try:
+            with transaction.atomic():
+                take_stock(_totals(released))
+        except InsufficientStock as e:
+            logger.error(f"Order #{order.id} paid after its stock hold expired; {e}")
+            return e.product_names
+        _claim(released, 'confirmed')
+    return []
+
+
+def release_holds(order):
+    """
+    Gives back the stock held for an unpaid or cancelled order.
+    """
+    with transaction.atomic():
+        holds = _claim(list(StockHold.objects.filter(order=order, status='held')), 'released')
+        return_stock(_totals(holds))
+    return len(holds)
+
+
+def release_expired_holds(now=None, batch_size=500):
+    """
+    Releases holds whose orders were not paid in time. Safe to run from
+    several processes at once. Returns the number of holds released.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(StockHold.objects.filter(status='held', expires_at__lte=now).order_by('id')[:batch_size])
+            if not batch:
+                break
+            holds = _claim(batch, 'released')
+            return_stock(_totals(holds))
+        released += len(holds)
+    if released:
+        logger.info(f"Released {released} expired stock holds.")
+    return released
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import get_template
+from xhtml2pdf import pisa
+
+from .models import Invoice
+
+logger = logging.getLogger(__name__)
+
+
+class InvoiceRenderError(Exception):
+    pass
+
+
+def invoice_items(order):
+    return list(order.items.order_by('id'))
+
+
+def invoice_fingerprint(order, items=None):
+    """
+    Hash of everything the invoice template shows. Changes only when the
+    printed invoice would change.
+    """
+    items = invoice_items(order) if items is None else items
+    data = {
+        'order': [order.id, str(order.total_price), order.created_at.isoformat()],
+        'user': [order.user.username, order.user.email],
+        'items': [[item.product_name, item.quantity, str(item.price)] for item in items],
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def render_invoice(order, items=None):
+    items = invoice_items(order) if items is None else items
+    html = get_template('store/invoice_template.html').render({
+        'order': order,
+        'items': items,
+        'user': order.user,
+    })
+    pdf = BytesIO()
+    status = pisa.CreatePDF(html, dest=pdf)
+    if status.err:
+        raise InvoiceRenderError(f"PDF rendering failed for order #{order.id}")
+    return pdf.getvalue()
+
+
+def write_invoice_file(content):
+    """
+    Stores PDF bytes under their content hash (once) and returns the digest.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    path = Invoice(digest=digest).path
+    if not default_storage.exists(path):
+        default_storage.save(path, ContentFile(content))
+    return digest
+
+
+def store_invoice(order):
+    """
+    Renders and stores the invoice for `order` unless an up-to-date one exists.
+    """
+    items = invoice_items(order)
+    fingerprint = invoice_fingerprint(order, items)
+    invoice = Invoice.objects.filter(order=order).first()
+    if invoice and invoice.fingerprint == fingerprint and default_storage.exists(invoice.path):
+        return invoice
+
+    content = render_invoice(order, items)
+    invoice, _ = Invoice.objects.update_or_create(order=order, defaults={
+        'fingerprint': fingerprint,
+        'digest': write_invoice_file(content),
+        'size': len(content),
+    })
+    return invoice
+
+
+def current_invoice(order):
+    """
+    Returns the stored invoice for `order` if it still matches the order, else None.
+    """
+    invoice = Invoice.objects.filter(order=order).first()
+    if invoice is None or invoice.fingerprint != invoice_fingerprint(order):
+        return None
+    if not default_storage.exists(invoice.path):
+        return None
+    return invoice
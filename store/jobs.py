@@ -0,0 +1,227 @@
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .inventory import release_expired_holds
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+# ---------------- Task registry ----------------
+
+def task(name=None, priority=Job.PRIORITY_DEFAULT, max_attempts=3):
+    """
+    Registers a function as a background task. The function gains a
+    `.delay(*args, **kwargs)` helper that enqueues it with the task's defaults.
+    Arguments must be JSON-serializable (pass ids, not model instances).
+    """
+    def decorator(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        _registry[task_name] = func
+        func.task_name = task_name
+        func.delay = lambda *args, **kwargs: enqueue(
+            task_name, args=args, kwargs=kwargs, priority=priority, max_attempts=max_attempts
+        )
+        return func
+    return decorator
+
+
+def get_task(name):
+    return _registry.get(name)
+
+
+def enqueue(task_name, args=(), kwargs=None, priority=Job.PRIORITY_DEFAULT, max_attempts=3, user=None, delay=0):
+    if task_name not in _registry:
+        raise LookupError(f"Unknown task: {task_name}")
+    return Job.objects.create(
+        task=task_name,
+        args=list(args),
+        kwargs=kwargs or {},
+        priority=priority,
+        max_attempts=max_attempts,
+        user=user,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+# ---------------- Claiming ----------------
+
+def claim_job(worker_name, priorities=None):
+    """
+    Atomically moves the next due job to `running` and returns it, or None.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED where the database supports it, so
+    concurrent workers never block on each other's rows. SQLite has no row
+    locks, but it serializes writers, so there each candidate is claimed
+    with a conditional UPDATE and skipped if another worker won it first.
+    """
+    now = timezone.now()
+    candidates = Job.objects.filter(status='queued', run_at__lte=now)
+    if priorities:
+        candidates = candidates.filter(priority__in=priorities)
+    candidates = candidates.order_by('priority', 'run_at', 'id')
+    claim = {'status': 'running', 'locked_by': worker_name, 'locked_at': now, 'attempts': F('attempts') + 1}
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job_id = candidates.select_for_update(skip_locked=True).values_list('id', flat=True).first()
+            if job_id is None:
+                return None
+            Job.objects.filter(id=job_id).update(**claim)
+        return Job.objects.get(id=job_id)
+
+    for job_id in candidates.values_list('id', flat=True)[:10]:
+        if Job.objects.filter(id=job_id, status='queued').update(**claim):
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'STORE_JOB_RETRY_BACKOFF', 30)
+    return base * (2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def heartbeat(job):
+    """Marks a running job as still alive, so requeue_stale_jobs leaves it be."""
+    return Job.objects.filter(id=job.id, status='running', locked_by=job.locked_by).update(locked_at=timezone.now())
+
+
+class _Heartbeat(threading.Thread):
+    # Refreshes the job's lock while it runs, so a long job (a big CSV
+    # import) isn't taken for orphaned and run a second time.
+    def __init__(self, job):
+        super().__init__(name=f'job-{job.id}-heartbeat', daemon=True)
+        self.job = job
+        self.interval = getattr(settings, 'STORE_JOB_HEARTBEAT_INTERVAL', 30)
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            while not self._done.wait(self.interval):
+                heartbeat(self.job)
+        except Exception:
+            logger.exception(f"Heartbeat for job #{self.job.id} stopped")
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def requeue_stale_jobs(timeout=None):
+    """
+    Returns jobs whose worker died mid-run (no heartbeat for `timeout`
+    seconds) to the queue, or fails them if they are out of attempts.
+    """
+    timeout = timeout or getattr(settings, 'STORE_JOB_LOCK_TIMEOUT', 600)
+    stale = Job.objects.filter(status='running', locked_at__lt=timezone.now() - timedelta(seconds=timeout))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', last_error='Worker lost while running job.', finished_at=timezone.now()
+    )
+    requeued = stale.update(status='queued', locked_by='', locked_at=None)
+    return requeued + failed
+
+
+# ---------------- Running ----------------
+
+def _jsonable(value):
+    try:
+        DjangoJSONEncoder().encode(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def run_job(job):
+    func = get_task(job.task)
+    beat = _Heartbeat(job)
+    beat.start()
+    error = None
+    try:
+        if func is None:
+            raise LookupError(f"Unknown task: {job.task}")
+        result = func(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        beat.stop()
+
+    if error:
+        logger.error(f"Job #{job.id} ({job.task}) failed on attempt {job.attempts}: {error}")
+        job.last_error = error
+        job.locked_by = ''
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        else:
+            job.status = 'queued'
+            job.run_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+    else:
+        job.status = 'succeeded'
+        job.result = _jsonable(result)
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'last_error', 'locked_by', 'locked_at', 'run_at', 'finished_at'])
+    return job
+
+
+class Worker:
+    def __init__(self, priorities=None, poll_interval=None, name=None):
+        self.priorities = priorities
+        self.poll_interval = poll_interval or getattr(settings, 'STORE_JOB_POLL_INTERVAL', 1.0)
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = False
+
+    def stop(self, *args):
+        logger.info(f"Worker {self.name} stopping after current job.")
+        self._stopping = True
+
+    def run_once(self):
+        """
+        Runs at most one job. Returns True if a job was run.
+        """
+        close_old_connections()
+        job = claim_job(self.name, self.priorities)
+        if job is None:
+            return False
+        run_job(job)
+        return True
+
+    def run(self, burst=False, max_jobs=None):
+        """
+        Processes jobs until stopped. With `burst`, exits once the queue is empty.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        processed = 0
+        last_sweep = 0
+        while not self._stopping:
+            if time.monotonic() - last_sweep > 60:
+                requeue_stale_jobs()
+                release_expired_holds()
+                last_sweep = time.monotonic()
+            if self.run_once():
+                processed += 1
+                if max_jobs and processed >= max_jobs:
+                    break
+            elif burst:
+                break
+            else:
+                time.sleep(self.poll_interval)
+        return processed
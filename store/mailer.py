@@ -0,0 +1,209 @@
+import logging
+import smtplib
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Min, Prefetch
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import Job, Order, OrderItem, OutboundEmail
+from .jobs import enqueue, retry_delay
+
+logger = logging.getLogger(__name__)
+
+SEND_TASK = 'store.send_queued_emails'
+ORDER_CONFIRMATION = 'order_confirmation'
+
+# kind -> (template, subject)
+KINDS = {
+    ORDER_CONFIRMATION: ('store/order_confirmation.html', "Order Confirmation - #{order.id}"),
+}
+
+
+# ---------------- Building ----------------
+
+def build_message(kind, order, user=None, to=None, items=None, template=None, connection=None):
+    template_name, subject = KINDS[kind]
+    user = user or order.user
+    template = template or get_template(template_name)
+    body = template.render({
+        'user': user,
+        'order': order,
+        'items': order.items.order_by('id') if items is None else items,
+        'now': timezone.now(),
+    })
+    message = EmailMessage(subject.format(order=order), body, to=[to or user.email], connection=connection)
+    message.content_subtype = "html"
+    return message
+
+
+# ---------------- Queueing ----------------
+
+def queue_order_confirmation(order):
+    """
+    Queues the confirmation email for a paid order. Returns None if the
+    customer has no email address or it was already queued.
+    """
+    if not order.user.email:
+        return None
+    try:
+        with transaction.atomic():
+            email = OutboundEmail.objects.create(kind=ORDER_CONFIRMATION, order=order, to=order.user.email)
+    except IntegrityError:
+        return None
+    schedule_sending()
+    return email
+
+
+def schedule_sending(delay=0):
+    # One queued run drains the whole outbox, so don't stack them up.
+    if not Job.objects.filter(task=SEND_TASK, status='queued').exists():
+        enqueue(SEND_TASK, priority=Job.PRIORITY_HIGH, delay=delay)
+
+
+# ---------------- Sending ----------------
+
+def is_transient(exc):
+    """
+    Whether a send error is worth retrying: dropped connections, timeouts
+    and 4xx replies are; 5xx replies (bad address, rejected content) aren't.
+    """
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code < 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code < 500
+    return isinstance(exc, OSError)
+
+
+def _claim(emails, now):
+    claimed = []
+    for email in emails:
+        if OutboundEmail.objects.filter(id=email.id, status='pending').update(status='sending', claimed_at=now):
+            claimed.append(email)
+    return claimed
+
+
+def _orders_for(emails):
+    items = Prefetch('items', queryset=OrderItem.objects.order_by('id'))
+    return Order.objects.select_related('user').prefetch_related(items).in_bulk(
+        {email.order_id for email in emails if email.order_id}
+    )
+
+
+def _finish(email, exc, max_attempts):
+    email.attempts += 1
+    if exc is None:
+        email.status, email.sent_at, email.last_error = 'sent', timezone.now(), ''
+    elif is_transient(exc) and email.attempts < max_attempts:
+        email.status, email.last_error = 'pending', str(exc)
+        email.send_after = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+    else:
+        email.status = 'failed'
+        email.last_error = ''.join(traceback.format_exception(exc))
+        logger.error(f"Giving up on {email.kind} email #{email.id} to {email.to}: {exc}")
+    email.save(update_fields=['status', 'attempts', 'send_after', 'sent_at', 'last_error'])
+    return email.status
+
+
+def _reopen(connection):
+    try:
+        connection.close()
+    except OSError:
+        pass
+    connection.open()
+
+
+def requeue_stale_emails(timeout=None):
+    timeout = timeout or getattr(settings, 'STORE_JOB_LOCK_TIMEOUT', 600)
+    return OutboundEmail.objects.filter(
+        status='sending', claimed_at__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(status='pending')
+
+
+def _send_batch(emails, orders, connection, templates, max_attempts, counts):
+    """
+    Sends one claimed batch. Returns False if the mail server went away, in
+    which case the unsent rest of the batch is back in the queue.
+    """
+    for n, email in enumerate(emails):
+        error = None
+        try:
+            order = orders.get(email.order_id)
+            if order is None:
+                raise LookupError(f"Order {email.order_id} no longer exists.")
+            template_name = KINDS[email.kind][0]
+            if template_name not in templates:
+                templates[template_name] = get_template(template_name)
+            build_message(email.kind, order, to=email.to, items=order.items.all(),
+                          template=templates[template_name], connection=connection).send()
+        except Exception as e:
+            error = e
+        counts[_finish(email, error, max_attempts)] += 1
+        if error is not None and is_transient(error):
+            try:
+                _reopen(connection)
+            except OSError as e:
+                logger.warning(f"Mail server unavailable, stopping this run: {e}")
+                for rest in emails[n + 1:]:
+                    counts[_finish(rest, e, max_attempts)] += 1
+                return False
+    return True
+
+
+def send_pending(batch_size=None, max_attempts=None, connection=None):
+    """
+    Sends due emails oldest first, a batch at a time, over one mail server
+    connection for the whole run, loading each template once per run.
+
+    A transient failure puts the email back in the queue with a backoff
+    and reconnects; if the server can't be reached again the run stops.
+    Other failures mark the email failed. Returns counts and throughput.
+    """
+    batch_size = batch_size or getattr(settings, 'STORE_EMAIL_BATCH_SIZE', 50)
+    max_attempts = max_attempts or getattr(settings, 'STORE_EMAIL_MAX_ATTEMPTS', 5)
+    connection = connection or get_connection()
+    requeue_stale_emails()
+    counts = {'sent': 0, 'pending': 0, 'failed': 0, 'batches': 0}
+    templates = {}
+    started = time.perf_counter()
+
+    with connection:
+        while True:
+            batch = list(
+                OutboundEmail.objects.filter(status='pending', send_after__lte=timezone.now())
+                .order_by('send_after', 'id')[:batch_size]
+            )
+            if not batch:
+                break
+            emails = _claim(batch, timezone.now())
+            counts['batches'] += 1
+            if not _send_batch(emails, _orders_for(emails), connection, templates, max_attempts, counts):
+                break
+
+    elapsed = time.perf_counter() - started
+    counts['seconds'] = round(elapsed, 3)
+    counts['per_second'] = round(counts['sent'] / elapsed, 1) if elapsed else 0.0
+    if counts['pending']:
+        schedule_sending(delay=retry_delay(1))
+    if counts['batches']:
+        logger.info(
+            f"Sent {counts['sent']} emails in {counts['batches']} batches "
+            f"({counts['per_second']}/s); {counts['pending']} to retry, {counts['failed']} failed"
+        )
+    return counts
+
+
+def queue_stats():
+    """Outbox depth for monitoring: pending and failed counts, and how long the oldest pending email has waited."""
+    pending = OutboundEmail.objects.filter(status='pending')
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'pending': pending.count(),
+        'failed': OutboundEmail.objects.filter(status='failed').count(),
+        'oldest_pending_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0,
+    }
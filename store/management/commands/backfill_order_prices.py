@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from store.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills in the price snapshot on order items created before snapshots existed, "
+        "using the product's current price and name."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--recalculate-totals', action='store_true',
+            help="Also reset the totals of the backfilled orders to the sum of their items. "
+                 "By default the totals customers were charged are left alone.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        filled, order_ids = 0, set()
+        while True:
+            with transaction.atomic():
+                items = list(
+                    OrderItem.objects.filter(price__isnull=True)
+                    .select_related('product')
+                    .order_by('id')[:batch_size]
+                )
+                if not items:
+                    break
+                for item in items:
+                    item.snapshot()
+                    order_ids.add(item.order_id)
+                OrderItem.objects.bulk_update(items, ['product_name', 'price', 'line_total'])
+            filled += len(items)
+            self.stdout.write(f"  {filled} items...")
+
+        if options['recalculate_totals'] and order_ids:
+            items_total = (
+                OrderItem.objects.filter(order=OuterRef('pk'))
+                .values('order')
+                .annotate(total=Sum('line_total'))
+                .values('total')
+            )
+            output_field = DecimalField(max_digits=10, decimal_places=2)
+            Order.objects.filter(id__in=order_ids).update(
+                total_price=Coalesce(Subquery(items_total, output_field=output_field),
+                                     Value(Decimal('0.00')), output_field=output_field)
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {filled} order items across {len(order_ids)} orders."
+        ))
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares concurrent payment_initiate throughput served the WSGI way (a fixed "
+        "pool of blocking workers) against ASGI (one event loop), using the in-process "
+        "fake gateway with simulated latency. Runs in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help="Seconds the fake gateway takes per order.")
+        parser.add_argument('--sync-workers', type=int, default=8,
+                            help="Concurrent requests on the WSGI path, like gunicorn sync workers.")
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help="Requests in flight at once on the ASGI path.")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        tmp_path = None
+        if connection.vendor == 'sqlite':
+            # The WSGI path runs requests on several threads, which need a
+            # real file to share rather than the default in-memory database.
+            fd, tmp_path = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            connection.settings_dict['TEST']['NAME'] = tmp_path
+            connection.settings_dict['OPTIONS'].setdefault('timeout', 60)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        setup_test_environment()
+        try:
+            with override_settings(STORE_PAYMENT_GATEWAY='fake', STORE_FAKE_GATEWAY_LATENCY=options['latency']):
+                self._run(options)
+        finally:
+            from store.payments import reset_gateway
+
+            reset_gateway()
+            teardown_test_environment()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _run(self, options):
+        from django.contrib.auth.models import User
+        from store.models import Category, Order, OrderItem, Product
+        from store.payments import reset_gateway
+
+        reset_gateway()
+        category = Category.objects.create(name="Bench", slug="bench")
+        product = Product.objects.create(name="Bench item", slug="bench-item", category=category, price=250, stock=10_000)
+        users = User.objects.bulk_create([User(username=f"payer-{i}") for i in range(options['requests'])])
+        orders = Order.objects.bulk_create([Order(user=user, total_price=250) for user in users])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, product_name=product.name, price=250, line_total=250)
+            for order in orders
+        ])
+        url = reverse('payment_initiate')
+        self.stdout.write(
+            f"{options['requests']} payment_initiate requests, fake gateway latency {options['latency'] * 1000:.0f}ms"
+        )
+
+        # ---- WSGI: blocking workers ----
+        clients = []
+        for user, order in zip(users, orders):
+            client = Client()
+            client.force_login(user)
+            session = client.session
+            session['order_id'] = order.id
+            session.save()
+            clients.append(client)
+
+        def call(client):
+            started = time.perf_counter()
+            response = client.get(url)
+            connections.close_all()
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['sync_workers']) as pool:
+            sync_results = list(pool.map(call, clients))
+        sync_elapsed = time.perf_counter() - started
+        self._report(f"WSGI, {options['sync_workers']} workers", sync_results, sync_elapsed)
+
+        # ---- ASGI: one event loop ----
+        Order.objects.update(razorpay_order_id=None)
+        async_results, async_elapsed = asyncio.run(self._run_async(users, orders, url, options['concurrency']))
+        self._report(f"ASGI, {options['concurrency']} in flight", async_results, async_elapsed)
+
+        created = Order.objects.exclude(razorpay_order_id=None).count()
+        self.stdout.write(f"  gateway orders recorded: {created}/{len(orders)}")
+        self.stdout.write(self.style.SUCCESS(f"ASGI throughput {sync_elapsed / async_elapsed:.1f}x WSGI."))
+
+    async def _run_async(self, users, orders, url, concurrency):
+        clients = []
+        for user, order in zip(users, orders):
+            client = AsyncClient()
+            await client.aforce_login(user)
+            session = await client.asession()
+            await session.aset('order_id', order.id)
+            await session.asave()
+            clients.append(client)
+
+        limit = asyncio.Semaphore(concurrency)
+
+        async def call(client):
+            async with limit:
+                started = time.perf_counter()
+                response = await client.get(url)
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call(client) for client in clients))
+        return results, time.perf_counter() - started
+
+    def _report(self, label, results, elapsed):
+        latencies = sorted(latency * 1000 for latency, _ in results)
+        statuses = {}
+        for _, status in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+        self.stdout.write(
+            f"  {label}: {len(results) / elapsed:.0f} req/s over {elapsed:.2f}s, "
+            f"p50 {statistics.median(latencies):.0f}ms, p95 {p95:.0f}ms, statuses {statuses}"
+        )
@@ -0,0 +1,106 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Sum
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Stress-tests stock holds: many threads check out the same SKU at once, "
+        "then the holds are expired. Fails if any unit is oversold or lost. "
+        "Runs in a throwaway test database; the real database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=100)
+        parser.add_argument('--checkouts', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--max-quantity', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        tmp_path = None
+        if connection.vendor == 'sqlite':
+            # The default SQLite test database lives in memory; the threads
+            # need a real file to contend on.
+            fd, tmp_path = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            connection.settings_dict['TEST']['NAME'] = tmp_path
+            connection.settings_dict['OPTIONS'].setdefault('timeout', 60)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._run(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _run(self, options):
+        from django.contrib.auth.models import User
+        from store.checkout import CheckoutError, CheckoutLine, place_order
+        from store.inventory import hold_ttl, release_expired_holds
+        from store.models import Address, Category, Product, StockHold
+
+        category = Category.objects.create(name="Bench", slug="bench")
+        product = Product.objects.create(
+            name="Contended SKU", slug="contended-sku", category=category, price=100, stock=options['stock']
+        )
+        users = User.objects.bulk_create(
+            [User(username=f"bench-{i}") for i in range(options['checkouts'])]
+        )
+        rng = random.Random(options['seed'])
+        quantities = [rng.randint(1, options['max_quantity']) for _ in users]
+
+        lock = threading.Lock()
+        outcome = {'placed': 0, 'rejected': 0, 'errors': 0}
+
+        def checkout(user, quantity):
+            address = Address(full_name=user.username, phone="0000000000", address_line1="1 Bench Street",
+                              city="Bench", state="Bench", postal_code="000000", country="India")
+            try:
+                place_order(user, address, [CheckoutLine(product, quantity)], clear_cart=False)
+                key = 'placed'
+            except CheckoutError:
+                key = 'rejected'
+            except Exception as e:
+                self.stderr.write(f"{user.username}: {e}")
+                key = 'errors'
+            finally:
+                connections.close_all()
+            with lock:
+                outcome[key] += 1
+
+        self.stdout.write(
+            f"{options['checkouts']} checkouts of up to {options['max_quantity']} units "
+            f"against {options['stock']} in stock, {options['threads']} threads..."
+        )
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            list(pool.map(checkout, users, quantities))
+        elapsed = time.perf_counter() - started
+
+        product.refresh_from_db()
+        held = StockHold.objects.filter(product=product, status='held').aggregate(total=Sum('quantity'))['total'] or 0
+        self.stdout.write(
+            f"  placed {outcome['placed']}, rejected {outcome['rejected']}, errors {outcome['errors']} "
+            f"in {elapsed:.2f}s ({options['checkouts'] / elapsed:.0f} checkouts/s)"
+        )
+        self.stdout.write(f"  held {held} units, {product.stock} left in stock")
+        if product.stock < 0 or held + product.stock != options['stock']:
+            raise CommandError("Oversold: held units and remaining stock don't add up to the starting stock.")
+
+        released = release_expired_holds(now=timezone.now() + hold_ttl())
+        product.refresh_from_db()
+        self.stdout.write(f"  expired {released} holds, {product.stock} back in stock")
+        if product.stock != options['stock']:
+            raise CommandError("Releasing expired holds did not restore the starting stock.")
+        self.stdout.write(self.style.SUCCESS("No oversell."))
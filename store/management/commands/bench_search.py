@@ -0,0 +1,98 @@
+import random
+import statistics
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks product search latency against a synthetic catalog. "
+        "Runs in a throwaway test database; the real database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--backend', choices=['fts5', 'python', 'both'], default='both')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, options):
+        from store.models import Category, Product
+
+        rng = random.Random(options['seed'])
+        vocabulary = [
+            ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))) for _ in range(5000)
+        ]
+        categories = Category.objects.bulk_create(
+            [Category(name=f"Category {i}", slug=f"category-{i}") for i in range(50)]
+        )
+
+        self.stdout.write(f"Creating {options['products']} products...")
+        batch = []
+        for i in range(options['products']):
+            batch.append(Product(
+                name=' '.join(rng.choices(vocabulary, k=rng.randint(2, 5))),
+                slug=f"bench-{i}",
+                description=' '.join(rng.choices(vocabulary, k=25)),
+                category=rng.choice(categories),
+                price=rng.randint(1, 5000),
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+
+        queries = []
+        for _ in range(options['queries']):
+            words = rng.choices(vocabulary, k=rng.randint(1, 2))
+            # Half the queries end in a partial word to exercise prefix matching.
+            if rng.random() < 0.5:
+                words[-1] = words[-1][:3]
+            queries.append(' '.join(words))
+
+        backends = ['fts5', 'python'] if options['backend'] == 'both' else [options['backend']]
+        for name in backends:
+            # The backend is cached per process; drop it on the way in and out
+            # so neither the next run nor anything after us keeps this one.
+            with override_settings(STORE_SEARCH_BACKEND=name):
+                search.reset_backend()
+                try:
+                    self._bench(name, queries)
+                finally:
+                    search.reset_backend()
+
+    def _bench(self, name, queries):
+        backend = search.get_backend()
+        if backend.name != name:
+            self.stderr.write(f"{name}: not available in this database, skipped.")
+            return
+
+        start = time.perf_counter()
+        search.rebuild_index(chunk_size=5000)
+        build = time.perf_counter() - start
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            search.search_product_ids(query, limit=24)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f"{name:>6}: index build {build:.1f}s | "
+            f"p50 {statistics.median(timings):.2f}ms  p95 {p95:.2f}ms  max {timings[-1]:.2f}ms"
+        )
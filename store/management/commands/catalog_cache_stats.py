@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from store.catalog_cache import reset_stats, stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Shows hit/miss counts for the catalog read cache, per read, summed over "
+        "every process sharing the cache (all of them with the file or redis backend)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the counters after printing them.")
+
+    def handle(self, *args, **options):
+        for read, counts in stats().items():
+            rate = f"{counts['hit_rate']}%" if counts['hit_rate'] is not None else "-"
+            self.stdout.write(
+                f"{read:<14} {counts['hit']:>8} hits {counts['miss']:>8} misses "
+                f"{counts['wait']:>6} waited   hit rate {rate}"
+            )
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset."))
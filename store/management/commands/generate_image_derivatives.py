@@ -0,0 +1,56 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from store.images import build_derivatives, derivative_formats, derivative_widths
+from store.models import Product
+
+
+def _init_worker():
+    import django
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates resized WebP/AVIF copies of product images that don't have current "
+        "ones, resizing across a process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('--force', action='store_true', help="Regenerate even if derivatives are current.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.order_by('id').only('id', 'image', 'uploaded_image', 'image_derivatives')
+        self.stdout.write(
+            f"Widths {', '.join(map(str, derivative_widths()))}px as {', '.join(derivative_formats())}, "
+            f"{options['workers']} workers"
+        )
+        started = time.perf_counter()
+        rendered = failed = 0
+        # Pool processes must not share the parent's database connections.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            chunk = []
+            for product in products.iterator(chunk_size=options['chunk_size']):
+                if options['force']:
+                    product.image_derivatives = {}
+                chunk.append(product)
+                if len(chunk) == options['chunk_size']:
+                    done, errors = build_derivatives(chunk, executor=pool)
+                    rendered, failed, chunk = rendered + done, failed + errors, []
+            if chunk:
+                done, errors = build_derivatives(chunk, executor=pool)
+                rendered, failed = rendered + done, failed + errors
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} images ({failed} failed) in {elapsed:.1f}s, "
+            f"{rendered / elapsed if elapsed else 0:.1f} images/s."
+        ))
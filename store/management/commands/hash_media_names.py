@@ -0,0 +1,65 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store import catalog_cache
+from store.models import Product, Profile
+from store.storage import HASHED_DIRS, MediaStorage, name_digest
+
+FIELDS = ((Product, 'image'), (Product, 'uploaded_image'), (Profile, 'profile_picture'))
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies product and profile images stored before content-hashed names to "
+        "hashed names and points their rows at the copies, so they get long-lived "
+        "cacheable URLs too. The old files are left in place for pages still linking them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, MediaStorage):
+            raise CommandError("STORAGES['default'] must be store.storage.MediaStorage to hash names.")
+        renamed = missing = 0
+        for model, field in FIELDS:
+            names = (
+                model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                .values_list(field, flat=True).distinct()
+            )
+            for name in list(names):
+                if not name.startswith(HASHED_DIRS) or name_digest(name):
+                    continue
+                if not default_storage.exists(name):
+                    self.stderr.write(f"Missing {name}")
+                    missing += 1
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(name)
+                    renamed += 1
+                    continue
+                with default_storage.open(name, 'rb') as f:
+                    new_name = default_storage.save(name, f)
+                self._repoint(model, field, name, new_name)
+                renamed += 1
+
+        if renamed and not options['dry_run']:
+            catalog_cache.bump('product')
+        verb = "Would rename" if options['dry_run'] else "Renamed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {renamed} files ({missing} missing)."))
+
+    def _repoint(self, model, field, name, new_name):
+        rows = model.objects.filter(**{field: name})
+        if model is not Product:
+            rows.update(**{field: new_name})
+            return
+        # Keep derivatives current for the new name, and move updated_at so
+        # cached product pages pick up the new URL.
+        for product in rows.only('id', 'image_derivatives'):
+            derivatives = product.image_derivatives or {}
+            if derivatives.get('source') == name:
+                derivatives['source'] = new_name
+            Product.objects.filter(pk=product.pk).update(
+                **{field: new_name}, image_derivatives=derivatives, updated_at=timezone.now()
+            )
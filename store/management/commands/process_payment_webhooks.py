@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from store.webhooks import process_pending
+
+
+class Command(BaseCommand):
+    help = "Applies recorded payment webhook events that are still pending."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        counts = process_pending(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            ", ".join(f"{count} {status}" for status, count in counts.items())
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from store import facets
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts every product's review aggregates (count, sum, average, star "
+        "histogram) from the Review table. Normally they are kept current on each "
+        "review write; use this to repair them after bulk edits that bypass signals."
+    )
+
+    def handle(self, *args, **options):
+        product_ids = []
+        for product in Product.objects.only('id').iterator():
+            product.recalculate_ratings()
+            product_ids.append(product.id)
+        facets.sync_product_facets(product_ids)
+        self.stdout.write(self.style.SUCCESS(f"Recounted ratings for {len(product_ids)} products."))
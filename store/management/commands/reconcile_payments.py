@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.reconcile import reconcile_orders
+
+
+class Command(BaseCommand):
+    help = "Checks unpaid orders against captured Razorpay payments and marks matches paid."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="How far back to look.")
+        parser.add_argument('--min-age', type=int, default=30,
+                            help="Skip orders younger than this many minutes.")
+        parser.add_argument('--page-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true', help="Report matches without changing orders.")
+
+    def handle(self, *args, **options):
+        counts = reconcile_orders(
+            since=timezone.now() - timedelta(days=options['days']),
+            min_age=timedelta(minutes=options['min_age']),
+            page_size=options['page_size'],
+            dry_run=options['dry_run'],
+        )
+        verb = "would be marked" if options['dry_run'] else "marked"
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {counts['checked']} unpaid orders: {counts['paid']} {verb} paid, "
+            f"{counts['unmatched']} with no captured payment."
+        ))
@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from store.models import Order, Invoice
+
+
+def _init_worker():
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def _render(order_id, force):
+    """
+    Runs in a pool process. Writes the PDF file and returns the row data for
+    the parent to record, or None if the stored invoice is already current.
+    """
+    from store.invoices import invoice_items, invoice_fingerprint, render_invoice, write_invoice_file
+
+    order = Order.objects.select_related('user').get(id=order_id)
+    items = invoice_items(order)
+    fingerprint = invoice_fingerprint(order, items)
+    if not force and Invoice.objects.filter(order_id=order_id, fingerprint=fingerprint).exists():
+        return None
+    content = render_invoice(order, items)
+    return order_id, fingerprint, write_invoice_file(content), len(content)
+
+
+class Command(BaseCommand):
+    help = "Renders missing or outdated invoice PDFs in parallel across a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--all', action='store_true', help="Include unpaid orders.")
+        parser.add_argument('--force', action='store_true', help="Re-render even if the stored invoice is current.")
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all() if options['all'] else Order.objects.filter(is_paid=True)
+        order_ids = list(orders.order_by('id').values_list('id', flat=True))
+        if not order_ids:
+            self.stdout.write("No orders to render.")
+            return
+
+        # Pool processes must not share the parent's database connections.
+        connections.close_all()
+        rendered, failed, pending = 0, 0, []
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            futures = {pool.submit(_render, order_id, options['force']): order_id for order_id in order_ids}
+            for future in as_completed(futures):
+                try:
+                    row = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Order #{futures[future]}: {e}")
+                    continue
+                if row:
+                    pending.append(row)
+                if len(pending) >= options['batch_size']:
+                    rendered += self._record(pending)
+                    pending = []
+        rendered += self._record(pending)
+
+        skipped = len(order_ids) - rendered - failed
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} invoices ({skipped} already current, {failed} failed)."
+        ))
+
+    def _record(self, rows):
+        Invoice.objects.bulk_create(
+            [Invoice(order_id=order_id, fingerprint=fingerprint, digest=digest, size=size)
+             for order_id, fingerprint, digest, size in rows],
+            update_conflicts=True,
+            unique_fields=['order'],
+            update_fields=['fingerprint', 'digest', 'size', 'rendered_at'],
+        )
+        return len(rows)
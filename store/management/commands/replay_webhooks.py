@@ -0,0 +1,188 @@
+import hashlib
+import hmac
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+
+def razorpay_event(event_type, order_id, payment_id, amount, created_at):
+    """
+    A webhook body shaped like Razorpay's, with only the fields we read.
+    """
+    return {
+        'entity': 'event',
+        'account_id': 'acc_replay',
+        'event': event_type,
+        'contains': ['payment'],
+        'payload': {
+            'payment': {
+                'entity': {
+                    'id': payment_id,
+                    'entity': 'payment',
+                    'amount': amount,
+                    'currency': 'INR',
+                    'status': 'captured' if event_type == 'payment.captured' else 'failed',
+                    'order_id': order_id,
+                },
+            },
+        },
+        'created_at': created_at,
+    }
+
+
+def sign(body, secret):
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests the Razorpay webhook with signed, replayed events, including "
+        "repeat deliveries. Without --url, runs in-process against a throwaway test "
+        "database, then processes the recorded events and checks every order was "
+        "paid exactly once. With --url, posts to a running server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--duplicates', type=float, default=0.3,
+                            help="Fraction of events delivered a second time.")
+        parser.add_argument('--failures', type=float, default=0.1,
+                            help="Fraction of orders that see a payment.failed before the capture.")
+        parser.add_argument('--url', help="Webhook URL of a running server.")
+        parser.add_argument('--secret', help="Webhook secret (defaults to RAZORPAY_WEBHOOK_SECRET).")
+        parser.add_argument('--concurrency', type=int, default=16, help="Parallel requests with --url.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        secret = options['secret'] or settings.RAZORPAY_WEBHOOK_SECRET or 'replay-secret'
+        if options['url']:
+            self._replay_http(options, secret)
+            return
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        setup_test_environment()
+        try:
+            with override_settings(RAZORPAY_WEBHOOK_SECRET=secret):
+                self._replay_in_process(options, secret)
+        finally:
+            teardown_test_environment()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _deliveries(self, razorpay_order_ids, options):
+        """
+        Returns (event_id, body) pairs: one capture per order, some preceded by
+        a failed attempt, a share repeated, all shuffled.
+        """
+        created_at = int(time.time())
+        events = []
+        for n, order_id in enumerate(razorpay_order_ids):
+            if self.rng.random() < options['failures']:
+                events.append((f'evt_fail_{n}', razorpay_event(
+                    'payment.failed', order_id, f'pay_fail_{n}', 10000, created_at + 2 * n)))
+            events.append((f'evt_cap_{n}', razorpay_event(
+                'payment.captured', order_id, f'pay_{n}', 10000, created_at + 2 * n + 1)))
+        deliveries = [(event_id, json.dumps(payload).encode('utf-8')) for event_id, payload in events]
+        deliveries += self.rng.sample(deliveries, int(len(deliveries) * options['duplicates']))
+        self.rng.shuffle(deliveries)
+        return deliveries, len(events)
+
+    def _report(self, latencies, statuses):
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+        self.stdout.write(
+            f"  {len(latencies)} deliveries: p50 {statistics.median(latencies):.2f}ms, "
+            f"p95 {p95:.2f}ms, max {latencies[-1]:.2f}ms"
+        )
+        self.stdout.write("  responses: " + ", ".join(f"{k} {v}" for k, v in sorted(statuses.items())))
+
+    def _replay_in_process(self, options, secret):
+        from django.contrib.auth.models import User
+        from store.models import Order, PaymentWebhook
+        from store.webhooks import process_pending
+
+        user = User.objects.create_user('replay')
+        orders = Order.objects.bulk_create([
+            Order(user=user, total_price=100, razorpay_order_id=f'order_replay_{n}')
+            for n in range(options['orders'])
+        ])
+        deliveries, unique = self._deliveries([order.razorpay_order_id for order in orders], options)
+
+        client = Client()
+        url = reverse('razorpay_webhook')
+        latencies, statuses = [], {}
+        self.stdout.write(f"Replaying {len(deliveries)} deliveries of {unique} events in-process...")
+        for event_id, body in deliveries:
+            started = time.perf_counter()
+            response = client.post(url, data=body, content_type='application/json', headers={
+                'X-Razorpay-Signature': sign(body, secret),
+                'X-Razorpay-Event-Id': event_id,
+            })
+            latencies.append((time.perf_counter() - started) * 1000)
+            key = response.json().get('status', str(response.status_code))
+            statuses[key] = statuses.get(key, 0) + 1
+        self._report(latencies, statuses)
+
+        started = time.perf_counter()
+        counts = process_pending()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"  processed in {elapsed:.2f}s: " + ", ".join(f"{k} {v}" for k, v in counts.items())
+        )
+
+        stored = PaymentWebhook.objects.count()
+        paid = Order.objects.filter(is_paid=True, status='paid').count()
+        if stored != unique:
+            raise CommandError(f"Stored {stored} events, expected {unique}.")
+        if paid != len(orders):
+            raise CommandError(f"{paid} of {len(orders)} orders paid.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored each of the {unique} events once; all {paid} orders paid."
+        ))
+
+    def _replay_http(self, options, secret):
+        order_ids = [f'order_replay_{n}' for n in range(options['orders'])]
+        deliveries, unique = self._deliveries(order_ids, options)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=options['concurrency'])
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        def post(delivery):
+            event_id, body = delivery
+            started = time.perf_counter()
+            response = session.post(options['url'], data=body, timeout=10, headers={
+                'Content-Type': 'application/json',
+                'X-Razorpay-Signature': sign(body, secret),
+                'X-Razorpay-Event-Id': event_id,
+            })
+            try:
+                status = response.json().get('status', str(response.status_code))
+            except ValueError:
+                status = str(response.status_code)
+            return (time.perf_counter() - started) * 1000, status
+
+        self.stdout.write(
+            f"Posting {len(deliveries)} deliveries of {unique} events to {options['url']} "
+            f"with {options['concurrency']} connections..."
+        )
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(post, deliveries))
+        elapsed = time.perf_counter() - started
+        statuses = {}
+        for _, status in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        self._report([latency for latency, _ in results], statuses)
+        self.stdout.write(f"  {len(results) / elapsed:.0f} requests/s")
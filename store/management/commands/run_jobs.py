@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.jobs import Worker
+from store.models import Job
+
+
+class Command(BaseCommand):
+    help = "Runs a background job worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lanes', default='high,default,low',
+            help="Comma-separated priority lanes to serve, e.g. 'high' for a dedicated fast-lane worker.",
+        )
+        parser.add_argument('--burst', action='store_true', help="Exit once the queue is empty.")
+        parser.add_argument('--max-jobs', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=None)
+
+    def handle(self, *args, **options):
+        lanes = {label.lower(): value for value, label in Job.PRIORITY_CHOICES}
+        try:
+            priorities = [lanes[lane.strip()] for lane in options['lanes'].split(',') if lane.strip()]
+        except KeyError as e:
+            raise CommandError(f"Unknown lane {e}; choose from {', '.join(lanes)}.")
+
+        worker = Worker(priorities=priorities, poll_interval=options['poll_interval'])
+        self.stdout.write(f"Worker {worker.name} serving lanes: {options['lanes']}")
+        processed = worker.run(burst=options['burst'], max_jobs=options['max_jobs'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs."))
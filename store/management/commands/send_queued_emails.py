@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from store.mailer import queue_stats, send_pending
+
+
+class Command(BaseCommand):
+    help = "Sends queued transactional emails in batches over one mail server connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        counts = send_pending(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['sent']} sent in {counts['batches']} batches over {counts['seconds']}s "
+            f"({counts['per_second']}/s), {counts['pending']} to retry, {counts['failed']} failed"
+        ))
+        stats = queue_stats()
+        self.stdout.write(
+            f"Outbox: {stats['pending']} pending (oldest {stats['oldest_pending_seconds']:.0f}s), "
+            f"{stats['failed']} failed"
+        )
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+FTS_TABLE = 'store_product_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return  # Other databases use the in-memory fallback index in store.search
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "category_id UNINDEXED, name, description, category, tags, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        except Exception:
+            return  # SQLite built without FTS5
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, category_id, name, description, category, tags) "
+            "SELECT p.id, p.category_id, p.name, p.description, c.name, "
+            "COALESCE((SELECT group_concat(t.name, ' ') FROM store_producttag pt "
+            "JOIN store_tag t ON t.id = pt.tag_id WHERE pt.product_id = p.id), '') "
+            "FROM store_product p JOIN store_category c ON c.id = p.category_id "
+            "WHERE p.is_archived = 0 AND p.is_available = 1"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0011_product_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2 on 2026-10-18 20:12
+
+import django.db.models.deletion
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+
+
+def populate_facets(apps, schema_editor):
+    from store.facets import facet_values
+
+    Product = apps.get_model('store', 'Product')
+    ProductTag = apps.get_model('store', 'ProductTag')
+    ProductFacet = apps.get_model('store', 'ProductFacet')
+    FacetCount = apps.get_model('store', 'FacetCount')
+
+    tags = defaultdict(list)
+    for product_id, tag_id in ProductTag.objects.values_list('product_id', 'tag_id'):
+        tags[product_id].append(tag_id)
+
+    totals = Counter()
+    rows = []
+    products = Product.objects.filter(is_archived=False, is_available=True).values_list(
+        'id', 'category_id', 'price', 'average_rating', 'stock'
+    )
+    for pk, category_id, price, average_rating, stock in products.iterator():
+        for facet, value in facet_values(category_id, price, average_rating, stock, tags[pk]):
+            rows.append(ProductFacet(product_id=pk, facet=facet, value=value))
+            totals[(facet, value)] += 1
+    ProductFacet.objects.bulk_create(rows, batch_size=2000)
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value, count=count) for (facet, value), count in totals.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('category', 'Category'), ('tag', 'Tag'), ('price', 'Price'), ('rating', 'Rating'), ('availability', 'Availability')], max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('facet', 'value')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('category', 'Category'), ('tag', 'Tag'), ('price', 'Price'), ('rating', 'Rating'), ('availability', 'Availability')], max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='store.product')),
+            ],
+            options={
+                'unique_together': {('product', 'facet', 'value')},
+            },
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-18 20:29
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+logger = logging.getLogger(__name__)
+
+
+def clear_blank_and_duplicate_ids(apps, schema_editor):
+    # Blank strings would collide under the unique index; NULLs don't. If a
+    # Razorpay order ID was ever stored on more than one order, keep it on
+    # the newest one and log every order it is taken off, so they can be
+    # matched to their payments by hand.
+    Order = apps.get_model('store', 'Order')
+    Order.objects.filter(razorpay_order_id='').update(razorpay_order_id=None)
+    duplicates = (
+        Order.objects.exclude(razorpay_order_id=None)
+        .values('razorpay_order_id')
+        .annotate(copies=Count('id'), newest=Max('id'))
+        .filter(copies__gt=1)
+    )
+    for row in duplicates:
+        older = Order.objects.filter(razorpay_order_id=row['razorpay_order_id']).exclude(id=row['newest'])
+        older_ids = sorted(older.values_list('id', flat=True))
+        logger.warning(
+            f"Razorpay order {row['razorpay_order_id']} was stored on orders {older_ids + [row['newest']]}; "
+            f"kept on #{row['newest']} and cleared from {older_ids}"
+        )
+        older.update(razorpay_order_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_payment_webhook_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_blank_and_duplicate_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='razorpay_order_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
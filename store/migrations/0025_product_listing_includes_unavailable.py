@@ -0,0 +1,73 @@
+# Generated by Django 5.2 on 2026-10-18 21:29
+
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+from django.db.models import F
+
+FTS_TABLE = 'store_product_fts'
+
+
+def list_unavailable_products(apps, schema_editor):
+    # Products marked unavailable were left out of the search index and the
+    # facets while the listing excluded them; add them now that it doesn't.
+    from store.facets import facet_values
+
+    Product = apps.get_model('store', 'Product')
+    ProductTag = apps.get_model('store', 'ProductTag')
+    ProductFacet = apps.get_model('store', 'ProductFacet')
+    FacetCount = apps.get_model('store', 'FacetCount')
+
+    products = Product.objects.filter(is_archived=False, is_available=False)
+    ids = list(products.values_list('id', flat=True))
+    if not ids:
+        return
+
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            if cursor.fetchone():
+                cursor.execute(
+                    f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, category_id, name, description, category, tags) "
+                    "SELECT p.id, p.category_id, p.name, p.description, c.name, "
+                    "COALESCE((SELECT group_concat(t.name, ' ') FROM store_producttag pt "
+                    "JOIN store_tag t ON t.id = pt.tag_id WHERE pt.product_id = p.id), '') "
+                    "FROM store_product p JOIN store_category c ON c.id = p.category_id "
+                    "WHERE p.is_archived = 0 AND p.is_available = 0"
+                )
+
+    tags = defaultdict(list)
+    for product_id, tag_id in ProductTag.objects.filter(product_id__in=ids).values_list('product_id', 'tag_id'):
+        tags[product_id].append(tag_id)
+    totals = Counter()
+    rows = []
+    for pk, category_id, price, average_rating, stock in products.values_list(
+        'id', 'category_id', 'price', 'average_rating', 'stock'
+    ).iterator():
+        for facet, value in facet_values(category_id, price, average_rating, stock, tags[pk]):
+            rows.append(ProductFacet(product_id=pk, facet=facet, value=value))
+            totals[(facet, value)] += 1
+    ProductFacet.objects.bulk_create(rows, batch_size=2000)
+    for (facet, value), count in totals.items():
+        FacetCount.objects.get_or_create(facet=facet, value=value)
+        FacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_listing_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_archived', 'created_at', 'id'], name='product_listing_idx'),
+        ),
+        migrations.RunPython(list_unavailable_products, migrations.RunPython.noop),
+    ]
@@ -5,7 +5,10 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.urls import reverse
 from django.utils import timezone
 from django.templatetags.static import static
+from django.core.files.storage import default_storage
 from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
 
 
 # ---------------- Category ----------------
@@ -34,6 +37,16 @@ class Tag(models.Model):
 
 
 # ---------------- Product ----------------
+class ProductQuerySet(models.QuerySet):
+    def listed(self):
+        """
+        Products shown in the storefront catalog: everything not archived,
+        including products marked unavailable. Matches the leading columns of
+        `product_listing_idx` so listings are an index range scan.
+        """
+        return self.filter(is_archived=False)
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     slug = models.SlugField(unique=True, blank=True)
@@ -44,10 +57,33 @@ class Product(models.Model):
     is_available = models.BooleanField(default=True)
     uploaded_image = models.ImageField(upload_to='uploaded_products/', blank=True, null=True)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Resized WebP/AVIF copies of the displayed image, written by store.images:
+    # {'source': name, 'width': w, 'height': h, 'formats': {'webp': [[width, name], ...]}}
+    image_derivatives = models.JSONField(default=dict, blank=True)
+    # Review aggregates, kept current by store.signals with F() increments
+    # so the product page never has to read the Review table for them.
     average_rating = models.FloatField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
     is_archived = models.BooleanField(default=False)
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Versions the cached product page (store.product_page). Queryset
+    # update()s of anything the page shows must set it too, see touch().
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_archived', 'created_at', 'id'], name='product_listing_idx'),
+            models.Index(fields=['category', 'created_at'], name='product_category_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -60,10 +96,63 @@ class Product(models.Model):
             self.slug = slug
         super().save(*args, **kwargs)
 
-    def update_average_rating(self):
-        avg = self.reviews.aggregate(models.Avg('rating'))['rating__avg'] or 0
-        self.average_rating = round(avg, 1)
-        self.save()
+    @classmethod
+    def touch(cls, product_ids):
+        """Marks products changed without a save(), e.g. when a variant or tag changes."""
+        return cls.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+
+    @classmethod
+    def apply_rating_change(cls, product_id, added=None, removed=None):
+        """
+        Moves one review's rating into (`added`) and/or out of (`removed`)
+        the product's aggregates. Counts change by F() increments, so
+        concurrent reviews never overwrite each other; the average is then
+        derived from the updated row.
+        """
+        if added == removed:
+            return
+        changes = {
+            'rating_sum': models.F('rating_sum') + (added or 0) - (removed or 0),
+            'updated_at': timezone.now(),
+        }
+        if added:
+            changes[f'rating_{added}_count'] = models.F(f'rating_{added}_count') + 1
+        if removed:
+            changes[f'rating_{removed}_count'] = models.F(f'rating_{removed}_count') - 1
+        if not (added and removed):
+            changes['review_count'] = models.F('review_count') + (1 if added else -1)
+        product = cls.objects.filter(pk=product_id)
+        with transaction.atomic():
+            product.update(**changes)
+            product.update(average_rating=Coalesce(
+                Round(Cast('rating_sum', models.FloatField()) / NullIf('review_count', 0), 1), 0.0
+            ))
+
+    def recalculate_ratings(self):
+        """Recounts the aggregates from the Review table (for repairs and backfills)."""
+        totals = self.reviews.aggregate(
+            review_count=models.Count('id'),
+            rating_sum=Coalesce(models.Sum('rating'), 0),
+            **{f'rating_{stars}_count': models.Count('id', filter=models.Q(rating=stars)) for stars in range(1, 6)},
+        )
+        totals['average_rating'] = round(totals['rating_sum'] / totals['review_count'], 1) if totals['review_count'] else 0
+        totals['updated_at'] = timezone.now()
+        Product.objects.filter(pk=self.pk).update(**totals)
+        for field, value in totals.items():
+            setattr(self, field, value)
+
+    @property
+    def rounded_rating(self):
+        return int(self.average_rating + 0.5)
+
+    @property
+    def rating_histogram(self):
+        """(stars, count, percent of reviews) from 5 stars down, for distribution bars."""
+        return [
+            (stars, count, round(100 * count / self.review_count) if self.review_count else 0)
+            for stars in range(5, 0, -1)
+            for count in [getattr(self, f'rating_{stars}_count')]
+        ]
 
     @property
     def display_image(self):
@@ -73,6 +162,30 @@ class Product(models.Model):
             return self.image.url if hasattr(self.image, 'url') else None
         return static('store/images/default_product.png')
 
+    @property
+    def display_sources(self):
+        """
+        <source> candidates for display_image, best format first, as
+        [{'type': ..., 'srcset': ...}]. Empty until derivatives of the
+        current image exist, in which case templates fall back to display_image.
+        """
+        derivatives = self.image_derivatives or {}
+        if derivatives.get('source') != (self.uploaded_image.name or self.image.name):
+            return []
+        return [
+            {
+                'type': f'image/{fmt}',
+                'srcset': ", ".join(f"{default_storage.url(name)} {width}w" for width, name in candidates),
+            }
+            for fmt, candidates in derivatives.get('formats', {}).items()
+        ]
+
+    @property
+    def display_size(self):
+        """(width, height) of the displayed image if known, for layout-stable <img> tags."""
+        derivatives = self.image_derivatives or {}
+        return derivatives.get('width'), derivatives.get('height')
+
     @property
     def get_display_price(self):
         return f"₹{self.price:.2f}"
@@ -96,6 +209,44 @@ class ProductTag(models.Model):
         return f"{self.product.name} → {self.tag.name}"
 
 
+# ---------------- Facets ----------------
+FACET_CHOICES = (
+    ('category', 'Category'),
+    ('tag', 'Tag'),
+    ('price', 'Price'),
+    ('rating', 'Rating'),
+    ('availability', 'Availability'),
+)
+
+
+class ProductFacet(models.Model):
+    """
+    The facet values a listed product currently counts towards. Kept so a
+    product write can be diffed against what was counted before.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='facets')
+    facet = models.CharField(max_length=20, choices=FACET_CHOICES)
+    value = models.CharField(max_length=50)
+
+    class Meta:
+        unique_together = ('product', 'facet', 'value')
+
+    def __str__(self):
+        return f"{self.product_id}: {self.facet}={self.value}"
+
+
+class FacetCount(models.Model):
+    facet = models.CharField(max_length=20, choices=FACET_CHOICES)
+    value = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('facet', 'value')
+
+    def __str__(self):
+        return f"{self.facet}={self.value} ({self.count})"
+
+
 # ---------------- Product Variant ----------------
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants')
@@ -143,6 +294,7 @@ class Order(models.Model):
         ('shipped', 'Shipped'),
         ('delivered', 'Delivered'),
         ('cancelled', 'Cancelled'),
+        ('refunded', 'Refunded'),
     ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
@@ -154,7 +306,7 @@ class Order(models.Model):
     shipping_address = models.ForeignKey('Address', on_delete=models.CASCADE, null=True, blank=True)
 
     # Razorpay fields
-    razorpay_order_id = models.CharField(max_length=100, blank=True, null=True)
+    razorpay_order_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     razorpay_payment_id = models.CharField(max_length=100, blank=True, null=True)
     razorpay_signature = models.CharField(max_length=255, blank=True, null=True)
 
@@ -168,22 +320,117 @@ class Order(models.Model):
         self.save()
 
     def cancel_order(self):
+        from .inventory import release_holds
+
         self.status = 'cancelled'
         self.save()
+        release_holds(self)
 
     def update_total_price(self):
-        self.total_price = sum(
-            item.product.price * item.quantity for item in self.items.all()
-        )
-        self.save()
+        """
+        Recomputes the total from the items' price snapshots with one
+        aggregate query. Item saves and deletes keep it current on their own;
+        this is for repairs and for items written with bulk_create.
+        """
+        self.total_price = self.items.aggregate(total=models.Sum('line_total'))['total'] or Decimal('0.00')
+        self.save(update_fields=['total_price', 'updated_at'])
+
+
 # ---------------- Order Item ----------------
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    # Snapshot taken when the order is placed, so the order never reprices
+    # and reading it never joins back to Product. Null only on rows created
+    # before snapshots existed (see `manage.py backfill_order_prices`).
+    product_name = models.CharField(max_length=255, blank=True, default='')
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
     def __str__(self):
-        return f"{self.quantity} × {self.product.name} (Order #{self.order.id})"
+        return f"{self.quantity} × {self.product_name or self.product_id} (Order #{self.order_id})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_line_total = instance.__dict__.get('line_total')
+        return instance
+
+    def snapshot(self, product=None):
+        product = product or self.product
+        self.product_name = product.name
+        self.price = product.price
+        self.line_total = self.price * self.quantity
+
+    def save(self, *args, **kwargs):
+        if self.price is None:
+            self.snapshot()
+        self.line_total = self.price * self.quantity
+        super().save(*args, **kwargs)
+        # Keep the order total current with an F() delta instead of re-summing.
+        delta = self.line_total - (getattr(self, '_saved_line_total', None) or 0)
+        if delta:
+            Order.objects.filter(pk=self.order_id).update(total_price=models.F('total_price') + delta)
+        self._saved_line_total = self.line_total
+
+    def delete(self, *args, **kwargs):
+        line_total = getattr(self, '_saved_line_total', None)
+        result = super().delete(*args, **kwargs)
+        if line_total:
+            Order.objects.filter(pk=self.order_id).update(total_price=models.F('total_price') - line_total)
+        return result
+
+
+# ---------------- Stock Hold ----------------
+class StockHold(models.Model):
+    """
+    Stock set aside for an unpaid order. Taking a hold decrements
+    Product.stock; releasing it (expiry or cancellation) gives it back and
+    confirming it (payment) makes the decrement permanent.
+    """
+    STATUS_CHOICES = [
+        ('held', 'Held'),
+        ('confirmed', 'Confirmed'),
+        ('released', 'Released'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_holds')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_holds')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='stockhold_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} × {self.product_id} for Order #{self.order_id} ({self.status})"
+
+
+# ---------------- Invoice ----------------
+class Invoice(models.Model):
+    """
+    The rendered PDF for an order. Files are stored under the SHA-256 of
+    their bytes; `fingerprint` hashes the order data the PDF was rendered
+    from, so a changed order is detected without re-rendering.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='invoice')
+    fingerprint = models.CharField(max_length=64)
+    digest = models.CharField(max_length=64)
+    size = models.PositiveIntegerField(default=0)
+    rendered_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def path(self):
+        return f"invoices/{self.digest[:2]}/{self.digest}.pdf"
+
+    def __str__(self):
+        return f"Invoice for Order #{self.order_id}"
 
 
 # ---------------- Cart Item ----------------
@@ -244,10 +491,23 @@ class Review(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The product page's review feed, newest first, with and without a star filter.
+            models.Index(fields=['product', 'rating', 'created_at', 'id'], name='review_product_rating_idx'),
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name} ({self.rating}★)"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember what the product's aggregates currently count for this review.
+        instance = super().from_db(db, field_names, values)
+        instance._saved_rating = instance.__dict__.get('rating')
+        instance._saved_product_id = instance.__dict__.get('product_id')
+        return instance
+
 
 # ---------------- Coupon ----------------
 class Coupon(models.Model):
@@ -271,15 +531,75 @@ class Coupon(models.Model):
 
 # ---------------- Payment Webhook Logger ----------------
 class PaymentWebhook(models.Model):
+    """
+    A verified gateway event, stored as received. The webhook view only
+    records it; store.webhooks applies it to orders afterwards.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    ]
+
     gateway = models.CharField(max_length=50)
+    event_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
     event_type = models.CharField(max_length=100)
     payload = models.JSONField()
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='pending')
+    occurred_at = models.DateTimeField(null=True, blank=True)   # gateway's event timestamp
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
     received_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'occurred_at', 'id'], name='webhook_pending_idx'),
+        ]
+
     def __str__(self):
         return f"{self.gateway} - {self.event_type} @ {self.received_at}"
 
 
+# ---------------- Outbound Email ----------------
+class OutboundEmail(models.Model):
+    """
+    A transactional email waiting to go out. Messages are rendered and sent
+    in batches by store.mailer, so the request or job that triggers one
+    never talks to the mail server itself.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='emails')
+    to = models.EmailField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # An order gets each kind of email once, however often it's queued.
+        unique_together = ('order', 'kind')
+        indexes = [
+            models.Index(fields=['status', 'send_after', 'id'], name='email_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} to {self.to} ({self.status})"
+
+
 # ---------------- Shipment Tracking ----------------
 class Shipment(models.Model):
     order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='shipment')
@@ -301,3 +621,51 @@ class ActivityLog(models.Model):
 
     def __str__(self):
         return f"{self.user.username if self.user else 'System'}: {self.action} @ {self.timestamp}"
+
+
+# ---------------- Background Jobs ----------------
+class Job(models.Model):
+    PRIORITY_HIGH = 0
+    PRIORITY_DEFAULT = 5
+    PRIORITY_LOW = 9
+    PRIORITY_CHOICES = [
+        (PRIORITY_HIGH, 'High'),
+        (PRIORITY_DEFAULT, 'Default'),
+        (PRIORITY_LOW, 'Low'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    task = models.CharField(max_length=100)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_DEFAULT)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'priority', 'run_at', 'id'], name='job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job #{self.id} {self.task} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
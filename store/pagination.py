@@ -0,0 +1,108 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+# ---------------- Keyset (cursor) pagination ----------------
+# Pages are addressed by the (timestamp, id) of the last row already shown
+# rather than by an OFFSET, so page N costs the same single index range
+# scan as page 1.
+
+def encode_cursor(timestamp, pk):
+    raw = json.dumps([timestamp.isoformat(), pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns (timestamp, pk) for a cursor string, or None if it is missing or malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, pk = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        timestamp = parse_datetime(timestamp)
+        pk = int(pk)
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    if timestamp is None:
+        return None
+    return timestamp, pk
+
+
+def get_page_size(request, default=None, maximum=None):
+    default = default or getattr(settings, 'STORE_PAGE_SIZE', 24)
+    maximum = maximum or getattr(settings, 'STORE_MAX_PAGE_SIZE', 96)
+    try:
+        size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, page_size, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.page_size = page_size
+        self.cursor = cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return not self.cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def paginate_keyset(queryset, cursor, page_size, field='created_at'):
+    """
+    Returns one page of `queryset`, newest first, ordered by (`field`, id).
+
+    Fetches page_size + 1 rows so the presence of a next page is known
+    without a COUNT(*).
+    """
+    queryset = queryset.order_by(f'-{field}', '-id')
+    position = decode_cursor(cursor)
+    if position:
+        timestamp, pk = position
+        queryset = queryset.filter(
+            Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'id__lt': pk})
+        )
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return KeysetPage(rows, next_cursor, page_size, cursor=cursor if position else None)
+
+
+def paginate_ranked(ids, cursor, page_size):
+    """
+    Pages through an already-ranked list of ids (e.g. search results). The
+    cursor is the offset of the first id on the page; the list itself is
+    capped upstream, so deep pages stay cheap.
+    """
+    try:
+        offset = max(0, int(cursor or 0))
+    except (TypeError, ValueError):
+        offset = 0
+    end = offset + page_size
+    next_cursor = str(end) if end < len(ids) else None
+    return KeysetPage(ids[offset:end], next_cursor, page_size, cursor=cursor if offset else None)
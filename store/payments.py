@@ -0,0 +1,392 @@
+import asyncio
+import hashlib
+import hmac
+import itertools
+import logging
+import threading
+import time
+import weakref
+from importlib import import_module
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class GatewayUnavailable(PaymentGatewayError):
+    """The gateway timed out, errored, or is being skipped by the circuit breaker."""
+
+
+class SignatureError(PaymentGatewayError):
+    pass
+
+
+# ---------------- Circuit breaker ----------------
+
+class CircuitBreaker:
+    """
+    Fails calls fast once the gateway keeps failing, so a slow or down
+    gateway ties up no more workers than it takes to notice.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls raise GatewayUnavailable at once. After `reset_timeout` seconds a
+    single trial call is let through: success closes the circuit, failure
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def _before_call(self):
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._trial_running):
+                raise GatewayUnavailable("Payment gateway is unavailable; not retrying yet.")
+            if state == 'half-open':
+                self._trial_running = True
+
+    def _record(self, ok):
+        with self._lock:
+            self._trial_running = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(f"Payment gateway circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Runs `func` through the breaker. Only GatewayUnavailable counts as a
+        failure; any other error means the gateway did answer.
+        """
+        self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except GatewayUnavailable:
+            self._record(False)
+            raise
+        except Exception:
+            self._record(True)
+            raise
+        self._record(True)
+        return result
+
+    async def acall(self, func, *args, **kwargs):
+        """`call` for coroutine functions."""
+        self._before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except GatewayUnavailable:
+            self._record(False)
+            raise
+        except Exception:
+            self._record(True)
+            raise
+        self._record(True)
+        return result
+
+
+# ---------------- Backends ----------------
+
+class PaymentGateway:
+    """
+    What the store needs from a payment gateway. Amounts are in paise.
+    """
+    name = None
+
+    @property
+    def key_id(self):
+        raise NotImplementedError
+
+    def create_order(self, amount, currency='INR', receipt=None):
+        """Returns the gateway's order dict, with at least an 'id'."""
+        raise NotImplementedError
+
+    async def acreate_order(self, amount, currency='INR', receipt=None):
+        """Async create_order. Backends without a native one run the sync call in a thread."""
+        return await sync_to_async(self.create_order, thread_sensitive=False)(amount, currency, receipt)
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        """Raises SignatureError unless the checkout callback is genuine."""
+        raise NotImplementedError
+
+    def captured_payments(self, since, until):
+        """Yields captured payment dicts (with 'id' and 'order_id') made in the window."""
+        raise NotImplementedError
+
+
+def _hmac_sha256(secret, message):
+    return hmac.new(secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+class _TimeoutSession(requests.Session):
+    # requests has no session-wide timeout; make every request carry one.
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
+class RazorpayGateway(PaymentGateway):
+    """
+    Razorpay over a shared, size-limited keep-alive connection pool.
+
+    Nothing is built until the first API call, so importing the app or
+    booting a worker never touches the network or needs the keys. Every
+    request has a connect/read timeout, and API calls go through a circuit
+    breaker.
+    """
+    name = 'razorpay'
+    api_url = 'https://api.razorpay.com/v1'
+    list_page_size = 100
+
+    def __init__(self, key_id=None, key_secret=None, timeout=None, pool_size=None,
+                 failure_threshold=None, reset_timeout=None):
+        self._key_id = key_id
+        self._key_secret = key_secret
+        self.timeout = timeout or getattr(settings, 'STORE_PAYMENT_TIMEOUT', (3.05, 10))
+        self.pool_size = pool_size = pool_size or getattr(settings, 'STORE_PAYMENT_POOL_SIZE', 10)
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            # Only idempotent reads are retried; creating an order twice would
+            # leave an orphan order at the gateway.
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                              allowed_methods=('GET',), raise_on_status=False),
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold or getattr(settings, 'STORE_PAYMENT_BREAKER_THRESHOLD', 5),
+            reset_timeout or getattr(settings, 'STORE_PAYMENT_BREAKER_RESET', 30),
+        )
+        self._local = threading.local()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def key_id(self):
+        return self._key_id or settings.RAZORPAY_KEY_ID
+
+    @property
+    def key_secret(self):
+        return self._key_secret or settings.RAZORPAY_KEY_SECRET
+
+    def _session(self):
+        # The REST API is called directly, as on the async path, rather than
+        # through razorpay.Client. One requests session per thread (sessions
+        # aren't thread safe), all drawing on the same connection pool.
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            if not self.key_id or not self.key_secret:
+                raise PaymentGatewayError("RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET must be set.")
+            session = _TimeoutSession(self.timeout)
+            session.auth = (self.key_id, self.key_secret)
+            session.mount(self.api_url, self.adapter)
+            self._local.session = session
+        return session
+
+    def _request(self, method, path, **kwargs):
+        try:
+            response = self._session().request(method, self.api_url + path, **kwargs)
+        except requests.RequestException as e:
+            raise GatewayUnavailable(str(e) or type(e).__name__) from e
+        return self._parse(response)
+
+    @staticmethod
+    def _parse(response):
+        # Shared by the requests and httpx paths; both responses look alike here.
+        status_code = response.status_code
+        if status_code >= 500:
+            raise GatewayUnavailable(f"Razorpay returned HTTP {status_code}")
+        try:
+            data = response.json()
+        except ValueError:
+            raise GatewayUnavailable(f"Razorpay returned a non-JSON HTTP {status_code}")
+        if status_code >= 400:
+            raise PaymentGatewayError((data.get('error') or {}).get('description') or f"HTTP {status_code}")
+        return data
+
+    def create_order(self, amount, currency='INR', receipt=None):
+        data = {'amount': amount, 'currency': currency, 'payment_capture': 1}
+        if receipt:
+            data['receipt'] = receipt
+        return self.breaker.call(self._request, 'POST', '/orders', json=data)
+
+    def _async_client(self):
+        # httpx clients belong to the event loop they were first used on, so
+        # keep one pooled client per loop (one per uvicorn worker in practice).
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            if not self.key_id or not self.key_secret:
+                raise PaymentGatewayError("RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET must be set.")
+            connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+            client = httpx.AsyncClient(
+                base_url=self.api_url,
+                auth=(self.key_id, self.key_secret),
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                transport=httpx.AsyncHTTPTransport(retries=1),     # connection failures only
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def _arequest(self, method, path, **kwargs):
+        try:
+            response = await self._async_client().request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            raise GatewayUnavailable(str(e) or type(e).__name__) from e
+        return self._parse(response)
+
+    async def acreate_order(self, amount, currency='INR', receipt=None):
+        data = {'amount': amount, 'currency': currency, 'payment_capture': 1}
+        if receipt:
+            data['receipt'] = receipt
+        return await self.breaker.acall(self._arequest, 'POST', '/orders', json=data)
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        # Checked locally (HMAC with our key secret), no API call needed.
+        # Without a secret anyone could compute the signature, so refuse.
+        if not self.key_secret:
+            raise SignatureError("RAZORPAY_KEY_SECRET is not set; can't verify payment signatures.")
+        expected = _hmac_sha256(self.key_secret, f"{order_id}|{payment_id}")
+        if not signature or not hmac.compare_digest(expected, signature):
+            raise SignatureError("Payment signature verification failed.")
+
+    def captured_payments(self, since, until):
+        skip = 0
+        while True:
+            page = self.breaker.call(self._request, 'GET', '/payments', params={
+                'from': int(since.timestamp()),
+                'to': int(until.timestamp()),
+                'count': self.list_page_size,
+                'skip': skip,
+            })
+            items = page.get('items', [])
+            for payment in items:
+                if payment.get('status') == 'captured':
+                    yield payment
+            if len(items) < self.list_page_size:
+                break
+            skip += self.list_page_size
+
+
+class FakeGateway(PaymentGateway):
+    """
+    An in-process gateway for development and tests: orders get sequential
+    fake IDs, nothing leaves the process, and `sign` produces the signature
+    a real checkout callback would carry.
+    """
+    name = 'fake'
+
+    def __init__(self, key_id='rzp_test_fake', key_secret='fake-secret', latency=None):
+        self._key_id = key_id
+        self.key_secret = key_secret
+        # Seconds each API call takes, to stand in for the network in benchmarks.
+        self.latency = latency if latency is not None else getattr(settings, 'STORE_FAKE_GATEWAY_LATENCY', 0)
+        self.orders = {}
+        self.payments = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def key_id(self):
+        return self._key_id
+
+    def _new_order(self, amount, currency, receipt):
+        with self._lock:
+            order = {'id': f"order_fake{next(self._ids):010d}", 'amount': amount, 'currency': currency,
+                     'receipt': receipt, 'status': 'created'}
+            self.orders[order['id']] = order
+        return order
+
+    def create_order(self, amount, currency='INR', receipt=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._new_order(amount, currency, receipt)
+
+    async def acreate_order(self, amount, currency='INR', receipt=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._new_order(amount, currency, receipt)
+
+    def sign(self, order_id, payment_id):
+        return _hmac_sha256(self.key_secret, f"{order_id}|{payment_id}")
+
+    def capture(self, order_id, payment_id=None):
+        """Records a captured payment for `order_id` and returns the callback's signature."""
+        with self._lock:
+            payment_id = payment_id or f"pay_fake{next(self._ids):010d}"
+            self.payments.append({'id': payment_id, 'order_id': order_id, 'status': 'captured',
+                                  'created_at': int(time.time())})
+        return payment_id, self.sign(order_id, payment_id)
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        if not signature or not hmac.compare_digest(self.sign(order_id, payment_id), signature):
+            raise SignatureError("Payment signature verification failed.")
+
+    def captured_payments(self, since, until):
+        return [
+            payment for payment in self.payments
+            if payment['status'] == 'captured' and since.timestamp() <= payment['created_at'] <= until.timestamp()
+        ]
+
+
+GATEWAYS = {
+    'razorpay': RazorpayGateway,
+    'fake': FakeGateway,
+}
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    The configured gateway (STORE_PAYMENT_GATEWAY: 'razorpay', 'fake', or a
+    dotted path to a PaymentGateway class), built on first use.
+    """
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                choice = getattr(settings, 'STORE_PAYMENT_GATEWAY', 'razorpay')
+                if choice in GATEWAYS:
+                    gateway_class = GATEWAYS[choice]
+                else:
+                    module_path, _, class_name = choice.rpartition('.')
+                    gateway_class = getattr(import_module(module_path), class_name)
+                _gateway = gateway_class()
+    return _gateway
+
+
+def reset_gateway():
+    global _gateway
+    _gateway = None
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+
+from . import catalog_cache
+from .models import Product, Wishlist
+
+# ---------------- Product page assembly ----------------
+# Everything on the product page that's the same for every visitor is
+# rendered once and cached, keyed on the product's updated_at. A hit costs
+# the single product + category query; variants and tags are only read (from
+# the catalog cache) to render a miss. Bump FRAGMENT_VERSION when the
+# fragment templates change, so HTML cached by the old ones is ignored.
+
+FRAGMENT_VERSION = 3
+CACHE_TIMEOUT = getattr(settings, 'STORE_PRODUCT_CACHE_TIMEOUT', 3600)
+
+
+def get_product(slug):
+    return get_object_or_404(Product.objects.select_related('category'), slug=slug)
+
+
+def _fragments_key(product):
+    return f"store:product_page:{FRAGMENT_VERSION}:{product.pk}:{product.updated_at.timestamp()}"
+
+
+def render_fragments(product):
+    context = {
+        'product': product,
+        'variants': catalog_cache.variants(product.pk),
+        'tags': catalog_cache.product_tags(product.pk),
+    }
+    return {
+        'image': render_to_string('store/product_image.html', context),
+        'summary': render_to_string('store/product_summary.html', context),
+    }
+
+
+def product_fragments(product):
+    """The shared parts of the product page as {'image': html, 'summary': html}."""
+    key = _fragments_key(product)
+    fragments = cache.get(key)
+    if fragments is None:
+        fragments = render_fragments(product)
+        cache.set(key, fragments, CACHE_TIMEOUT)
+    return fragments
+
+
+def in_wishlist(user, product):
+    if not user.is_authenticated:
+        return False
+    return Wishlist.objects.filter(user=user, product=product).exists()
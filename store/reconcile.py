@@ -0,0 +1,61 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order
+from .checkout import complete_payment, lock_payment_order
+from .payments import get_gateway
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------- Reconciliation ----------------
+
+def reconcile_orders(gateway=None, since=None, min_age=None, page_size=200, dry_run=False):
+    """
+    Marks unpaid orders paid when Razorpay shows a captured payment for
+    them, e.g. because both the browser callback and the webhook were lost.
+    `gateway` defaults to the configured payment gateway.
+
+    Captured payments for the whole window are fetched once up front, then
+    unpaid orders are paged through by id and matched against them. Orders
+    younger than `min_age` are skipped since their payment may still be in
+    flight.
+    """
+    gateway = gateway or get_gateway()
+    now = timezone.now()
+    since = since or now - timedelta(days=7)
+    cutoff = now - (min_age if min_age is not None else timedelta(minutes=30))
+
+    captured = {}
+    for payment in gateway.captured_payments(since, now):
+        if payment.get('order_id'):
+            captured[payment['order_id']] = payment
+
+    counts = {'checked': 0, 'paid': 0, 'unmatched': 0}
+    unpaid = Order.objects.filter(
+        is_paid=False, razorpay_order_id__isnull=False, created_at__gte=since, created_at__lte=cutoff
+    ).exclude(status='cancelled').order_by('id')
+    last_id = 0
+    while True:
+        page = list(unpaid.filter(id__gt=last_id).values_list('id', 'razorpay_order_id')[:page_size])
+        if not page:
+            break
+        last_id = page[-1][0]
+        counts['checked'] += len(page)
+        for order_id, razorpay_order_id in page:
+            payment = captured.get(razorpay_order_id)
+            if payment is None:
+                counts['unmatched'] += 1
+                continue
+            if dry_run:
+                counts['paid'] += 1
+                continue
+            with transaction.atomic():
+                order = lock_payment_order(razorpay_order_id)
+                if order and complete_payment(order, payment['id']):
+                    counts['paid'] += 1
+                    logger.warning(f"Reconciled Order {order_id}: payment {payment['id']} was captured but not recorded")
+    return counts
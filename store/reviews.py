@@ -0,0 +1,89 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Review
+from .pagination import decode_cursor, paginate_keyset
+
+# Review feed pages are cached per product under a version key. Any review
+# write for the product drops the version (after commit), which orphans
+# every cached page at once, so no page is ever served stale.
+FEED_CACHE_TIMEOUT = getattr(settings, 'STORE_REVIEW_CACHE_TIMEOUT', 600)
+
+
+def parse_rating(value):
+    """Returns the star filter as an int from 1 to 5, or None."""
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if 1 <= rating <= 5 else None
+
+
+def page_size():
+    return getattr(settings, 'STORE_REVIEW_PAGE_SIZE', 10)
+
+
+def _version_key(product_id):
+    return f"store:review_feed_version:{product_id}"
+
+
+def _feed_version(product_id):
+    key = _version_key(product_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex[:12], None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_review_feed(product_id):
+    transaction.on_commit(lambda: cache.delete(_version_key(product_id)))
+
+
+def reviews_for(product_id, rating=None):
+    """
+    A product's reviews with only the columns the feed shows. Filtered by
+    rating this is a range scan on review_product_rating_idx, unfiltered on
+    review_product_created_idx.
+    """
+    reviews = Review.objects.filter(product_id=product_id)
+    if rating:
+        reviews = reviews.filter(rating=rating)
+    return reviews.select_related('user').only('id', 'rating', 'comment', 'created_at', 'user__username')
+
+
+def review_feed(product_id, rating=None, cursor=None):
+    """
+    One page of a product's reviews, newest first, as a plain dict (it is
+    cached, and served as-is by the JSON feed):
+
+        {'reviews': [{'id', 'username', 'rating', 'comment', 'created_at'}],
+         'rating': ..., 'cursor': ..., 'next_cursor': ...}
+    """
+    rating = parse_rating(rating)
+    if decode_cursor(cursor) is None:
+        cursor = None
+    key = f"store:review_feed:{product_id}:{_feed_version(product_id)}:{rating or 'all'}:{page_size()}:{cursor or ''}"
+    feed = cache.get(key)
+    if feed is None:
+        page = paginate_keyset(reviews_for(product_id, rating), cursor, page_size())
+        feed = {
+            'reviews': [
+                {
+                    'id': review.id,
+                    'username': review.user.username,
+                    'rating': review.rating,
+                    'comment': review.comment,
+                    'created_at': review.created_at,
+                }
+                for review in page
+            ],
+            'rating': rating,
+            'cursor': page.cursor,
+            'next_cursor': page.next_cursor,
+        }
+        cache.set(key, feed, FEED_CACHE_TIMEOUT)
+    return feed
@@ -0,0 +1,333 @@
+import bisect
+import logging
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, OperationalError
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'store_product_fts'
+
+# Relative weight of each indexed field when ranking results.
+FIELD_WEIGHTS = {'name': 10.0, 'description': 1.0, 'category': 2.0, 'tags': 4.0}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Upper bound on how many index terms a single prefix may expand to in the
+# in-memory backend, so one-letter queries stay cheap.
+MAX_PREFIX_EXPANSION = 64
+
+# Ids per query when narrowing search matches to a filtered queryset.
+FILTER_CHUNK_SIZE = 500
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+# ---------------- Documents ----------------
+
+def iter_documents(product_ids=None, chunk_size=2000):
+    """
+    Yields one search document per listed product, optionally restricted to `product_ids`.
+
+    Reads products and tag names chunk by chunk with flat value queries, so a
+    full rebuild never holds the whole catalog in memory.
+    """
+    from .models import Product, ProductTag
+
+    products = Product.objects.listed().order_by('id')
+    if product_ids is not None:
+        products = products.filter(id__in=list(product_ids))
+
+    last_id = 0
+    while True:
+        rows = list(
+            products.filter(id__gt=last_id).values_list(
+                'id', 'name', 'description', 'category_id', 'category__name'
+            )[:chunk_size]
+        )
+        if not rows:
+            return
+        ids = [row[0] for row in rows]
+        tags = defaultdict(list)
+        for product_id, tag_name in ProductTag.objects.filter(product_id__in=ids).values_list('product_id', 'tag__name'):
+            tags[product_id].append(tag_name)
+        for pk, name, description, category_id, category_name in rows:
+            yield {
+                'id': pk,
+                'category_id': category_id,
+                'name': name,
+                'description': description or '',
+                'category': category_name or '',
+                'tags': ' '.join(tags[pk]),
+            }
+        last_id = ids[-1]
+
+
+# ---------------- SQLite FTS5 backend ----------------
+
+class Fts5Backend:
+    """
+    Ranked full-text search over the `store_product_fts` FTS5 table (created by
+    migration 0012). Lives in the main database, so index updates commit
+    atomically with the product write that triggered them.
+    """
+    name = 'fts5'
+
+    def __init__(self):
+        self._available = None
+
+    def is_available(self):
+        if self._available is None:
+            self._available = False
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+                    )
+                    self._available = cursor.fetchone() is not None
+        return self._available
+
+    def index(self, documents):
+        rows = [
+            (doc['id'], doc['category_id'], doc['name'], doc['description'], doc['category'], doc['tags'])
+            for doc in documents
+        ]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, category_id, name, description, category, tags) "
+                f"VALUES (%s, %s, %s, %s, %s, %s)",
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in product_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def search(self, query, limit, category_id=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # Every token is a quoted prefix term; FTS5 ANDs them together.
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in ('name', 'description', 'category', 'tags'))
+        sql = (
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+            f"{' AND category_id = %s' if category_id else ''} "
+            f"ORDER BY bm25({FTS_TABLE}, 0, {weights}), rowid DESC LIMIT %s"
+        )
+        params = [match] + ([int(category_id)] if category_id else []) + [limit]
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(sql, params)
+            except OperationalError as e:
+                logger.warning(f"FTS5 query failed for {query!r}: {e}")
+                return []
+            return [row[0] for row in cursor.fetchall()]
+
+
+# ---------------- Pure-Python backend ----------------
+
+class InMemoryIndex:
+    """
+    Process-local inverted index used when FTS5 is not available (e.g. on
+    PostgreSQL or an SQLite build without FTS5). Loaded lazily from the
+    database on first search and kept current by the product signals.
+    """
+    name = 'python'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = defaultdict(dict)   # term -> {product_id: weighted term frequency}
+        self._doc_terms = {}                 # product_id -> set of terms
+        self._doc_category = {}              # product_id -> category_id
+        self._terms = []                     # sorted vocabulary, for prefix lookups
+        self._terms_dirty = False
+
+    def is_available(self):
+        return True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._loaded = True
+                    self.index(iter_documents())
+
+    def _remove_locked(self, pk):
+        for term in self._doc_terms.pop(pk, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(pk, None)
+                if not postings:
+                    del self._postings[term]
+                    self._terms_dirty = True
+        self._doc_category.pop(pk, None)
+
+    def index(self, documents):
+        with self._lock:
+            for doc in documents:
+                pk = doc['id']
+                self._remove_locked(pk)
+                weights = defaultdict(float)
+                for field, weight in FIELD_WEIGHTS.items():
+                    for term in tokenize(doc[field]):
+                        weights[term] += weight
+                for term, weight in weights.items():
+                    if term not in self._postings:
+                        self._terms_dirty = True
+                    self._postings[term][pk] = weight
+                self._doc_terms[pk] = set(weights)
+                self._doc_category[pk] = doc['category_id']
+
+    def remove(self, product_ids):
+        with self._lock:
+            for pk in product_ids:
+                self._remove_locked(pk)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_category.clear()
+            self._terms = []
+            self._terms_dirty = False
+            self._loaded = True
+
+    def _expand(self, prefix):
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        start = bisect.bisect_left(self._terms, prefix)
+        matches = []
+        for term in self._terms[start:start + MAX_PREFIX_EXPANSION]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, query, limit, category_id=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        self._ensure_loaded()
+        with self._lock:
+            total = max(len(self._doc_terms), 1)
+            scores = None
+            for token in tokens:
+                token_scores = defaultdict(float)
+                for term in self._expand(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for pk, weight in postings.items():
+                        token_scores[pk] += weight * idf
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pk: scores[pk] + score for pk, score in token_scores.items() if pk in scores}
+                if not scores:
+                    return []
+            if category_id:
+                category_id = int(category_id)
+                scores = {pk: s for pk, s in scores.items() if self._doc_category.get(pk) == category_id}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [pk for pk, _ in ranked[:limit]]
+
+
+# ---------------- Public API ----------------
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                choice = getattr(settings, 'STORE_SEARCH_BACKEND', 'auto')
+                backend = Fts5Backend()
+                if choice == 'python' or (choice == 'auto' and not backend.is_available()):
+                    backend = InMemoryIndex()
+                _backend = backend
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    _backend = None
+
+
+def search_product_ids(query, category_id=None, limit=None, within=None):
+    """
+    Returns ids of listed products matching every word of `query` as a
+    prefix, best match first.
+
+    With `within` (a Product queryset, e.g. narrowed by facets) only its
+    products are returned. The index is asked for ever more matches until
+    `limit` of them pass or the matches run out, so the filter never leaves
+    a short list while further matches exist.
+    """
+    limit = limit or getattr(settings, 'STORE_SEARCH_MAX_RESULTS', 1000)
+    backend = get_backend()
+    if within is None:
+        return backend.search(query, limit, category_id=category_id)
+
+    allowed, checked = set(), set()
+    fetch = limit
+    while True:
+        candidates = backend.search(query, fetch, category_id=category_id)
+        unchecked = [pk for pk in candidates if pk not in checked]
+        for start in range(0, len(unchecked), FILTER_CHUNK_SIZE):
+            chunk = unchecked[start:start + FILTER_CHUNK_SIZE]
+            allowed.update(within.filter(id__in=chunk).values_list('id', flat=True))
+        checked.update(unchecked)
+        ids = [pk for pk in candidates if pk in allowed]
+        if len(ids) >= limit or len(candidates) < fetch:
+            return ids[:limit]
+        fetch *= 4
+
+
+def index_products(product_ids):
+    """
+    Re-indexes the given products; ids that are no longer listed are dropped from the index.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    backend = get_backend()
+    documents = list(iter_documents(product_ids))
+    backend.remove(product_ids - {doc['id'] for doc in documents})
+    backend.index(documents)
+
+
+def remove_products(product_ids):
+    get_backend().remove(list(product_ids))
+
+
+def rebuild_index(chunk_size=2000):
+    backend = get_backend()
+    backend.clear()
+    count = 0
+    batch = []
+    for doc in iter_documents(chunk_size=chunk_size):
+        batch.append(doc)
+        if len(batch) >= chunk_size:
+            backend.index(batch)
+            count += len(batch)
+            batch = []
+    backend.index(batch)
+    return count + len(batch)
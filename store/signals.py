@@ -1,7 +1,12 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.dispatch import receiver
-from .models import Profile
+from django.utils import timezone
+from .models import Profile, Product, ProductTag, ProductVariant, Category, Tag, Review, CartItem, Wishlist
+from . import search, facets, images, catalog_cache
+from .reviews import invalidate_review_feed
+from .context_processors import invalidate_cart_count, invalidate_wishlist_count
 
 @receiver(post_save, sender=User)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
@@ -11,3 +16,155 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
         # Check if profile exists before saving
         Profile.objects.get_or_create(user=instance)
         instance.profile.save()
+
+# ---------------- Search index ----------------
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products([instance.pk])
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+def reindex_tagged_product(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not _deleting_products(origin):
+        search.index_products([instance.product_id])
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_products(instance.products.values_list('id', flat=True))
+
+# ---------------- Facet counts ----------------
+
+def _deleting_products(origin):
+    """
+    True when a post_delete is a cascade from deleting products (directly or
+    through their category), in which case the products' own pre_delete
+    handles the bookkeeping.
+    """
+    model = getattr(origin, 'model', type(origin))
+    return model in (Product, Category)
+
+@receiver(post_save, sender=Product)
+def sync_saved_product_facets(sender, instance, raw=False, **kwargs):
+    if not raw:
+        facets.sync_product_facets([instance.pk])
+
+@receiver(pre_delete, sender=Product)
+def remove_deleted_product_facets(sender, instance, **kwargs):
+    facets.remove_product_facets([instance.pk])
+
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+def sync_tagged_product_facets(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not _deleting_products(origin):
+        facets.sync_product_facets([instance.product_id])
+
+# ---------------- Image derivatives ----------------
+
+@receiver(post_save, sender=Product)
+def resize_uploaded_product_image(sender, instance, raw=False, **kwargs):
+    if not raw and not images.is_current(instance):
+        transaction.on_commit(lambda: images.schedule_derivatives([instance.pk]))
+
+# ---------------- Product page cache ----------------
+# The cached product page is keyed on Product.updated_at, so anything else
+# it shows bumps that when it changes.
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+def touch_product_page(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not _deleting_products(origin):
+        Product.touch([instance.product_id])
+
+@receiver(post_save, sender=Category)
+def touch_category_product_pages(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        instance.products.update(updated_at=timezone.now())
+
+# ---------------- Catalog read cache ----------------
+# Queryset update()s and bulk_create()s send no signals; code using them on
+# anything a catalog read shows bumps the generation itself. A renamed Tag
+# changes the cached tag names, so Tag shares ProductTag's scope.
+
+CATALOG_SCOPES = {
+    Product: 'product',
+    Category: 'category',
+    ProductVariant: 'variant',
+    ProductTag: 'tag',
+    Tag: 'tag',
+}
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_catalog_generation(sender, **kwargs):
+    catalog_cache.bump(CATALOG_SCOPES[sender])
+
+# ---------------- Rating aggregates ----------------
+
+@receiver(pre_save, sender=Review)
+def remember_stored_review(sender, instance, raw=False, **kwargs):
+    # A Review built by hand with an existing pk wasn't loaded through
+    # from_db, so read what the aggregates count for it before it's overwritten.
+    if raw or instance.pk is None or getattr(instance, '_saved_rating', None) is not None:
+        return
+    stored = Review.objects.filter(pk=instance.pk).values('rating', 'product_id').first()
+    if stored:
+        instance._saved_rating = stored['rating']
+        instance._saved_product_id = stored['product_id']
+
+@receiver(post_save, sender=Review)
+def count_saved_review(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_review_feed(instance.product_id)
+    saved_rating = None if created else getattr(instance, '_saved_rating', None)
+    saved_product_id = None if created else getattr(instance, '_saved_product_id', None)
+    if saved_product_id not in (None, instance.product_id):
+        # Moved to another product: take it off the old one entirely.
+        Product.apply_rating_change(saved_product_id, removed=saved_rating)
+        facets.sync_product_facets([saved_product_id])
+        saved_rating = None
+    if saved_rating != instance.rating:
+        Product.apply_rating_change(instance.product_id, added=instance.rating, removed=saved_rating)
+        # The new average may move the product to another rating facet bucket.
+        facets.sync_product_facets([instance.product_id])
+    instance._saved_rating = instance.rating
+    instance._saved_product_id = instance.product_id
+
+@receiver(post_delete, sender=Review)
+def uncount_deleted_review(sender, instance, origin=None, **kwargs):
+    if not _deleting_products(origin):
+        invalidate_review_feed(instance.product_id)
+        Product.apply_rating_change(instance.product_id, removed=instance.rating)
+        facets.sync_product_facets([instance.product_id])
+
+# ---------------- Navbar counts ----------------
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cached_cart_count(sender, instance, created=True, **kwargs):
+    # Quantity changes don't change the number of cart lines.
+    if created:
+        invalidate_cart_count(instance.user_id)
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def invalidate_cached_wishlist_count(sender, instance, created=True, **kwargs):
+    if created:
+        invalidate_wishlist_count(instance.user_id)
\ No newline at end of file
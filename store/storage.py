@@ -0,0 +1,83 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from whitenoise.compress import Compressor
+
+# ---------------- Content-hashed media ----------------
+# Product and profile images are stored under names that carry a digest of
+# their content (poster.jpg -> poster.3f2a9c1b7d4e.jpg), so a URL always
+# names the same bytes and can be cached by browsers forever; replacing an
+# image gives it a new URL. Imported images and derivatives are already
+# named after their full sha256 (products/ab/<sha256>.jpg).
+
+HASHED_DIRS = ('products/', 'uploaded_products/', 'profile_pics/')
+# Served by the public media view. Everything else in MEDIA_ROOT (invoices)
+# is private and only reachable through its own view.
+PUBLIC_DIRS = HASHED_DIRS + ('derivatives/',)
+
+DIGEST_LENGTH = 12
+HASHED_NAME_RE = re.compile(r'(?:^([0-9a-f]{64})|\.([0-9a-f]{%d}))\.\w+$' % DIGEST_LENGTH)
+
+# AVIF isn't in WhiteNoise's list but is just as incompressible.
+compressor = Compressor(extensions=Compressor.SKIP_COMPRESS_EXTENSIONS + ('avif',), quiet=True)
+
+
+def name_digest(name):
+    """The content digest carried by a stored file's name, or None."""
+    match = HASHED_NAME_RE.search(posixpath.basename(name))
+    return (match.group(1) or match.group(2)) if match else None
+
+
+def is_public(name):
+    return name.startswith(PUBLIC_DIRS)
+
+
+def file_digest(content):
+    sha = hashlib.sha256()
+    for chunk in content.chunks():  # chunks() rewinds first, so saving afterwards reads it all
+        sha.update(chunk)
+    return sha.hexdigest()[:DIGEST_LENGTH]
+
+
+def hashed_name(name, digest, max_length=None):
+    """'products/poster.jpg' -> 'products/poster.<digest>.jpg', shortening the stem to fit max_length."""
+    directory, filename = posixpath.split(name)
+    stem, extension = os.path.splitext(filename)
+    if max_length:
+        room = max_length - len(name) - len(digest) - 1
+        if room < 0:
+            stem = stem[:max(1, len(stem) + room)]
+    return posixpath.join(directory, f"{stem}.{digest}{extension}")
+
+
+class MediaStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names new product and profile images after their
+    content and writes precompressed .gz (and .br, with brotli installed)
+    copies of them where that actually saves bytes.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if name.startswith(HASHED_DIRS) and not name_digest(name):
+            name = hashed_name(self.generate_filename(name), file_digest(content), max_length)
+            # Same name, same bytes: nothing to write.
+            if self.exists(name):
+                return name
+        name = super().save(name, content, max_length)
+        if name.startswith(HASHED_DIRS) and compressor.should_compress(name):
+            compressor.compress(self.path(name))
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        for suffix in ('.gz', '.br'):
+            if self.exists(name + suffix):
+                super().delete(name + suffix)
@@ -0,0 +1,57 @@
+import logging
+
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from .jobs import task
+from .models import Job, Order, Product
+from .importers import ProductCSVImporter
+from . import images, invoices, mailer, webhooks
+
+logger = logging.getLogger(__name__)
+
+
+# Not retried: a partially applied import would duplicate the rows it already wrote.
+@task(name='store.import_products_csv', priority=Job.PRIORITY_LOW, max_attempts=1)
+def import_products_csv(path):
+    try:
+        with default_storage.open(path, 'rb') as csv_file:
+            result = ProductCSVImporter().run(csv_file)
+    finally:
+        default_storage.delete(path)
+    return {
+        'created': result.created,
+        'skipped': result.skipped,
+        'warnings': result.warnings[:20],
+        'warning_count': result.warning_count,
+        'redirect_url': reverse('home'),
+    }
+
+
+@task(name='store.send_order_confirmation_email', priority=Job.PRIORITY_HIGH, max_attempts=5)
+def send_order_confirmation_email(order_id):
+    # Kept for jobs enqueued before emails went through the outbox.
+    mailer.queue_order_confirmation(Order.objects.select_related('user').get(id=order_id))
+
+
+@task(name=mailer.SEND_TASK, priority=Job.PRIORITY_HIGH, max_attempts=3)
+def send_queued_emails():
+    return mailer.send_pending()
+
+
+@task(name='store.render_invoice_pdf', priority=Job.PRIORITY_DEFAULT, max_attempts=3)
+def render_invoice_pdf(order_id):
+    order = Order.objects.select_related('user').get(id=order_id)
+    invoices.store_invoice(order)
+    return {'redirect_url': reverse('download_invoice', args=[order_id])}
+
+
+@task(name='store.process_payment_webhooks', priority=Job.PRIORITY_HIGH, max_attempts=3)
+def process_payment_webhooks():
+    return webhooks.process_pending()
+
+
+@task(name=images.DERIVATIVES_TASK, priority=Job.PRIORITY_LOW, max_attempts=3)
+def generate_image_derivatives(product_ids):
+    rendered, failed = images.build_derivatives(Product.objects.filter(pk__in=product_ids))
+    return {'rendered': rendered, 'failed': failed}
@@ -4,4 +4,32 @@ register = template.Library()
 
 @register.filter
 def multiply(value, arg):
-    return value * arg
\ No newline at end of file
+    return value * arg
+
+@register.simple_tag(takes_context=True)
+def url_replace(context, **kwargs):
+    """
+    Returns the current query string with the given parameters replaced
+    (or removed when the value is empty).
+    """
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        if value in (None, ''):
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return query.urlencode()
+
+@register.simple_tag(takes_context=True)
+def facet_toggle(context, param, value):
+    """
+    Returns the query string that selects `value` for facet `param`, or clears
+    it if already selected. Always restarts pagination.
+    """
+    query = context['request'].GET.copy()
+    query.pop('cursor', None)
+    if query.get(param) == str(value):
+        query.pop(param)
+    else:
+        query[param] = value
+    return query.urlencode()
\ No newline at end of file
@@ -1,3 +1,1303 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import json
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import timedelta
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import catalog_cache
+from .cart import OutOfStock, _add_with_conditional_update, add_item
+from .checkout import CheckoutError, load_cart_lines, place_order
+from .downloads import AsyncImageDownloader, ImageDownloader
+from .facets import facet_counts, filter_products
+from .images import build_derivatives, render_derivatives
+from .importers import import_products_csv
+from .invoices import invoice_fingerprint, write_invoice_file
+from .inventory import release_expired_holds, reserve, return_stock, take_stock
+from .jobs import claim_job, enqueue, heartbeat, requeue_stale_jobs, run_job, task
+from .mailer import queue_order_confirmation, send_pending
+from .models import (
+    Address, CartItem, Category, Invoice, Job, Order, OrderItem, OutboundEmail, PaymentWebhook, Product, ProductTag,
+    ProductVariant, Review, StockHold, Tag,
+)
+from .payments import (
+    CircuitBreaker, FakeGateway, GatewayUnavailable, PaymentGatewayError, RazorpayGateway, SignatureError, get_gateway,
+    reset_gateway,
+)
+from .reconcile import reconcile_orders
+from .reviews import review_feed
+from .search import Fts5Backend, index_products, reset_backend, search_product_ids
+from .webhooks import RAZORPAY, process_pending, record_event
+from .storage import MediaStorage, name_digest
+
+
+class MyOrdersQueryCountTests(TestCase):
+    """
+    my_orders must cost the same number of queries however many orders and
+    items the user has.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='pass')
+        cls.address = Address.objects.create(
+            user=cls.user, address_type='shipping', full_name='Buyer', phone='0000000000',
+            address_line1='1 Test Street', city='City', state='State', country='India', postal_code='000000',
+        )
+        category = Category.objects.create(name='Things', slug='things')
+        cls.products = [
+            Product.objects.create(name=f'Thing {i}', slug=f'thing-{i}', category=category, price=10, stock=100)
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_orders(self, count, items_per_order):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, shipping_address=self.address)
+            for product in self.products[:items_per_order]:
+                OrderItem.objects.create(order=order, product=product, quantity=2)
+
+    def count_queries(self, url):
+        cache.clear()   # navbar counts are cached; measure from a cold cache each time
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_detail_view_query_count_is_constant(self):
+        url = reverse('my_orders')
+        self.create_orders(2, 1)
+        few = self.count_queries(url)
+        self.create_orders(20, 5)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+    def test_summary_view_query_count_is_constant(self):
+        url = reverse('my_orders') + '?view=summary'
+        self.create_orders(2, 1)
+        few = self.count_queries(url)
+        self.create_orders(20, 5)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+    def test_summary_view_annotates_counts(self):
+        self.create_orders(1, 3)
+        response = self.client.get(reverse('my_orders') + '?view=summary')
+        order = response.context['orders'].object_list[0]
+        self.assertEqual(order.item_count, 3)
+        self.assertEqual(order.unit_count, 6)
+
+    def test_orders_are_paginated(self):
+        self.create_orders(5, 1)
+        response = self.client.get(reverse('my_orders') + '?page_size=2')
+        page = response.context['page']
+        self.assertEqual(len(page), 2)
+        self.assertTrue(page.has_next)
+
+
+class ReconcilePaymentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('payer')
+
+    def setUp(self):
+        self.gateway = FakeGateway()
+
+    def create_order(self, razorpay_order_id, age_minutes=60, **kwargs):
+        order = Order.objects.create(user=self.user, total_price=100, razorpay_order_id=razorpay_order_id, **kwargs)
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(minutes=age_minutes))
+        return order
+
+    def test_marks_orders_with_captured_payments_paid(self):
+        captured = self.create_order('order_a')
+        missing = self.create_order('order_b')
+        self.gateway.capture('order_a', 'pay_a')
+
+        counts = reconcile_orders(self.gateway, page_size=1)
+
+        self.assertEqual(counts, {'checked': 2, 'paid': 1, 'unmatched': 1})
+        captured.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertTrue(captured.is_paid)
+        self.assertEqual(captured.razorpay_payment_id, 'pay_a')
+        self.assertFalse(missing.is_paid)
+
+    def test_skips_recent_paid_and_failed(self):
+        self.create_order('order_recent', age_minutes=5)
+        self.create_order('order_paid', is_paid=True)
+        self.create_order('order_failed')
+        self.gateway.capture('order_recent')
+        self.gateway.capture('order_paid')
+        self.gateway.capture('order_failed')
+        self.gateway.payments[-1]['status'] = 'failed'
+
+        counts = reconcile_orders(self.gateway)
+
+        self.assertEqual(counts, {'checked': 1, 'paid': 0, 'unmatched': 1})
+
+    def test_dry_run_changes_nothing(self):
+        order = self.create_order('order_a')
+        self.gateway.capture('order_a')
+
+        counts = reconcile_orders(self.gateway, dry_run=True)
+
+        self.assertEqual(counts['paid'], 1)
+        order.refresh_from_db()
+        self.assertFalse(order.is_paid)
+
+
+def razorpay_event(event, created_at, payment=None, refund=None):
+    payload = {}
+    if payment:
+        payload['payment'] = {'entity': payment}
+    if refund:
+        payload['refund'] = {'entity': refund}
+    return {'event': event, 'created_at': created_at, 'payload': payload}
+
+
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(user=User.objects.create_user('payer'), total_price=100, razorpay_order_id='order_1')
+        self.payment = {'id': 'pay_1', 'order_id': 'order_1'}
+
+    def captured(self, created_at=1000):
+        return razorpay_event('payment.captured', created_at, payment=self.payment)
+
+    def refunded(self, created_at=2000):
+        return razorpay_event(
+            'refund.processed', created_at,
+            payment={**self.payment, 'amount_refunded': 10000}, refund={'payment_id': 'pay_1', 'amount': 10000},
+        )
+
+    def test_redelivered_event_is_recorded_and_applied_once(self):
+        self.assertTrue(record_event(RAZORPAY, 'evt_1', self.captured()))
+        self.assertFalse(record_event(RAZORPAY, 'evt_1', self.captured()))
+        self.assertEqual(process_pending(), {'processed': 1, 'ignored': 0, 'failed': 0, 'pending': 0})
+        self.assertFalse(record_event(RAZORPAY, 'evt_1', self.captured()))
+        self.assertEqual(process_pending()['processed'], 0)
+        self.assertEqual(PaymentWebhook.objects.count(), 1)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+
+    def test_refund_delivered_before_its_capture_waits_for_it(self):
+        record_event(RAZORPAY, 'evt_refund', self.refunded())
+        self.assertEqual(process_pending()['pending'], 1)
+        record_event(RAZORPAY, 'evt_capture', self.captured())
+        self.assertEqual(process_pending(), {'processed': 2, 'ignored': 0, 'failed': 0, 'pending': 0})
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.is_paid, self.order.status), (True, 'refunded'))
+
+    def test_failed_attempt_keeps_holds_for_a_retry(self):
+        product = Product.objects.create(name="Last one", category=Category.objects.create(name="Misc"), price=100, stock=1)
+        reserve(self.order, [CartItem(product=product, quantity=1)])
+        record_event(RAZORPAY, 'evt_fail', razorpay_event('payment.failed', 1000, payment={'id': 'pay_0', 'order_id': 'order_1'}))
+        self.assertEqual(process_pending()['processed'], 1)
+        self.assertEqual(StockHold.objects.get(order=self.order).status, 'held')
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+
+        record_event(RAZORPAY, 'evt_capture', self.captured(created_at=1100))
+        process_pending()
+        self.assertEqual(StockHold.objects.get(order=self.order).status, 'confirmed')
+
+    def test_unknown_orders_are_ignored_but_handler_bugs_are_retried(self):
+        record_event(RAZORPAY, 'evt_other', razorpay_event('payment.captured', 1000, payment={'id': 'pay_x', 'order_id': 'order_x'}))
+        with mock.patch('store.webhooks.complete_payment', side_effect=KeyError('amount')):
+            record_event(RAZORPAY, 'evt_1', self.captured())
+            self.assertEqual(process_pending(), {'processed': 0, 'ignored': 1, 'failed': 0, 'pending': 1})
+        self.assertIn("KeyError: 'amount'", PaymentWebhook.objects.get(event_id='evt_1').last_error)
+        self.assertEqual(PaymentWebhook.objects.get(event_id='evt_other').last_error, "No order for this payment.")
+
+
+class CatalogListingTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        category = Category.objects.create(name="Tea")
+        self.products = [
+            Product.objects.create(name=f"Tea {n}", category=category, price=100, description="", stock=5)
+            for n in range(5)
+        ]
+        self.newest_first = self.products[::-1]
+
+    def get_page(self, **params):
+        return self.client.get(reverse('product_list'), {'page_size': 2, **params}).context['page']
+
+    def test_pages_neither_repeat_nor_skip_across_an_insert(self):
+        first = self.get_page()
+        self.assertEqual(list(first), self.newest_first[:2])
+        Product.objects.create(name="Tea new", category=self.products[0].category, price=100, description="", stock=5)
+        second = self.get_page(cursor=first.next_cursor)
+        third = self.get_page(cursor=second.next_cursor)
+        self.assertEqual(list(second), self.newest_first[2:4])
+        self.assertEqual(list(third), self.newest_first[4:])
+        self.assertFalse(third.has_next)
+
+    def test_unavailable_products_are_listed_but_archived_ones_are_not(self):
+        unavailable, archived = self.products[:2]
+        Product.objects.filter(pk=unavailable.pk).update(is_available=False)
+        Product.objects.filter(pk=archived.pk).update(is_archived=True)
+        index_products([unavailable.pk, archived.pk])
+        response = self.client.get(reverse('product_list'), {'page_size': 10})
+        self.assertEqual(list(response.context['page']), [p for p in self.newest_first if p != archived])
+        self.assertEqual(set(search_product_ids('tea')), {p.pk for p in self.products if p != archived})
+
+    def test_malformed_cursor_starts_from_the_top(self):
+        page = self.get_page(cursor='not-a-cursor')
+        self.assertTrue(page.is_first)
+        self.assertEqual(list(page), self.newest_first[:2])
+
+
+class SearchIndexTests(TestCase):
+    def check_index_follows_writes(self):
+        reset_backend()
+        self.addCleanup(reset_backend)
+        category = Category.objects.create(name="Kitchen")
+        product = Product.objects.create(name="Zebra teapot", category=category, price=500, description="", stock=5)
+        self.assertEqual(search_product_ids('zebra tea'), [product.pk])
+
+        product.name = "Yak mug"
+        product.save()
+        self.assertEqual(search_product_ids('zebra'), [])
+        self.assertEqual(search_product_ids('yak'), [product.pk])
+
+        ProductTag.objects.create(product=product, tag=Tag.objects.create(name="Handmade"))
+        category.name = "Crockery"
+        category.save()
+        self.assertEqual(search_product_ids('handmade crock'), [product.pk])
+
+        product.delete()
+        self.assertEqual(search_product_ids('yak'), [])
+
+    def test_fts5_index_follows_writes(self):
+        if not Fts5Backend().is_available():
+            self.skipTest("SQLite was built without FTS5.")
+        with self.settings(STORE_SEARCH_BACKEND='fts5'):
+            self.check_index_follows_writes()
+
+    def test_in_memory_index_follows_writes(self):
+        with self.settings(STORE_SEARCH_BACKEND='python'):
+            self.check_index_follows_writes()
+
+
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Tea")
+        # Cheap matches rank first (name hits), expensive ones only match on description.
+        self.cheap = [
+            Product.objects.create(name=f"Green tea {n}", category=self.category, price=100, description="", stock=5)
+            for n in range(6)
+        ]
+        self.dear = [
+            Product.objects.create(name=f"Blend {n}", category=self.category, price=2000, description="tea", stock=5)
+            for n in range(4)
+        ]
+
+    def test_facets_narrow_search_results_before_paging(self):
+        response = self.client.get(reverse('product_list'), {'q': 'tea', 'price': '1000-5000', 'page_size': 3})
+        page = response.context['page']
+        self.assertEqual(len(page), 3)
+        self.assertTrue(page.has_next)
+        self.assertTrue(all(product.price == 2000 for product in page))
+        response = self.client.get(reverse('product_list'), {
+            'q': 'tea', 'price': '1000-5000', 'page_size': 3, 'cursor': page.next_cursor,
+        })
+        self.assertEqual(len(response.context['page']), 1)
+        self.assertFalse(response.context['page'].has_next)
+
+    @override_settings(STORE_SEARCH_MAX_RESULTS=3)
+    def test_filtered_matches_past_the_result_cap_are_reachable(self):
+        ids = search_product_ids('tea', within=Product.objects.filter(price=2000))
+        self.assertEqual(len(ids), 3)
+        self.assertTrue(set(ids) <= {product.pk for product in self.dear})
+
+
+class StockFacetTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Last kettle", category=Category.objects.create(name="Kitchen"), price=900, description="", stock=1,
+        )
+
+    def availability(self):
+        return dict(facet_counts()['availability'])
+
+    def test_selling_out_and_restocking_move_the_availability_facet(self):
+        self.assertEqual(self.availability(), {'in_stock': 1})
+        take_stock({self.product.pk: 1})
+        self.assertEqual(self.availability(), {'out_of_stock': 1})
+        self.assertEqual(len(filter_products(Product.objects.listed(), {'availability': 'in_stock'})), 0)
+        return_stock({self.product.pk: 1})
+        self.assertEqual(self.availability(), {'in_stock': 1})
+
+    def test_expired_holds_restock_the_facet(self):
+        order = Order.objects.create(user=User.objects.create_user('shopper'), total_price=900)
+        StockHold.objects.create(order=order, product=self.product, quantity=1, expires_at=timezone.now())
+        take_stock({self.product.pk: 1})
+        self.assertEqual(self.availability(), {'out_of_stock': 1})
+        self.assertEqual(release_expired_holds(), 1)
+        self.assertEqual(self.availability(), {'in_stock': 1})
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Books")
+        self.product = Product.objects.create(name="Novel", category=category, price=10, description="")
+        self.users = [User.objects.create_user(f'reader{n}') for n in range(3)]
+
+    def review(self, user, rating):
+        return Review.objects.create(product=self.product, user=user, rating=rating, comment="")
+
+    def assertAggregates(self, count, total, average, histogram):
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (count, total))
+        self.assertEqual(self.product.average_rating, average)
+        self.assertEqual([count for _, count, _ in self.product.rating_histogram], histogram)
+
+    def test_create_edit_and_delete(self):
+        first = self.review(self.users[0], 5)
+        self.review(self.users[1], 4)
+        self.review(self.users[2], 4)
+        self.assertAggregates(3, 13, 4.3, [1, 2, 0, 0, 0])
+
+        first = Review.objects.get(id=first.id)
+        first.rating = 1
+        first.save()
+        self.assertAggregates(3, 9, 3.0, [0, 2, 0, 0, 1])
+
+        first.delete()
+        Review.objects.filter(user=self.users[1]).delete()
+        self.assertAggregates(1, 4, 4.0, [0, 1, 0, 0, 0])
+
+    def test_review_built_with_an_existing_pk_is_counted_once(self):
+        stored = self.review(self.users[0], 5)
+        Review(pk=stored.pk, product=self.product, user=self.users[0], rating=2, comment="").save()
+        self.assertAggregates(1, 2, 2.0, [0, 0, 0, 1, 0])
+
+        other = Product.objects.create(name="Poems", category=self.product.category, price=10, description="")
+        Review(pk=stored.pk, product=other, user=self.users[0], rating=3, comment="").save()
+        self.assertAggregates(0, 0, 0.0, [0, 0, 0, 0, 0])
+        other.refresh_from_db()
+        self.assertEqual((other.review_count, other.rating_sum), (1, 3))
+
+    def test_matches_full_recount(self):
+        for user, rating in zip(self.users, [2, 3, 5]):
+            self.review(user, rating)
+        self.users[0].delete()
+        self.product.refresh_from_db()
+        counted = (self.product.review_count, self.product.rating_sum, self.product.average_rating)
+        self.product.recalculate_ratings()
+        self.assertEqual(counted, (2, 8, 4.0))
+        self.assertEqual(counted, (self.product.review_count, self.product.rating_sum, self.product.average_rating))
+
+
+@override_settings(STORE_REVIEW_PAGE_SIZE=3)
+class ReviewFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Games")
+        self.product = Product.objects.create(name="Chess", category=category, price=10, description="")
+        now = timezone.now()
+        for n in range(7):
+            user = User.objects.create_user(f'player{n}')
+            Review.objects.create(product=self.product, user=user, rating=5 if n % 2 else 3, comment=f"#{n}",
+                                  created_at=now - timedelta(minutes=n))
+
+    def test_pages_newest_first_in_one_query_each(self):
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                feed = review_feed(self.product.id, cursor=cursor)
+            seen += [review['comment'] for review in feed['reviews']]
+            cursor = feed['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [f"#{n}" for n in range(7)])
+        self.assertEqual(feed['reviews'][0]['username'], 'player6')
+
+    def test_rating_filter(self):
+        feed = review_feed(self.product.id, rating='5')
+        self.assertEqual([review['comment'] for review in feed['reviews']], ['#1', '#3', '#5'])
+        self.assertIsNone(feed['next_cursor'])
+
+    def test_pages_are_cached_until_a_review_is_written(self):
+        review_feed(self.product.id)
+        with self.assertNumQueries(0):
+            review_feed(self.product.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, user=User.objects.create_user('late'), rating=4, comment="new")
+        self.assertEqual(review_feed(self.product.id)['reviews'][0]['comment'], "new")
+
+    def test_product_page_renders_feed(self):
+        response = self.client.get(self.product.get_absolute_url(), {'rating': 3})
+        self.assertContains(response, "#0")
+        self.assertNotContains(response, "#1")
+
+
+class ProductPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Tea")
+        self.product = Product.objects.create(name="Assam", category=self.category, price=200, description="Strong")
+        ProductVariant.objects.create(product=self.product, name="250g", price=200)
+        self.url = self.product.get_absolute_url()
+
+    def test_cached_page_is_one_query(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, "250g")
+        self.assertContains(response, "Tea")
+
+    def test_related_changes_refresh_the_page(self):
+        self.client.get(self.url)
+        ProductVariant.objects.create(product=self.product, name="1kg", price=700)
+        self.assertContains(self.client.get(self.url), "1kg")
+
+        self.category.name = "Black tea"
+        self.category.save()
+        self.assertContains(self.client.get(self.url), "Black tea")
+
+        Review.objects.create(product=self.product, user=User.objects.create_user('sipper'), rating=4, comment="")
+        self.assertContains(self.client.get(self.url), "1 review)")
+
+    def test_wishlist_state_is_per_user(self):
+        fan, other = User.objects.create_user('fan'), User.objects.create_user('other')
+        fan.wishlist.create(product=self.product)
+        self.client.force_login(fan)
+        self.assertTrue(self.client.get(self.url).context['in_wishlist'])
+        self.client.force_login(other)
+        self.assertFalse(self.client.get(self.url).context['in_wishlist'])
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        catalog_cache.get_cache().clear()
+        self.category = Category.objects.create(name="Tea")
+        self.product = Product.objects.create(name="Assam", category=self.category, price=200, description="", stock=5)
+        self.tag = Tag.objects.create(name="Organic")
+        ProductTag.objects.create(product=self.product, tag=self.tag)
+
+    def test_reads_are_cached_until_their_models_change(self):
+        self.assertEqual([c.name for c in catalog_cache.categories()], ["Tea"])
+        self.assertEqual(catalog_cache.product_tags(self.product.pk), ["Organic"])
+        self.assertEqual(catalog_cache.variants(self.product.pk), [])
+        with self.assertNumQueries(0):
+            catalog_cache.categories()
+            catalog_cache.product_tags(self.product.pk)
+            catalog_cache.variants(self.product.pk)
+
+        Category.objects.create(name="Coffee")
+        self.tag.name = "Fair trade"
+        self.tag.save()
+        ProductVariant.objects.create(product=self.product, name="1kg", price=700)
+        self.assertEqual([c.name for c in catalog_cache.categories()], ["Coffee", "Tea"])
+        self.assertEqual(catalog_cache.tag_names(), {str(self.tag.pk): "Fair trade"})
+        self.assertEqual(catalog_cache.product_tags(self.product.pk), ["Fair trade"])
+        self.assertEqual([v.name for v in catalog_cache.variants(self.product.pk)], ["1kg"])
+
+    def test_listing_pages_are_cached_per_filter(self):
+        tagged = {'tag': str(self.tag.pk)}
+        self.assertEqual(list(catalog_cache.listing_page(tagged, None, 10)), [self.product])
+        with self.assertNumQueries(0):
+            catalog_cache.listing_page(tagged, None, 10)
+        other = Product.objects.create(name="Darjeeling", category=self.category, price=300, description="", stock=5)
+        self.assertEqual(list(catalog_cache.listing_page(tagged, None, 10)), [self.product])
+        self.assertEqual(list(catalog_cache.listing_page({}, None, 10)), [other, self.product])
+        # Stock changes by update() and sends no signal, so these aren't cached.
+        Product.objects.filter(pk=other.pk).update(stock=0)
+        self.assertEqual(list(catalog_cache.listing_page({'availability': 'out_of_stock'}, None, 10)), [other])
+
+    def test_concurrent_misses_build_once(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(catalog_cache.cached('categories', ('category',), build)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 4)
+        self.assertEqual(len(builds), 1)
+        counts = catalog_cache.stats()['categories']
+        self.assertEqual((counts['miss'], counts['wait']), (1, 3))
+        catalog_cache.cached('categories', ('category',), build)
+        self.assertEqual(catalog_cache.stats()['categories']['hit'], 1)
+
+
+def png_bytes(width, height):
+    out = BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(out, format='PNG')
+    return out.getvalue()
+
+
+@override_settings(STORE_IMAGE_WIDTHS=(100, 200, 400), STORE_IMAGE_FORMATS=('webp',))
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        self.storage = FileSystemStorage(location=self.media, base_url='/media/')
+        category = Category.objects.create(name="Prints")
+        self.source = self.storage.save('products/ab/poster.png', ContentFile(png_bytes(300, 150)))
+        self.products = [
+            Product.objects.create(name=f"Poster {n}", category=category, price=10, description="", image=self.source)
+            for n in range(2)
+        ]
+
+    def test_widths_stop_at_the_source_width(self):
+        size, rendered = render_derivatives(png_bytes(300, 150), (100, 200, 400), ('webp',))
+        self.assertEqual(size, (300, 150))
+        self.assertEqual([(fmt, width) for fmt, width, _ in rendered], [('webp', 100), ('webp', 200), ('webp', 300)])
+        _, rendered = render_derivatives(png_bytes(800, 600), (100, 200, 400), ('webp',))
+        self.assertEqual([width for _, width, _ in rendered], [100, 200, 400])
+
+    def test_shared_source_is_rendered_once_and_emits_srcset(self):
+        self.assertEqual(build_derivatives(Product.objects.all(), storage=self.storage), (1, 0))
+        for product in Product.objects.all():
+            self.assertEqual(product.display_size, (300, 150))
+            [source] = product.display_sources
+            self.assertEqual(source['type'], 'image/webp')
+            self.assertRegex(source['srcset'], r'^/media/derivatives/\w\w/\w{64}\.webp 100w, .+\.webp 200w, .+\.webp 300w$')
+        # Already current: nothing to do.
+        self.assertEqual(build_derivatives(Product.objects.all(), storage=self.storage), (0, 0))
+
+    def test_replaced_image_falls_back_until_rerendered(self):
+        build_derivatives(Product.objects.all(), storage=self.storage)
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.image = self.storage.save('products/cd/new.png', ContentFile(png_bytes(120, 120)))
+        product.save()
+        self.assertEqual(product.display_sources, [])
+        build_derivatives([product], storage=self.storage)
+        product.refresh_from_db()
+        self.assertIn('100w', product.display_sources[0]['srcset'])
+
+
+class StubImageHandler(BaseHTTPRequestHandler):
+    """Serves /ok.png, /slow.png (slower than the test timeout), /big.png, /page.html; anything else is a 404."""
+
+    def do_GET(self):
+        if self.path == '/slow.png':
+            time.sleep(1)
+        body, content_type = {
+            '/ok.png': (png_bytes(4, 4), 'image/png'),
+            '/slow.png': (png_bytes(4, 4), 'image/png'),
+            '/big.png': (b'\0' * 4096, 'image/png'),
+            '/page.html': (b'<html></html>', 'text/html'),
+        }.get(self.path, (b'', None))
+        self.send_response(200 if content_type else 404)
+        self.send_header('Content-Type', content_type or 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class StubImageServerMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubImageHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        self.storage = FileSystemStorage(location=self.media)
+
+
+class ImageDownloaderTests(StubImageServerMixin, SimpleTestCase):
+    def test_each_url_gets_its_own_result(self):
+        urls = {
+            'ok': f"{self.base_url}/ok.png",
+            'timeout': f"{self.base_url}/slow.png",
+            'oversize': f"{self.base_url}/big.png",
+            'not an image': f"{self.base_url}/page.html",
+            'missing': f"{self.base_url}/missing.png",
+            'invalid': "http://[::1/broken.png",
+        }
+        for downloader_class in (AsyncImageDownloader, ImageDownloader):
+            with self.subTest(downloader_class.__name__):
+                downloader = downloader_class(timeout=0.3, max_bytes=1024, retries=0, storage=self.storage)
+                try:
+                    results = downloader.fetch_many(urls.values())
+                finally:
+                    downloader.close()
+                result = {label: results[url] for label, url in urls.items()}
+                self.assertTrue(result['ok'].ok)
+                self.assertTrue(self.storage.exists(result['ok'].name))
+                for label in ('timeout', 'oversize', 'not an image', 'missing', 'invalid'):
+                    self.assertFalse(result[label].ok, label)
+                    self.assertTrue(result[label].error, label)
+                self.assertIn('larger than', result['oversize'].error)
+                self.assertIn('non-image', result['not an image'].error)
+                self.assertEqual(result['missing'].error, 'HTTP 404')
+
+
+class ProductImportTests(StubImageServerMixin, TestCase):
+    def test_rows_import_even_when_their_images_fail(self):
+        rows = [
+            ("Mug", f"{self.base_url}/ok.png"),
+            ("Jug", f"{self.base_url}/missing.png"),
+            ("Bowl", f"{self.base_url}/page.html"),
+            ("Cup", "http://[::1/broken.png"),
+            ("Plate", ""),
+        ]
+        csv_bytes = "name,price,stock,category,image\n" + "".join(f"{name},10,1,Kitchen,{url}\n" for name, url in rows)
+        with override_settings(MEDIA_ROOT=self.media, STORE_IMAGE_FETCH_TIMEOUT=2):
+            # No downloader passed: the importer's default (async) one is used.
+            result = import_products_csv(BytesIO(csv_bytes.encode()), batch_size=2)
+
+        self.assertEqual(result.created, 5)
+        self.assertEqual(result.warning_count, 3)
+        self.assertTrue(all('Failed to download image' in warning for warning in result.warnings))
+        images = dict(Product.objects.order_by('id').values_list('name', 'image'))
+        self.assertRegex(images['Mug'], r'^products/\w\w/\w{64}\.png$')
+        self.assertEqual([name for name, image in images.items() if not image], ['Jug', 'Bowl', 'Cup', 'Plate'])
+
+
+    def test_rows_are_written_in_batches_and_indexed(self):
+        Category.objects.create(name="Kitchen")
+        csv_bytes = (
+            "name,price,stock,category,is_available\n"
+            "Teapot,250,3,Kitchen,true\nTeapot,300,1,Kitchen,true\n,10,1,Kitchen,true\n"
+            "Kettle,cheap,1,Kitchen,true\nToaster,900,2,Appliances,true\nTea tray,80,0,,false\n"
+        )
+        result = import_products_csv(BytesIO(csv_bytes.encode()), batch_size=2)
+
+        self.assertEqual((result.created, result.skipped, result.batches), (4, 2, 2))
+        self.assertEqual(result.warning_count, 2)
+        products = Product.objects.order_by('id')
+        self.assertEqual([p.slug for p in products], ['teapot', 'teapot-1', 'toaster', 'tea-tray'])
+        self.assertEqual([p.category.name for p in products], ['Kitchen', 'Kitchen', 'Appliances', 'Uncategorized'])
+        self.assertEqual(Category.objects.filter(name="Kitchen").count(), 1)
+        self.assertFalse(products.get(slug='tea-tray').is_available)
+        self.assertEqual(set(search_product_ids('tea')), {p.pk for p in products if p.name.startswith('Tea')})
+
+class MediaTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.storage = MediaStorage()
+
+    def test_images_are_saved_under_their_content_hash(self):
+        name = self.storage.save('products/poster.png', ContentFile(png_bytes(20, 20)))
+        self.assertRegex(name, r'^products/poster\.[0-9a-f]{12}\.png$')
+        self.assertEqual(self.storage.save('products/poster.png', ContentFile(png_bytes(20, 20))), name)
+        self.assertNotEqual(self.storage.save('products/poster.png', ContentFile(png_bytes(30, 20))), name)
+        # Already-hashed names (imports, derivatives) and private files keep theirs.
+        self.assertEqual(self.storage.save('products/ab/' + 'ab' * 32 + '.png', ContentFile(b'x')), 'products/ab/' + 'ab' * 32 + '.png')
+        self.assertEqual(self.storage.save('invoices/1.pdf', ContentFile(b'x')), 'invoices/1.pdf')
+
+    def test_hashed_media_is_immutable_and_revalidates_to_304(self):
+        name = self.storage.save('profile_pics/me.png', ContentFile(png_bytes(20, 20)))
+        response = self.client.get(f'/media/{name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], f'"{name_digest(name)}"')
+        self.assertEqual(b''.join(response.streaming_content), png_bytes(20, 20))
+        response = self.client.get(f'/media/{name}', HTTP_IF_NONE_MATCH=f'"{name_digest(name)}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_precompressed_copy_is_served_to_clients_that_accept_it(self):
+        name = self.storage.save('uploaded_products/flat.bmp', ContentFile(b'BM' + b'\0' * 4096))
+        self.assertTrue(self.storage.exists(name + '.gz'))
+        response = self.client.get(f'/media/{name}', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertLess(int(response['Content-Length']), 4098)
+        response = self.client.get(f'/media/{name}', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Length'], '4098')
+
+    def test_private_and_missing_files_are_not_served(self):
+        self.storage.save('invoices/1.pdf', ContentFile(b'%PDF'))
+        self.assertEqual(self.client.get('/media/invoices/1.pdf').status_code, 404)
+        self.assertEqual(self.client.get('/media/products/missing.png').status_code, 404)
+        self.assertEqual(self.client.get('/media/products/../invoices/1.pdf').status_code, 404)
+
+
+class CartUpdateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        category = Category.objects.create(name="Kitchen")
+        self.mug, self.jug, self.bowl = [
+            Product.objects.create(name=name, category=category, price=price, description="", stock=5)
+            for name, price in (("Mug", 100), ("Jug", 250), ("Bowl", 40))
+        ]
+        self.items = [CartItem.objects.create(user=self.user, product=p, quantity=1) for p in (self.mug, self.jug, self.bowl)]
+        self.client.force_login(self.user)
+
+    def test_only_changed_lines_are_written(self):
+        mug, jug, bowl = self.items
+        response = self.client.post(
+            reverse('update_cart'),
+            {'quantities': {mug.id: 3, jug.id: 0, bowl.id: 1}},
+            content_type='application/json',
+        )
+        delta = response.json()
+        self.assertEqual(delta['status'], 'ok')
+        self.assertEqual(delta['updated'], {str(mug.id): {'quantity': 3, 'line_total': '300.00'}})
+        self.assertEqual(delta['removed'], [jug.id])
+        self.assertEqual((delta['total'], delta['item_count']), ('340.00', 2))
+        self.assertEqual(dict(CartItem.objects.values_list('product__name', 'quantity')), {"Mug": 3, "Bowl": 1})
+
+    def test_lines_over_stock_are_left_unchanged(self):
+        mug, jug, _ = self.items
+        response = self.client.post(
+            reverse('update_cart'), {f'quantity_{mug.id}': 6, f'quantity_{jug.id}': 2}, HTTP_ACCEPT='application/json',
+        )
+        delta = response.json()
+        self.assertEqual(delta['status'], 'error')
+        self.assertEqual(delta['errors'], {str(mug.id): "Only 5 of Mug in stock."})
+        self.assertEqual(list(delta['updated']), [str(jug.id)])
+        self.assertEqual(dict(CartItem.objects.values_list('product__name', 'quantity')), {"Mug": 1, "Jug": 2, "Bowl": 1})
+
+    def test_other_users_lines_are_not_touched(self):
+        other = CartItem.objects.create(user=User.objects.create_user('other'), product=self.mug, quantity=1)
+        self.client.post(reverse('update_cart'), {f'quantity_{other.id}': 4})
+        other.refresh_from_db()
+        self.assertEqual(other.quantity, 1)
+
+
+class AddToCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.product = Product.objects.create(
+            name="Mug", category=Category.objects.create(name="Kitchen"), price=100, description="", stock=3,
+        )
+
+    def test_adds_accumulate_up_to_stock(self):
+        self.assertEqual(add_item(self.user, self.product.id, 2), 2)
+        self.assertEqual(add_item(self.user, self.product.id), 3)
+        with self.assertRaisesMessage(OutOfStock, "Only 3 of Mug in stock."):
+            add_item(self.user, self.product.id)
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 3)
+        with self.assertRaises(Product.DoesNotExist):
+            add_item(self.user, self.product.id + 100)
+
+    def test_conditional_update_fallback_matches_the_upsert(self):
+        self.assertEqual(_add_with_conditional_update(self.user.pk, self.product.id, 2), 2)
+        self.assertEqual(_add_with_conditional_update(self.user.pk, self.product.id, 1), 3)
+        self.assertIsNone(_add_with_conditional_update(self.user.pk, self.product.id, 1))
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 3)
+
+    def test_view_reports_stock_errors_as_409(self):
+        self.client.force_login(self.user)
+        url = reverse('add_to_cart', args=[self.product.id])
+        response = self.client.post(url, {'quantity': 2}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'status': 'ok', 'quantity': 2, 'cart_item_count': 1})
+        response = self.client.post(url, {'quantity': 2}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.post(reverse('add_to_cart', args=[self.product.id + 100])).status_code, 404)
+
+
+def shipping_address(**kwargs):
+    return Address(
+        full_name='Buyer', phone='0000000000', address_line1='1 Test Street', city='City', state='State',
+        country='India', postal_code='000000', **kwargs
+    )
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Last kettle", category=Category.objects.create(name="Kitchen"), price=900, description="", stock=1,
+        )
+        self.buyers = [User.objects.create_user(name) for name in ('first', 'second')]
+        for buyer in self.buyers:
+            CartItem.objects.create(user=buyer, product=self.product, quantity=1)
+
+    def test_two_orders_for_the_last_unit_sell_it_once(self):
+        # Both carts are read before either order is placed, as two concurrent checkouts would.
+        lines = [load_cart_lines(buyer) for buyer in self.buyers]
+        order = place_order(self.buyers[0], shipping_address(), lines[0])
+        with self.assertRaisesMessage(CheckoutError, "Not enough stock for: Last kettle."):
+            place_order(self.buyers[1], shipping_address(), lines[1])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(list(Order.objects.all()), [order])
+        self.assertEqual(StockHold.objects.get().order, order)
+
+    def test_failed_checkout_writes_nothing(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        with self.assertRaises(CheckoutError):
+            place_order(self.buyers[0], shipping_address(), load_cart_lines(self.buyers[0]))
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertFalse(Address.objects.exists())
+        self.assertTrue(CartItem.objects.filter(user=self.buyers[0]).exists())
+
+    def test_order_is_written_with_its_items_and_clears_the_cart(self):
+        order = place_order(self.buyers[0], shipping_address(), load_cart_lines(self.buyers[0]))
+        self.assertEqual(order.total_price, 900)
+        self.assertEqual(list(order.items.values_list('product_name', 'quantity')), [("Last kettle", 1)])
+        self.assertEqual(order.shipping_address.user, self.buyers[0])
+        self.assertFalse(CartItem.objects.filter(user=self.buyers[0]).exists())
+        self.assertTrue(CartItem.objects.filter(user=self.buyers[1]).exists())
+
+
+class PriceSnapshotTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Kettle", category=Category.objects.create(name="Kitchen"), price=900, description="", stock=10,
+        )
+        self.order = Order.objects.create(user=User.objects.create_user('buyer'))
+        self.item = OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+
+    def test_order_keeps_its_prices_when_the_product_changes(self):
+        self.product.price = 1200
+        self.product.name = "Kettle (new model)"
+        self.product.save()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, 1800)
+        item = OrderItem.objects.get(pk=self.item.pk)
+        self.assertEqual((item.product_name, item.price, item.line_total), ("Kettle", 900, 1800))
+
+        # Changing the quantity reprices at the snapshot, not the current price.
+        item.quantity = 3
+        item.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, 2700)
+        self.order.update_total_price()
+        self.assertEqual(self.order.total_price, 2700)
+
+    def test_total_follows_item_deletes(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+        OrderItem.objects.get(pk=self.item.pk).delete()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, 900)
+
+
+class InvoiceDownloadTests(TestCase):
+    pdf = b'%PDF-1.4 ' + bytes(range(256)) * 4
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user('buyer', password='pass')
+        self.order = Order.objects.create(user=self.user, total_price=100)
+        self.order.refresh_from_db()
+        self.invoice = Invoice.objects.create(
+            order=self.order, fingerprint=invoice_fingerprint(self.order), digest=write_invoice_file(self.pdf),
+            size=len(self.pdf),
+        )
+        self.url = reverse('download_invoice', args=[self.order.id])
+        self.client.force_login(self.user)
+
+    def test_full_and_partial_downloads(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{self.invoice.digest}"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), self.pdf)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.pdf)}')
+        self.assertEqual(b''.join(response.streaming_content), self.pdf[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.pdf[-10:])
+
+    def test_unsatisfiable_range_is_416(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.pdf)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.pdf)}')
+
+    def test_conditional_requests(self):
+        etag = f'"{self.invoice.digest}"'
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # A range against an older version gets the whole current file.
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.pdf)
+
+    def test_changed_order_is_rendered_again_instead_of_served(self):
+        Order.objects.filter(pk=self.order.pk).update(total_price=250)
+        response = self.client.get(self.url)
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job_detail', args=[job.id]), fetch_redirect_response=False)
+        self.assertEqual(job.args, [self.order.id])
+
+    def test_other_users_invoices_are_not_found(self):
+        self.client.force_login(User.objects.create_user('other', password='pass'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@task(name='store.tests.sometimes_fails', max_attempts=2)
+def sometimes_fails(fail):
+    if fail:
+        raise RuntimeError("boom")
+    return {'ok': True}
+
+
+@task(name='store.tests.takes_a_while')
+def takes_a_while(seconds):
+    time.sleep(seconds)
+
+
+class JobQueueTests(TestCase):
+    def test_due_jobs_are_claimed_by_priority_and_only_once(self):
+        low = enqueue(sometimes_fails.task_name, args=[False], priority=Job.PRIORITY_LOW)
+        high = enqueue(sometimes_fails.task_name, args=[False], priority=Job.PRIORITY_HIGH)
+        enqueue(sometimes_fails.task_name, args=[False], priority=Job.PRIORITY_HIGH, delay=60)
+        self.assertEqual(claim_job('w1'), high)
+        self.assertEqual(claim_job('w2'), low)
+        self.assertIsNone(claim_job('w3'))
+        job = run_job(Job.objects.get(pk=high.pk))
+        self.assertEqual((job.status, job.result, job.attempts), ('succeeded', {'ok': True}, 1))
+
+    def test_failures_back_off_then_fail(self):
+        sometimes_fails.delay(True)
+        job = run_job(claim_job('w1'))
+        self.assertEqual(job.status, 'queued')
+        self.assertIn("RuntimeError: boom", job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIsNone(claim_job('w1'))
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        job = run_job(claim_job('w1'))
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_jobs_of_lost_workers_are_requeued_or_failed(self):
+        stale = timezone.now() - timedelta(hours=1)
+        retryable = sometimes_fails.delay(False)
+        spent = sometimes_fails.delay(False)
+        running = sometimes_fails.delay(False)
+        Job.objects.filter(pk__in=[retryable.pk, spent.pk]).update(status='running', locked_by='gone', locked_at=stale)
+        Job.objects.filter(pk=spent.pk).update(attempts=2)
+        Job.objects.filter(pk=running.pk).update(status='running', locked_by='alive', locked_at=timezone.now())
+
+        self.assertEqual(requeue_stale_jobs(timeout=60), 2)
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[retryable.pk], statuses[spent.pk], statuses[running.pk]], ['queued', 'failed', 'running']
+        )
+
+    def test_heartbeat_keeps_a_long_running_job_claimed(self):
+        takes_a_while.delay(0)
+        job = claim_job('w1')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(heartbeat(job), 1)
+        self.assertEqual(requeue_stale_jobs(timeout=60), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('running', 'w1'))
+
+    @override_settings(STORE_JOB_HEARTBEAT_INTERVAL=0.05)
+    def test_running_job_beats_until_it_finishes(self):
+        takes_a_while.delay(0.3)
+        # The beat runs on its own thread (and connection); count the beats here.
+        with mock.patch('store.jobs.heartbeat') as beat:
+            job = run_job(claim_job('w1'))
+            beats = beat.call_count
+            time.sleep(0.1)
+        self.assertEqual(job.status, 'succeeded')
+        self.assertGreaterEqual(beats, 3)
+        self.assertEqual(beat.call_count, beats)
+
+
+class FlakyBackend(EmailBackend):
+    """locmem backend that drops the connection on chosen sends and counts opens."""
+
+    def __init__(self, fail_on=(), **kwargs):
+        super().__init__(**kwargs)
+        self.fail_on, self.sends, self.opens = set(fail_on), 0, 0
+
+    def open(self):
+        self.opens += 1
+
+    def send_messages(self, messages):
+        self.sends += 1
+        if self.sends in self.fail_on:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return super().send_messages(messages)
+
+
+class OrderEmailTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', email='buyer@example.com')
+        self.orders = [Order.objects.create(user=self.user, total_price=100, is_paid=True) for _ in range(5)]
+
+    def test_batches_share_one_connection(self):
+        for order in self.orders:
+            queue_order_confirmation(order)
+        backend = FlakyBackend()
+        counts = send_pending(batch_size=2, connection=backend)
+        self.assertEqual((counts['sent'], counts['batches']), (5, 3))
+        self.assertEqual(backend.opens, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, f"Order Confirmation - #{self.orders[0].id}")
+
+    def test_queued_once_per_order(self):
+        self.assertIsNotNone(queue_order_confirmation(self.orders[0]))
+        self.assertIsNone(queue_order_confirmation(self.orders[0]))
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_transient_failure_is_retried_later(self):
+        for order in self.orders:
+            queue_order_confirmation(order)
+        backend = FlakyBackend(fail_on={2})
+        counts = send_pending(connection=backend)
+        self.assertEqual((counts['sent'], counts['pending'], counts['failed']), (4, 1, 0))
+        self.assertEqual(backend.opens, 2)
+        retry = OutboundEmail.objects.get(status='pending')
+        self.assertEqual(retry.attempts, 1)
+        self.assertGreater(retry.send_after, timezone.now())
+
+
+class CircuitBreakerTests(TestCase):
+    def fail(self):
+        raise GatewayUnavailable("timed out")
+
+    def test_opens_after_threshold_and_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            with self.assertRaises(GatewayUnavailable):
+                breaker.call(self.fail)
+        self.assertEqual(breaker.state, 'open')
+
+        calls = []
+        with self.assertRaises(GatewayUnavailable):
+            breaker.call(calls.append, 1)
+        self.assertEqual(calls, [])     # failed fast, gateway not called
+
+        breaker.opened_at -= 60
+        self.assertEqual(breaker.state, 'half-open')
+        breaker.call(calls.append, 1)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_other_errors_do_not_trip(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        with self.assertRaises(ValueError):
+            breaker.call(int, 'x')
+        self.assertEqual(breaker.state, 'closed')
+
+
+class StubRazorpayHandler(BaseHTTPRequestHandler):
+    """Answers POST /v1/orders and GET /v1/payments (three captured, one failed) like the Razorpay API."""
+    payments = [
+        {'id': f'pay_{n}', 'order_id': f'order_{n}', 'status': 'failed' if n == 2 else 'captured'} for n in range(4)
+    ]
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.headers['Authorization'] != 'Basic ' + base64.b64encode(b'rzp_test:secret').decode():
+            self.reply(401, {'error': {'description': 'Authentication failed'}})
+        elif data['amount'] >= 500000:
+            self.reply(503, {})
+        elif data['amount'] < 100:
+            self.reply(400, {'error': {'description': 'Order amount less than minimum amount allowed'}})
+        else:
+            self.reply(200, {'id': 'order_stub', **data})
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        skip, count = int(query['skip'][0]), int(query['count'][0])
+        self.reply(200, {'items': self.payments[skip:skip + count]})
+
+    def log_message(self, *args):
+        pass
+
+
+class RazorpayGatewayTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubRazorpayHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def gateway(self, key_id='rzp_test', **kwargs):
+        gateway = RazorpayGateway(key_id=key_id, key_secret='secret', **kwargs)
+        gateway.api_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+        gateway.list_page_size = 2
+        return gateway
+
+    def test_orders_and_payment_listing(self):
+        gateway = self.gateway()
+        order = gateway.create_order(10000, receipt='order_1')
+        self.assertEqual(order, {
+            'id': 'order_stub', 'amount': 10000, 'currency': 'INR', 'payment_capture': 1, 'receipt': 'order_1',
+        })
+        now = timezone.now()
+        self.assertEqual(async_to_sync(gateway.acreate_order)(10000)['id'], 'order_stub')
+        payments = gateway.captured_payments(now - timedelta(hours=1), now)
+        self.assertEqual([payment['id'] for payment in payments], ['pay_0', 'pay_1', 'pay_3'])
+
+    def test_errors_are_mapped_and_only_outages_trip_the_breaker(self):
+        gateway = self.gateway(failure_threshold=1)
+        with self.assertRaisesMessage(PaymentGatewayError, "less than minimum"):
+            gateway.create_order(50)
+        self.assertEqual(gateway.breaker.state, 'closed')
+        with self.assertRaises(GatewayUnavailable):
+            gateway.create_order(500000)
+        self.assertEqual(gateway.breaker.state, 'open')
+
+        with self.assertRaisesMessage(PaymentGatewayError, "Authentication failed"):
+            self.gateway(key_id='rzp_wrong').create_order(10000)
+
+
+    @override_settings(RAZORPAY_KEY_SECRET='')
+    def test_signatures_are_refused_without_a_secret(self):
+        gateway = RazorpayGateway(key_id='rzp_test')
+        forged = hmac.new(b'', b'order_1|pay_1', hashlib.sha256).hexdigest()
+        with self.assertRaises(SignatureError):
+            gateway.verify_payment_signature('order_1', 'pay_1', forged)
+        genuine = hmac.new(b'secret', b'order_1|pay_1', hashlib.sha256).hexdigest()
+        RazorpayGateway(key_id='rzp_test', key_secret='secret').verify_payment_signature('order_1', 'pay_1', genuine)
+
+@override_settings(STORE_PAYMENT_GATEWAY='fake')
+class PaymentHandlerTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        self.user = User.objects.create_user('payer')
+        self.order = Order.objects.create(user=self.user, total_price=100, razorpay_order_id='order_x')
+
+    def post(self, payment_id, signature, order_id='order_x'):
+        return self.client.post(reverse('payment_handler'), content_type='application/json', data={
+            'razorpay_order_id': order_id, 'razorpay_payment_id': payment_id, 'razorpay_signature': signature,
+        })
+
+    def test_valid_signature_marks_order_paid(self):
+        payment_id, signature = get_gateway().capture('order_x')
+        response = self.post(payment_id, signature)
+        self.assertEqual(response.json()['status'], 'success')
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+
+    def test_bad_signature_is_rejected(self):
+        response = self.post('pay_x', 'forged')
+        self.assertEqual(response.status_code, 400)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+
+    def test_repeated_callback_completes_the_order_once(self):
+        payment_id, signature = get_gateway().capture('order_x')
+        self.assertEqual(self.post(payment_id, signature).json(), {'status': 'success'})
+        self.assertEqual(self.post(payment_id, signature).json()['message'], 'Order already marked as paid.')
+        self.assertEqual(self.post(*get_gateway().capture('order_y'), order_id='order_y').status_code, 404)
+
+
+@override_settings(STORE_PAYMENT_GATEWAY='fake')
+class PaymentInitiateTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        self.user = User.objects.create_user('payer')
+        product = Product.objects.create(name="Kettle", category=Category.objects.create(name="Kitchen"), price=900, stock=5)
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product=product, quantity=1)
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['order_id'] = self.order.id
+        session.save()
+
+    def test_gateway_order_is_created_once(self):
+        response = self.client.get(reverse('payment_initiate'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['amount'], 90000)
+        self.order.refresh_from_db()
+        self.assertEqual(response.context['razorpay_order_id'], self.order.razorpay_order_id)
+
+        self.client.get(reverse('payment_initiate'))
+        self.assertEqual(list(get_gateway().orders), [self.order.razorpay_order_id])
+
+    def test_unavailable_gateway_sends_the_buyer_back_to_the_cart(self):
+        with mock.patch.object(FakeGateway, 'acreate_order', side_effect=GatewayUnavailable("timed out")):
+            response = self.client.get(reverse('payment_initiate'))
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.assertIsNone(self.order.razorpay_order_id)
+
+
+# The view records events in autocommit mode, as it runs in production, so
+# these tests can't share TestCase's wrapping transaction.
+@override_settings(RAZORPAY_WEBHOOK_SECRET='whsec_test')
+class RazorpayWebhookViewTests(TransactionTestCase):
+    def post(self, body, signature=None, event_id='evt_1'):
+        signature = signature or hmac.new(b'whsec_test', body, hashlib.sha256).hexdigest()
+        return self.client.post(
+            reverse('razorpay_webhook'), data=body, content_type='application/json',
+            HTTP_X_RAZORPAY_SIGNATURE=signature, HTTP_X_RAZORPAY_EVENT_ID=event_id,
+        )
+
+    def test_events_are_recorded_once_and_acknowledged(self):
+        body = json.dumps(razorpay_event('payment.captured', 1000, payment={'id': 'pay_1', 'order_id': 'order_1'})).encode()
+        self.assertEqual(self.post(body).json(), {'status': 'ok'})
+        self.assertEqual(self.post(body).json(), {'status': 'duplicate'})
+        self.assertEqual(PaymentWebhook.objects.get().status, 'pending')
+
+    def test_bad_signature_is_rejected(self):
+        self.assertEqual(self.post(b'{}', signature='forged').status_code, 400)
+        self.assertFalse(PaymentWebhook.objects.exists())
@@ -13,6 +13,7 @@ urlpatterns = [
 
     # ---------------- Product ----------------
     path('product/<slug:slug>/', views.product_detail, name='product_detail'),
+    path('product/<slug:slug>/reviews/', views.product_reviews, name='product_reviews'),
     path('product/<int:product_id>/review/', views.submit_review, name='submit_review'),
     path('products/', views.product_list, name='product_list'),
 
@@ -46,4 +47,8 @@ urlpatterns = [
     # ---------------- Utilities ----------------
     path('invoice/<int:order_id>/', views.download_invoice, name='download_invoice'),
     path('upload-products/', views.upload_products_csv, name='upload_products_csv'),
+
+    # ---------------- Background Jobs ----------------
+    path('jobs/<int:job_id>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:job_id>/status/', views.job_status, name='job_status'),
 ]
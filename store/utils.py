@@ -1,12 +1,5 @@
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
+from .mailer import ORDER_CONFIRMATION, build_message
 
 def send_order_confirmation_email(user, order):
-    subject = f"Order Confirmation - #{order.id}"
-    message = render_to_string("emails/order_confirmation.html", {
-        'user': user,
-        'order': order
-    })
-    email = EmailMessage(subject, message, to=[user.email])
-    email.content_subtype = "html"  # To send HTML email
-    email.send()
+    """Sends the confirmation straight away; checkout queues it through store.mailer instead."""
+    build_message(ORDER_CONFIRMATION, order, user=user).send()
\ No newline at end of file
@@ -1,19 +1,24 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.forms import UserCreationForm, PasswordResetForm
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.views.decorators.http import require_POST, require_safe
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, FileResponse, Http404
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 from django.template.loader import get_template
 from django.core.mail import send_mail
 from django.utils import timezone
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.db import transaction
+from asgiref.sync import sync_to_async
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Sum
+from django.templatetags.static import static
 from .forms import ReviewForm, AddressForm, ProfileForm, CSVUploadForm
 
 from xhtml2pdf import pisa
@@ -21,33 +26,66 @@ from io import BytesIO
 from decimal import Decimal
 from decimal import Decimal, ROUND_HALF_UP
 import csv
+import codecs
 import json
-import hmac
-import hashlib
-import razorpay
 import os
 import requests
 import logging
+import uuid
 
 from .models import (
     Product, CartItem, Address, Order, OrderItem, Wishlist,Profile,Category, Review,
-    Coupon, Shipment, ProductVariant
+    Coupon, Shipment, ProductVariant, Job
 )
+from .pagination import paginate_keyset, paginate_ranked, get_page_size
+from .search import search_product_ids
+from .reviews import review_feed
+from .product_page import get_product, product_fragments, in_wishlist
+from .facets import selected_facets, filter_products, build_facets
+from . import tasks, catalog_cache
+from .cart import add_item, update_quantities, parse_quantities, OutOfStock
+from .context_processors import get_cart_item_count
+from .checkout import (
+    CheckoutError, place_order, load_cart_lines, load_buy_now_line, order_total, record_payment,
+)
+from .invoices import current_invoice
+from . import webhooks
+from .payments import get_gateway, GatewayUnavailable, SignatureError
+from .http import serve_file, serve_media
 from .utils import send_order_confirmation_email
 
 # Initialize logger
-
-razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
 logger = logging.getLogger(__name__)
 
 # ------------- Home & Authentication Views -------------
 
+def _catalog_page(request, selected, query=None):
+    """
+    Returns one page of listed products narrowed by the `selected` facets:
+    newest first (from the catalog cache) when browsing, or by search
+    relevance when there is a query.
+    """
+    page_size = get_page_size(request)
+    cursor = request.GET.get('cursor')
+    if not query:
+        return catalog_cache.listing_page(selected, cursor, page_size)
+
+    # Facets narrow the ranked ids before paging, so every page is full.
+    products = filter_products(Product.objects.listed(), selected)
+    ids = search_product_ids(query, category_id=selected.get('category'), within=products)
+    page = paginate_ranked(ids, cursor, page_size)
+    found = products.in_bulk(page.object_list)
+    page.object_list = [found[pk] for pk in page.object_list if pk in found]
+    return page
+
 def home(request):
-    products = Product.objects.all()
     query = request.GET.get('q')
-    if query:
-        products = products.filter(name__icontains=query)
-    return render(request, 'store/home.html', {'products': products})
+    page = _catalog_page(request, {}, query)
+    return render(request, 'store/home.html', {
+        'products': page,
+        'page': page,
+        'query': query or '',
+    })
 
 def register(request):
     if request.method == 'POST':
@@ -100,74 +138,40 @@ def custom_password_reset_view(request):
 # ------------- Product Views -------------
 
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug)
-    in_wishlist = False
-    if request.user.is_authenticated:
-        in_wishlist = Wishlist.objects.filter(user=request.user, product=product).exists() if request.user.is_authenticated else False
-    variants = ProductVariant.objects.filter(product=product)
+    product = get_product(slug)
+    feed = review_feed(product.id, request.GET.get('rating'), request.GET.get('cursor'))
     return render(request, 'store/product_detail.html', {
         'product': product,
-        'in_wishlist': in_wishlist,
-        'variants': variants
+        'fragments': product_fragments(product),
+        'in_wishlist': in_wishlist(request.user, product),
+        'review_feed': feed,
+        'selected_rating': feed['rating'],
+        'review_form': ReviewForm(),
     })
 
+def product_reviews(request, slug):
+    """The product's review feed as JSON, a page at a time (?rating=, ?cursor=)."""
+    product = get_object_or_404(Product.objects.only('id'), slug=slug)
+    return JsonResponse(review_feed(product.id, request.GET.get('rating'), request.GET.get('cursor')))
+
 @login_required
 def upload_products_csv(request):
     if request.method == 'POST':
         form = CSVUploadForm(request.POST, request.FILES)
         if form.is_valid():
             csv_file = request.FILES['csv_file']
-            decoded = csv_file.read().decode('utf-8').splitlines()
-            reader = csv.DictReader(decoded)
-
-            if not reader.fieldnames or 'name' not in reader.fieldnames:
+            header = next(csv.reader(codecs.iterdecode(csv_file, 'utf-8-sig')), [])
+            if 'name' not in header:
                 messages.error(request, "Invalid CSV format. 'name' field is required.")
                 return redirect('upload_products_csv')
-
-            products = []
-            for row in reader:
-                category, _ = Category.objects.get_or_create(name=row.get('category', 'Uncategorized'))
-                base_slug = slugify(row['name'])
-                slug = base_slug
-                counter = 1
-                while Product.objects.filter(slug=slug).exists():
-                    slug = f"{base_slug}-{counter}"
-                    counter += 1
-
-                product = Product(
-                    name=row['name'],
-                    price = Decimal(row.get('price', '0').strip() or '0'),
-                    description=row.get('description', ''),
-                    category=category,
-                    stock=int(row.get('stock', 0)),
-                    is_available=row.get('is_available', '').lower() == 'true',
-                    slug=slug,
-                )
-
-                image_url = row.get('image', '').strip()
-                if image_url:
-                    try:
-                        response = requests.get(image_url, timeout=10)
-                        if response.status_code == 200 and 'image' in response.headers['Content-Type']:
-                            image_name = os.path.basename(image_url.split("?")[0])
-                            product.image.save(image_name, ContentFile(response.content), save=False)
-                        else:
-                            logger.error(f"Invalid image URL (non-image content): {image_url}")
-                            messages.warning(request, f"Invalid image URL for {row['name']}. Skipping image download.")
-                    except Exception as e:
-                        logger.error(f"Image download failed for {image_url}: {e}")
-                        messages.warning(request, f"Failed to download image for {row['name']}.")
-
-                products.append(product)
-
-            try:
-                Product.objects.bulk_create(products)
-                messages.success(request, "Products uploaded successfully.")
-            except Exception as e:
-                logger.error(f"Error while bulk creating products: {e}")
-                messages.error(request, "An error occurred while uploading products. Please try again.")
-
-            return redirect('home')
+            csv_file.seek(0)
+
+            path = default_storage.save(f"imports/{uuid.uuid4().hex}.csv", csv_file)
+            job = tasks.import_products_csv.delay(path)
+            job.user = request.user
+            job.save(update_fields=['user'])
+            messages.info(request, "Your product import has been queued.")
+            return redirect('job_detail', job_id=job.id)
     else:
         form = CSVUploadForm()
 
@@ -176,33 +180,54 @@ def upload_products_csv(request):
 
 def product_list(request):
     query = request.GET.get('q')
-    category_id = request.GET.get('category')
-
-    products = Product.objects.all()
-
-    if query:
-        products = products.filter(name__icontains=query)
-
-    if category_id:
-        products = products.filter(category_id=category_id)
-
-    categories = Category.objects.all()
+    selected = selected_facets(request.GET)
+    page = _catalog_page(request, selected, query)
+    categories = catalog_cache.categories()
     return render(request, 'store/product_list.html', {
-        'products': products,
+        'products': page,
+        'page': page,
+        'query': query or '',
+        'selected_category': selected.get('category', ''),
+        'selected_facets': selected,
+        'facets': build_facets(selected, categories, catalog_cache.tag_names()),
         'categories': categories
     })
 
 # ------------- Cart Views -------------
 
+def _wants_json(request):
+    return (
+        request.content_type == 'application/json'
+        or 'application/json' in request.headers.get('Accept', '')
+    )
+
 @login_required
 @require_POST
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    quantity = int(request.POST.get('quantity', 1))
-    cart_item, created = CartItem.objects.get_or_create(user=request.user, product=product)
-    if not created:
-        cart_item.quantity += quantity
-    cart_item.save()
+    try:
+        quantity = int(request.POST.get('quantity', 1))
+    except (TypeError, ValueError):
+        quantity = 1
+
+    try:
+        new_quantity = add_item(request.user, product_id, quantity)
+    except Product.DoesNotExist:
+        raise Http404("Product not found")
+    except OutOfStock as e:
+        if _wants_json(request):
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=409)
+        messages.error(request, str(e))
+        referer = request.META.get('HTTP_REFERER')
+        if referer and url_has_allowed_host_and_scheme(referer, allowed_hosts={request.get_host()}):
+            return redirect(referer)
+        return redirect('cart')
+
+    if _wants_json(request):
+        return JsonResponse({
+            'status': 'ok',
+            'quantity': new_quantity,
+            'cart_item_count': get_cart_item_count(request.user.pk),
+        })
     messages.success(request, "Item added to cart.")
     return redirect('cart')
 
@@ -219,12 +244,24 @@ def cart_view(request):
 @login_required
 @require_POST
 def update_cart(request):
-    cart_items = CartItem.objects.filter(user=request.user)
-    for item in cart_items:
-        quantity = int(request.POST.get(f'quantity_{item.id}', 1))
-        item.quantity = max(1, quantity)
-        item.save()
-    messages.info(request, "Cart updated.")
+    if request.content_type == 'application/json':
+        try:
+            submitted = json.loads(request.body).get('quantities', {})
+            data = {f'quantity_{item_id}': quantity for item_id, quantity in submitted.items()}
+        except (ValueError, AttributeError):
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    else:
+        data = request.POST
+
+    delta = update_quantities(request.user, parse_quantities(data))
+
+    if _wants_json(request):
+        return JsonResponse({'status': 'error' if delta['errors'] else 'ok', **delta})
+
+    for error in delta['errors'].values():
+        messages.error(request, error)
+    if delta['updated'] or delta['removed']:
+        messages.info(request, "Cart updated.")
     return redirect('cart')
 
 @login_required
@@ -248,74 +285,33 @@ def buy_now(request, product_id):
 @login_required
 def checkout_view(request):
     buy_now_item = request.session.get('buy_now_item')
-    cart_items = []
-    total = Decimal('0.00')
-
     if buy_now_item:
         # "Buy Now" flow
-        product = get_object_or_404(Product, id=buy_now_item['product_id'])
-        quantity = int(buy_now_item['quantity'])
-        price = Decimal(str(buy_now_item['price']))
-        total = price * quantity
-        cart_items = [{
-            'product': product,
-            'quantity': quantity,
-            'price': price
-        }]
+        lines = load_buy_now_line(buy_now_item)
     else:
         # Normal cart checkout
-        cart_items = CartItem.objects.filter(user=request.user)
-        total = sum(
-            Decimal(str(item.product.price)) * item.quantity for item in cart_items
-        ) or Decimal('0.00')
-
-    # Round total to 2 decimal places
-    total = total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        lines = load_cart_lines(request.user)
+    total = order_total(lines)
 
     form = AddressForm(request.POST or None)
 
     if request.method == 'POST' and form.is_valid():
-        if not cart_items:
+        if not lines:
             messages.error(request, "Your cart is empty.")
             return redirect('cart')
 
-        if total < Decimal('1.00'):
-            messages.error(request, "Minimum order amount must be ₹1.00.")
+        try:
+            order = place_order(request.user, form.save(commit=False), lines, clear_cart=not buy_now_item)
+        except CheckoutError as e:
+            messages.error(request, str(e))
             return render(request, 'store/checkout.html', {
-                'items': cart_items,
+                'items': lines,
                 'total': total,
                 'form': form
             })
 
-        # Save shipping address
-        address = form.save(commit=False)
-        address.user = request.user
-        address.address_type = 'shipping'
-        address.save()
-
-        # Create new order
-        order = Order.objects.create(
-            user=request.user,
-            shipping_address=address,
-            total_price=total
-        )
-
-        # Create order items
         if buy_now_item:
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity
-            )
             del request.session['buy_now_item']  # Clear buy now session
-        else:
-            for item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    quantity=item.quantity
-                )
-            CartItem.objects.filter(user=request.user).delete()  # Clear cart
 
         # Save order ID to session for use in payment
         request.session['order_id'] = order.id
@@ -323,22 +319,52 @@ def checkout_view(request):
         return redirect('payment_initiate')
 
     return render(request, 'store/checkout.html', {
-        'items': cart_items,
+        'items': lines,
         'total': total,
         'form': form
     })
 
 # ------------- Order Views -------------
 
+def _order_history(user, summary=False):
+    """
+    The user's orders with only the columns my_orders shows. The full view
+    prefetches items and their product images (two extra queries per page);
+    the summary view gets an item count and a thumbnail per order from
+    annotations on the same query.
+    """
+    orders = Order.objects.filter(user=user).only('id', 'status', 'total_price', 'created_at')
+    if summary:
+        first_item = OrderItem.objects.filter(order=OuterRef('pk')).order_by('id')
+        return orders.annotate(
+            item_count=Count('items'),
+            unit_count=Sum('items__quantity'),
+            thumb_uploaded=Subquery(first_item.values('product__uploaded_image')[:1]),
+            thumb_image=Subquery(first_item.values('product__image')[:1]),
+        )
+    return orders.prefetch_related(
+        Prefetch(
+            'items',
+            queryset=OrderItem.objects.only('id', 'order_id', 'product_id', 'product_name', 'quantity').order_by('id'),
+        ),
+        Prefetch('items__product', queryset=Product.objects.only('id', 'slug', 'uploaded_image', 'image')),
+    )
+
+
 @login_required
 def my_orders(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'store/my_orders.html', {'orders': orders})
+    summary = request.GET.get('view') == 'summary'
+    page = paginate_keyset(_order_history(request.user, summary), request.GET.get('cursor'), get_page_size(request))
+    if summary:
+        for order in page:
+            name = order.thumb_uploaded or order.thumb_image
+            order.thumbnail_url = default_storage.url(name) if name else static('store/images/default_product.png')
+    return render(request, 'store/my_orders.html', {'orders': page, 'page': page, 'summary': summary})
 
 @login_required
 def order_detail(request, order_id):
     order = get_object_or_404(Order, id=order_id, user=request.user)
-    items = order.items.select_related('product')
+    items = order.items.all()
     shipment = Shipment.objects.filter(order=order).first()
     return render(request, 'store/order_detail.html', {
         'order': order,
@@ -349,13 +375,28 @@ def order_detail(request, order_id):
 
 @login_required
 def download_invoice(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    template = get_template('store/invoice_template.html')
-    html = template.render({'order': order, 'user': request.user})
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="invoice_{order.id}.pdf"'
-    pisa.CreatePDF(html, dest=response)
-    return response
+    order = get_object_or_404(Order.objects.select_related('user'), id=order_id, user=request.user)
+    invoice = current_invoice(order)
+    if invoice:
+        return serve_file(request, default_storage, invoice.path, etag=invoice.digest,
+                          content_type='application/pdf', filename=f"invoice_{order.id}.pdf",
+                          as_attachment=True, last_modified=invoice.rendered_at)
+
+    # Rendered by a worker; the job page redirects back here once the file exists.
+    job = Job.objects.filter(
+        task=tasks.render_invoice_pdf.task_name, args=[order.id], status__in=['queued', 'running']
+    ).first()
+    if job is None:
+        job = tasks.render_invoice_pdf.delay(order.id)
+        job.user = request.user
+        job.save(update_fields=['user'])
+    return redirect('job_detail', job_id=job.id)
+
+# ------------- Media -------------
+
+@require_safe
+def media(request, path):
+    return serve_media(request, default_storage, path)
 
 # ------------- Profile Views -------------
 @login_required
@@ -431,22 +472,24 @@ def apply_coupon(request):
 
 # ------------------- Initiate Payment View -------------------
 @login_required
-def payment_initiate(request):
+async def payment_initiate(request):
+    """
+    Async so that waiting on Razorpay's order API doesn't hold a worker;
+    under ASGI other requests are served meanwhile.
+    """
     try:
-        order_id = request.session.get('order_id')
+        order_id = await request.session.aget('order_id')
         if not order_id:
             messages.error(request, "No active order found. Please try checking out again.")
             return redirect('cart')
 
-        order = get_object_or_404(Order, id=order_id, user=request.user, is_paid=False)
+        user = await request.auser()
+        order = await aget_object_or_404(Order, id=order_id, user=user, is_paid=False)
 
-        if not order.items.exists():
+        if not await order.items.aexists():
             messages.error(request, "Your order has no items.")
             return redirect('cart')
 
-        # Ensure the total price is accurate
-        order.update_total_price()
-
         # Convert amount to paise
         amount = int((order.total_price * Decimal('100')).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
 
@@ -455,26 +498,32 @@ def payment_initiate(request):
             messages.error(request, "Order total must be at least ₹1.00 to proceed with payment.")
             return redirect('cart')
 
-        # Create Razorpay order
-        razorpay_order = razorpay_client.order.create({
-            "amount": amount,
-            "currency": "INR",
-            "payment_capture": '1'
-        })
+        gateway = get_gateway()
 
-        # Save Razorpay order ID to the Order model
-        order.razorpay_order_id = razorpay_order['id']
-        order.save()
+        # The total is a snapshot, so a Razorpay order created on an earlier
+        # visit is still good; only create one the first time.
+        if not order.razorpay_order_id:
+            try:
+                razorpay_order = await gateway.acreate_order(amount, currency="INR", receipt=f"order_{order.id}")
+            except GatewayUnavailable as e:
+                logger.error(f"Payment gateway unavailable for Order {order.id}: {e}")
+                messages.error(request, "Payments are temporarily unavailable. Please try again in a minute.")
+                return redirect('cart')
+
+            # Save Razorpay order ID to the Order model
+            order.razorpay_order_id = razorpay_order['id']
+            await order.asave(update_fields=['razorpay_order_id', 'updated_at'])
 
         context = {
-            "razorpay_order_id": razorpay_order['id'],
-            "razorpay_key": settings.RAZORPAY_KEY_ID,
+            "razorpay_order_id": order.razorpay_order_id,
+            "razorpay_key": gateway.key_id,
             "amount": amount,  # in paise for Razorpay
             "amount_rupees": float(order.total_price),  # for display
-            "user": request.user
+            "user": user
         }
 
-        return render(request, 'store/payment.html', context)
+        # Rendering runs the (sync) context processors, so do it off the loop.
+        return await sync_to_async(render)(request, 'store/payment.html', context)
 
     except Exception as e:
         logger.error(f"Error initiating payment: {e}")
@@ -483,7 +532,7 @@ def payment_initiate(request):
 
 # ------------------- Payment Handler View -------------------
 @csrf_exempt
-def payment_handler(request):
+async def payment_handler(request):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
@@ -497,35 +546,23 @@ def payment_handler(request):
                 logger.error("Missing Razorpay parameters.")
                 return JsonResponse({'status': 'error', 'message': 'Incomplete payment details.'}, status=400)
 
-            params_dict = {
-                'razorpay_order_id': razorpay_order_id,
-                'razorpay_payment_id': razorpay_payment_id,
-                'razorpay_signature': razorpay_signature
-            }
-
-            razorpay_client.utility.verify_payment_signature(params_dict)
+            get_gateway().verify_payment_signature(razorpay_order_id, razorpay_payment_id, razorpay_signature)
 
-            order = Order.objects.filter(razorpay_order_id=razorpay_order_id).first()
+            # ✅ Mark as paid, confirm stock, clear the cart, queue email + invoice.
+            # Transactions are sync-only, so this one step runs in a thread.
+            order, completed = await sync_to_async(record_payment)(
+                razorpay_order_id, razorpay_payment_id, razorpay_signature
+            )
             if not order:
                 logger.error(f"No order found with Razorpay Order ID: {razorpay_order_id}")
                 return JsonResponse({'status': 'error', 'message': 'Order not found.'}, status=404)
 
-            if order.is_paid:
+            if not completed:
                 return JsonResponse({'status': 'success', 'message': 'Order already marked as paid.'})
 
-            # ✅ Mark as paid
-            order.is_paid = True
-            order.status = 'paid'
-            order.razorpay_payment_id = razorpay_payment_id
-            order.razorpay_signature = razorpay_signature
-            order.save()
-
-            # ✅ Clear user's cart
-            CartItem.objects.filter(user=order.user).delete()
-
             return JsonResponse({'status': 'success'})
 
-        except razorpay.errors.SignatureVerificationError as e:
+        except SignatureError as e:
             logger.error(f"Signature verification failed: {e}")
             return JsonResponse({'status': 'error', 'message': 'Invalid signature'}, status=400)
 
@@ -546,50 +583,57 @@ def payment_success(request):
 
 # ------------------- Razorpay Webhook -------------------
 @csrf_exempt
-def razorpay_webhook(request):
+async def razorpay_webhook(request):
+    """
+    Verifies the signature and records the event, then acknowledges at once.
+    Applying it to the order is left to the webhook processor job, so slow
+    order writes never make Razorpay time out and retry; retries of an
+    event already recorded are acknowledged without being stored again.
+    """
     if request.method == 'POST':
         data = request.body
+        if not webhooks.verify_razorpay_signature(data, request.headers.get('X-Razorpay-Signature')):
+            logger.warning("Invalid webhook signature")
+            return JsonResponse({'status': 'error', 'message': 'Invalid signature'}, status=400)
         try:
-            signature = request.headers.get('X-Razorpay-Signature')
-            secret = settings.RAZORPAY_WEBHOOK_SECRET  # Ensure this is set in your settings
-
-            expected_signature = hmac.new(
-                key=bytes(secret, 'utf-8'),
-                msg=data,
-                digestmod=hashlib.sha256
-            ).hexdigest()
-
-            if hmac.compare_digest(expected_signature, signature):
-                payload = json.loads(data)
-                event = payload.get('event')
-
-                if event == 'payment.captured':
-                    razorpay_order_id = payload['payload']['payment']['entity']['order_id']
-                    payment_id = payload['payload']['payment']['entity']['id']
-
-                    order = Order.objects.filter(razorpay_order_id=razorpay_order_id).first()
-                    if order and not order.is_paid:
-                        order.is_paid = True
-                        order.status = 'paid'
-                        order.razorpay_payment_id = payment_id
-                        order.save()
-                        CartItem.objects.filter(user=order.user).delete()
-
-                        logger.info(f"Payment captured via webhook for Order {order.id}")
-                    return JsonResponse({'status': 'ok'})
-                else:
-                    logger.info(f"Ignored event: {event}")
-                    return JsonResponse({'status': 'ignored', 'event': event})
-            else:
-                logger.warning("Invalid webhook signature")
-                return JsonResponse({'status': 'error', 'message': 'Invalid signature'}, status=400)
+            payload = json.loads(data)
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
 
-        except Exception as e:
-            logger.error(f"Webhook error: {e}")
-            return JsonResponse({'status': 'error', 'message': 'Webhook processing failed'}, status=500)
+        event_id = webhooks.razorpay_event_id(request.headers, data)
+        if not await webhooks.arecord_event(webhooks.RAZORPAY, event_id, payload):
+            return JsonResponse({'status': 'duplicate'})
+        return JsonResponse({'status': 'ok'})
     return HttpResponseBadRequest("Invalid request method")
 
 
+# ------------- Background Jobs -------------
+
+def _get_user_job(request, job_id):
+    job = get_object_or_404(Job, id=job_id)
+    if job.user_id != request.user.id and not request.user.is_staff:
+        raise Http404("Job not found")
+    return job
+
+@login_required
+def job_detail(request, job_id):
+    job = _get_user_job(request, job_id)
+    return render(request, 'store/job_status.html', {'job': job})
+
+@login_required
+def job_status(request, job_id):
+    job = _get_user_job(request, job_id)
+    return JsonResponse({
+        'id': job.id,
+        'task': job.task,
+        'status': job.status,
+        'attempts': job.attempts,
+        'finished': job.is_finished,
+        'result': job.result if job.status == 'succeeded' else None,
+        'error': 'The job failed. Please try again.' if job.status == 'failed' else None,
+    })
+
+
 # ------------- Admin Utility -------------
 
 @login_required
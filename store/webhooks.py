@@ -0,0 +1,249 @@
+import hashlib
+import hmac
+import logging
+import traceback
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job, Order, PaymentWebhook
+from .checkout import complete_payment
+from .jobs import enqueue, retry_delay
+
+logger = logging.getLogger(__name__)
+
+RAZORPAY = 'razorpay'
+PROCESS_TASK = 'store.process_payment_webhooks'
+
+
+class Deferred(Exception):
+    """The event can't be applied yet (e.g. a refund seen before its capture)."""
+
+
+class OrderNotFound(Exception):
+    """The event refers to no order of ours; it is recorded as ignored."""
+
+
+# ---------------- Ingestion ----------------
+
+def verify_razorpay_signature(body, signature, secret=None):
+    secret = settings.RAZORPAY_WEBHOOK_SECRET if secret is None else secret
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def razorpay_event_id(headers, body):
+    # Razorpay sends the same X-Razorpay-Event-Id on every retry of an event.
+    return headers.get('X-Razorpay-Event-Id') or 'sha256:' + hashlib.sha256(body).hexdigest()
+
+
+def _occurred_at(payload):
+    created_at = payload.get('created_at')
+    if isinstance(created_at, (int, float)):
+        return datetime.fromtimestamp(created_at, tz=dt_timezone.utc)
+    return None
+
+
+def _new_event(gateway, event_id, payload):
+    return PaymentWebhook(
+        gateway=gateway,
+        event_id=event_id,
+        event_type=str(payload.get('event', ''))[:100],
+        payload=payload,
+        occurred_at=_occurred_at(payload),
+    )
+
+
+def record_event(gateway, event_id, payload):
+    """
+    Stores a verified event once per event ID. Returns False for a repeat
+    delivery, which the caller should still acknowledge.
+    """
+    try:
+        with transaction.atomic():
+            _new_event(gateway, event_id, payload).save()
+    except IntegrityError:
+        return False
+    schedule_processing()
+    return True
+
+
+async def arecord_event(gateway, event_id, payload):
+    """record_event for async views, on the async ORM."""
+    try:
+        # A single INSERT in autocommit mode: a duplicate leaves no broken
+        # transaction behind, so no savepoint is needed.
+        await _new_event(gateway, event_id, payload).asave()
+    except IntegrityError:
+        return False
+    if not await Job.objects.filter(task=PROCESS_TASK, status='queued').aexists():
+        await sync_to_async(enqueue)(PROCESS_TASK, priority=Job.PRIORITY_HIGH)
+    return True
+
+
+def schedule_processing(delay=0):
+    # One queued run drains every pending event, so don't stack them up.
+    if not Job.objects.filter(task=PROCESS_TASK, status='queued').exists():
+        enqueue(PROCESS_TASK, priority=Job.PRIORITY_HIGH, delay=delay)
+
+
+# ---------------- Processing ----------------
+
+def _entity(event, name):
+    return ((event.payload.get('payload') or {}).get(name) or {}).get('entity') or {}
+
+
+def _payment_captured(event, order):
+    if order is None:
+        raise OrderNotFound("No order for this payment.")
+    if not complete_payment(order, _entity(event, 'payment').get('id')):
+        return 'ignored'
+    logger.info(f"Payment captured via webhook for Order {order.id}")
+
+
+def _payment_failed(event, order):
+    if order is None:
+        raise OrderNotFound("No order for this payment.")
+    if order.is_paid:
+        return 'ignored'
+    # Razorpay sends payment.failed for every failed attempt, and the buyer
+    # can still retry on the same order, so its stock stays held. Holds go
+    # when the order is cancelled or by the expiry sweep.
+    logger.info(f"Payment attempt failed for Order {order.id}")
+
+
+def _refund(event, order):
+    if order is None:
+        raise OrderNotFound("No order for this refund.")
+    if event.event_type != 'refund.processed':
+        return 'ignored'
+    if not order.is_paid:
+        raise Deferred("Refund seen before the payment was captured.")
+    payment = _entity(event, 'payment')
+    refunded = payment.get('amount_refunded', _entity(event, 'refund').get('amount', 0))
+    if Decimal(refunded) >= order.total_price * 100 and order.status != 'refunded':
+        order.status = 'refunded'
+        order.save(update_fields=['status', 'updated_at'])
+        logger.info(f"Order {order.id} fully refunded")
+
+
+def _handler_for(event_type):
+    if event_type == 'payment.captured':
+        return _payment_captured
+    if event_type == 'payment.failed':
+        return _payment_failed
+    if event_type.startswith('refund.'):
+        return _refund
+    return None
+
+
+def _claim(events, now):
+    claimed = []
+    for event in events:
+        if PaymentWebhook.objects.filter(id=event.id, status='pending').update(status='processing', claimed_at=now):
+            claimed.append(event)
+    return claimed
+
+
+def _order_ids_for(events):
+    """
+    Resolves the orders a batch of events refers to in one query, as
+    {razorpay order ID: pk} and {payment ID: pk}.
+    """
+    order_ids, payment_ids = set(), set()
+    for event in events:
+        payment = _entity(event, 'payment')
+        if payment.get('order_id'):
+            order_ids.add(payment['order_id'])
+        payment_id = payment.get('id') or _entity(event, 'refund').get('payment_id')
+        if payment_id:
+            payment_ids.add(payment_id)
+    by_order_id, by_payment_id = {}, {}
+    if order_ids or payment_ids:
+        orders = Order.objects.filter(
+            Q(razorpay_order_id__in=order_ids) | Q(razorpay_payment_id__in=payment_ids)
+        ).values_list('id', 'razorpay_order_id', 'razorpay_payment_id')
+        for pk, razorpay_order_id, razorpay_payment_id in orders:
+            by_order_id[razorpay_order_id] = pk
+            if razorpay_payment_id:
+                by_payment_id[razorpay_payment_id] = pk
+    return by_order_id, by_payment_id
+
+
+def _order_pk_for(event, by_order_id, by_payment_id):
+    payment = _entity(event, 'payment')
+    pk = by_order_id.get(payment.get('order_id'))
+    if pk is None:
+        pk = by_payment_id.get(payment.get('id') or _entity(event, 'refund').get('payment_id'))
+    return pk
+
+
+def _apply(event, order_pk, max_attempts):
+    handler = _handler_for(event.event_type)
+    event.attempts += 1
+    event.processed_at = timezone.now()
+    try:
+        if handler is None:
+            event.status = 'ignored'
+        else:
+            with transaction.atomic():
+                # Lock the order so this serializes with payment_handler.
+                order = Order.objects.select_for_update().filter(pk=order_pk).first() if order_pk else None
+                event.status = handler(event, order) or 'processed'
+        event.last_error = ''
+    except OrderNotFound as e:
+        event.status, event.last_error = 'ignored', str(e)
+    except Deferred as e:
+        event.status = 'pending' if event.attempts < max_attempts else 'failed'
+        event.last_error = str(e)
+    except Exception:
+        event.status = 'pending' if event.attempts < max_attempts else 'failed'
+        event.last_error = traceback.format_exc()
+        logger.exception(f"Webhook {event.event_id} ({event.event_type}) failed")
+    event.save(update_fields=['status', 'attempts', 'processed_at', 'last_error'])
+
+
+def requeue_stale_events(timeout=None):
+    timeout = timeout or getattr(settings, 'STORE_JOB_LOCK_TIMEOUT', 600)
+    return PaymentWebhook.objects.filter(
+        status='processing', claimed_at__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(status='pending')
+
+
+def process_pending(batch_size=100, max_attempts=5):
+    """
+    Applies pending events in the order the gateway raised them, a batch at
+    a time. Each event is claimed before it is applied, so concurrent
+    processors never apply the same event twice, and each is applied in its
+    own transaction so one bad event doesn't hold up the rest. Events that
+    can't be applied yet are retried on a later run.
+    """
+    requeue_stale_events()
+    started = timezone.now()
+    counts = {'processed': 0, 'ignored': 0, 'failed': 0, 'pending': 0}
+    while True:
+        # Events deferred during this run have claimed_at >= started and
+        # wait for the next one.
+        batch = list(
+            PaymentWebhook.objects.filter(status='pending')
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=started))
+            .order_by('occurred_at', 'id')[:batch_size]
+        )
+        if not batch:
+            break
+        events = _claim(batch, timezone.now())
+        by_order_id, by_payment_id = _order_ids_for(events)
+        for event in events:
+            _apply(event, _order_pk_for(event, by_order_id, by_payment_id), max_attempts)
+            counts[event.status] += 1
+
+    if counts['pending']:
+        schedule_processing(delay=retry_delay(1))
+    return counts